@@ -0,0 +1,179 @@
+import math
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from groovybytes import records as entity_records
+
+
+class NumberStats:
+    __slots__ = ("count", "sum", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, values):
+        if len(values):
+            self.count += len(values)
+            self.sum += float(values.sum())
+            self.min = min(self.min, float(values.min()))
+            self.max = max(self.max, float(values.max()))
+
+    def to_dict(self):
+        if not self.count:
+            return {"count": 0}
+        return {"count": self.count, "sum": self.sum, "min": self.min, "max": self.max,
+                "mean": self.sum / self.count}
+
+
+class EntityStats:
+    def __init__(self):
+        self.rows = 0
+        # column -> non-null values seen
+        self.present = {}
+        # column -> NumberStats, for columns that held numbers
+        self.numbers = {}
+        # bucket start -> [rows, {column: NumberStats}], oldest first
+        self.buckets = OrderedDict()
+        # (first row, arrival time, {column: float64 values}) kept for downsampling
+        self.chunks = deque()
+        self.kept_rows = 0
+
+
+class Aggregates:
+    """Running count/sum/min/max of the formatted records, by entity type, column and time bucket.
+
+    Batches are folded in as they arrive, so a summary costs the same for a
+    thousand rows as for a million. Numeric columns are also kept as float
+    arrays (up to max_points rows per entity) for series(), which downsamples
+    them to the number of points a chart can draw.
+    """
+
+    def __init__(self, bucket_seconds=60, max_buckets=1440, max_points=2000000):
+        self.bucket_seconds = bucket_seconds
+        self.max_buckets = max_buckets
+        self.max_points = max_points
+        self.lock = threading.Lock()
+        self.entities = {}
+
+    def add(self, records, received_at):
+        bucket = received_at // self.bucket_seconds * self.bucket_seconds
+        for entity, frame in entity_records.entity_frames(records).items():
+            present = frame.count()
+            numbers = {}
+            for column in frame.columns:
+                values = entity_records.numbers(frame[column])
+                if values is not None:
+                    numbers[str(column)] = values
+
+            with self.lock:
+                stats = self.entities.get(entity)
+                if stats is None:
+                    stats = self.entities[entity] = EntityStats()
+                first_row = stats.rows
+                stats.rows += len(frame)
+                for column, count in present.items():
+                    stats.present[str(column)] = stats.present.get(str(column), 0) + int(count)
+
+                entry = stats.buckets.get(bucket)
+                if entry is None:
+                    entry = stats.buckets[bucket] = [0, {}]
+                    while len(stats.buckets) > self.max_buckets:
+                        stats.buckets.popitem(last=False)
+                entry[0] += len(frame)
+                for column, values in numbers.items():
+                    values = values[~np.isnan(values)]
+                    stats.numbers.setdefault(column, NumberStats()).add(values)
+                    entry[1].setdefault(column, NumberStats()).add(values)
+
+                if numbers:
+                    stats.chunks.append((first_row, received_at, numbers))
+                    stats.kept_rows += len(frame)
+                    while stats.kept_rows - len(next(iter(stats.chunks[0][2].values()))) >= self.max_points:
+                        _, _, dropped = stats.chunks.popleft()
+                        stats.kept_rows -= len(next(iter(dropped.values())))
+
+    def summary(self):
+        with self.lock:
+            return {entity: {
+                "rows": stats.rows,
+                "columns": {column: {"present": count, **(stats.numbers[column].to_dict()
+                                                            if column in stats.numbers else {})}
+                            for column, count in stats.present.items()},
+            } for entity, stats in self.entities.items()}
+
+    def timeline(self, entity, column=None):
+        """Rows per time bucket, and the stats of column in each bucket when given."""
+        with self.lock:
+            stats = self.entities.get(entity)
+            if stats is None:
+                return None
+            buckets = []
+            for start, (rows, numbers) in stats.buckets.items():
+                bucket = {"start": start, "rows": rows}
+                if column is not None and column in numbers:
+                    bucket.update(numbers[column].to_dict())
+                buckets.append(bucket)
+            return buckets
+
+    def series(self, entity, column, points=1000, x="row"):
+        """Up to points (x, y) pairs of a numeric column, downsampled with LTTB.
+
+        x is the row number within the entity type, or the arrival time.
+        Returns None for an unknown entity or a column that is not numeric.
+        """
+        with self.lock:
+            stats = self.entities.get(entity)
+            if stats is None or column not in stats.numbers:
+                return None
+            chunks = [(first_row, received_at, numbers.get(column), len(next(iter(numbers.values()))))
+                      for first_row, received_at, numbers in stats.chunks]
+
+        xs, ys = [], []
+        for first_row, received_at, values, rows in chunks:
+            if values is None:
+                continue
+            keep = ~np.isnan(values)
+            if x == "time":
+                xs.append(np.full(int(keep.sum()), received_at, dtype="float64"))
+            else:
+                xs.append(np.arange(first_row, first_row + rows, dtype="float64")[keep])
+            ys.append(values[keep])
+        if not xs:
+            return {"x": [], "y": [], "total": 0}
+        xs = np.concatenate(xs)
+        ys = np.concatenate(ys)
+        sampled_x, sampled_y = lttb(xs, ys, points)
+        return {"x": sampled_x.tolist(), "y": sampled_y.tolist(), "total": len(xs)}
+
+
+def lttb(x, y, points):
+    """Largest-Triangle-Three-Buckets: the points of (x, y) that keep the shape of the line.
+
+    x must be sorted. The first and last points are always kept.
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return x, y
+
+    # Bucket edges for the n - 2 points between the first and the last.
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    selected = np.empty(points, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        # The next point is stood in for by the average of the following bucket.
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+        areas = np.abs((x[previous] - average_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (average_y - y[previous]))
+        previous = start + int(areas.argmax())
+        selected[i + 1] = previous
+    return x[selected], y[selected]
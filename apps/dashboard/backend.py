@@ -1,24 +1,216 @@
 import json
 import threading
-from flask import Flask, request, jsonify
-import queue
+import time
+import uuid
+from flask import Flask, Response, request, jsonify
+import pandas as pd
 import requests
+from groovybytes import wire, metrics
+from ring_buffer import RingBuffer
+from aggregates import Aggregates
+from record_store import RecordStore, SOURCE_FILE, UPLOAD_ID, INGESTED_AT, timestamp
+
+BUFFER_BATCHES = 10000
+BUFFER_BYTES = 256 * 1024 * 1024
+MAX_WAIT_SECONDS = 30  # longest a GET with ?wait= is held open
+STREAM_HEARTBEAT_SECONDS = 15
+BUCKET_SECONDS = 60
+MAX_BUCKETS = 1440  # a day of one-minute buckets per entity type
+SERIES_ROWS = 2000000  # numeric rows per entity type kept for downsampling
+MAX_SERIES_POINTS = 10000
+STORE_DIR = "record_store"
+STORE_COMPACT_SEGMENTS = 16  # small files per partition that are merged into one
+STORE_SEGMENT_ROWS = 100000  # files with fewer rows count as small
+QUERY_LIMIT = 1000  # rows a query returns when it does not say
+MAX_QUERY_ROWS = 100000
+# Names this run of the backend. Ring buffer offsets start over at every run,
+# so an offset only identifies a batch together with the run it was handed out by.
+RUN_ID = uuid.uuid4().hex
 
 app = Flask(__name__)
-data_queue = queue.Queue()  # A thread-safe queue
+app.json.sort_keys = False  # keep records in entity field order
+metrics.set_service("dashboard")
+metrics.register_endpoint(app)
+# Every reader gets every batch, from its own cursor.
+buffer = RingBuffer(max_batches=BUFFER_BATCHES, max_bytes=BUFFER_BYTES)
+# Summaries are kept up to date as batches arrive, so the dashboard never pulls raw rows to draw them.
+aggregates = Aggregates(bucket_seconds=BUCKET_SECONDS, max_buckets=MAX_BUCKETS, max_points=SERIES_ROWS)
+# Every formatted record is also kept on disk, for queries over the whole history.
+store = RecordStore(STORE_DIR, compact_segments=STORE_COMPACT_SEGMENTS, segment_rows=STORE_SEGMENT_ROWS)
+# When the batches being stored were received; they are not in the ring buffer yet.
+receiving = []
+receiving_lock = threading.Lock()
 
 @app.route('/dashboard_api/data', methods=['POST'])
 def receive_data():
-    data = json.loads(request.json)
-    data_queue.put(data)
-    return jsonify({"message": "Data processing started"}), 200
+    try:
+        with metrics.timed("receive"):
+            data = wire.decode(request.get_data(), request.content_type, request.content_encoding)
+    except ValueError as e:
+        return jsonify({"message": f"Could not decode data: {e}"}), 400
+    metrics.count("receive", len(data))
+    # Aggregated first: a batch's offset is the dataset version, and a version
+    # must never be handed out before the summaries include its batch.
+    with receiving_lock:
+        received_at = time.time()
+        receiving.append(received_at)
+    try:
+        with metrics.timed("store", items=len(data)):
+            store.append(data, received_at)
+        with metrics.timed("aggregate"):
+            aggregates.add(data, received_at)
+        offset = buffer.append(data, received_at)
+    finally:
+        with receiving_lock:
+            receiving.remove(received_at)
+    return jsonify({"message": "Data processing started", "offset": offset}), 200
 
 @app.route('/dashboard_api/data', methods=['GET'])
 def get_data():
-    if not data_queue.empty():
-        data = data_queue.get()
-        return jsonify(data), 200
-    return jsonify({"message": "No data available"}), 404
+    # Without a cursor: the newest batch, as a plain list of records.
+    if "since" not in request.args:
+        latest = buffer.latest()
+        if latest is None:
+            return jsonify({"message": "No data available"}), 404
+        return Response(latest[2], mimetype="application/json")
+
+    since = request.args.get("since", 0, type=int)
+    restarted = request.args.get("run", RUN_ID) != RUN_ID
+    if restarted:
+        # The cursor is from an earlier run: its offsets mean nothing now.
+        since = 0
+    wait = min(request.args.get("wait", 0, type=float), MAX_WAIT_SECONDS)
+    batches, missed = buffer.read(since, limit=request.args.get("limit", type=int), timeout=wait)
+    cursor = batches[-1][0] if batches else since
+    # The batches were serialized when they arrived; they are only joined here.
+    # Every batch received before stored_until is in the record store, so a
+    # reader that missed batches can read them back from there.
+    body = "".join([
+        f'{{"run":"{RUN_ID}","cursor":{cursor},"missed":{json.dumps(missed or restarted)},'
+        f'"stored_until":{stored_until()},"batches":[',
+        ",".join(f'{{"offset":{offset},"rows":{rows},"received_at":{received_at},"records":{records}}}'
+                 for offset, rows, records, received_at in batches),
+        "]}",
+    ])
+    return Response(body, mimetype="application/json")
+
+@app.route('/dashboard_api/stream')
+def stream_data():
+    # Server-Sent Events; a reconnecting EventSource resumes from Last-Event-ID.
+    since = request.headers.get("Last-Event-ID", type=int)
+    if since is None:
+        since = request.args.get("since", 0, type=int)
+
+    def events(since):
+        while True:
+            batches, missed = buffer.read(since, timeout=STREAM_HEARTBEAT_SECONDS)
+            if missed:
+                yield "event: missed\ndata: {}\n\n"
+            if not batches:
+                yield ": keep-alive\n\n"
+            for offset, rows, records, _ in batches:
+                yield f"id: {offset}\nevent: batch\ndata: {records}\n\n"
+                since = offset
+
+    return Response(events(since), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def stored_until():
+    """A time before which every batch received is in the record store and the ring buffer."""
+    with receiving_lock:
+        return min(receiving, default=time.time())
+
+def dataset_version():
+    # Offsets only grow within a run, so the run and its newest offset name the data
+    # seen so far; a restarted backend never hands out a version from before.
+    return f"{RUN_ID}:{buffer.stats()['last_offset']}"
+
+def versioned(response, version):
+    # Clients send the version back in If-None-Match and get a 304 while nothing new arrived.
+    response.set_etag(version)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+@app.route('/dashboard_api/version')
+def get_version():
+    return jsonify({"version": dataset_version()})
+
+@app.route('/dashboard_api/summary')
+def get_summary():
+    version = dataset_version()
+    return versioned(jsonify({"version": version, "entities": aggregates.summary()}), version)
+
+@app.route('/dashboard_api/timeline')
+def get_timeline():
+    version = dataset_version()
+    entity = request.args.get("entity")
+    buckets = aggregates.timeline(entity, request.args.get("column"))
+    if buckets is None:
+        return jsonify({"message": f"No data for entity type {entity}"}), 404
+    return versioned(jsonify({"bucket_seconds": BUCKET_SECONDS, "buckets": buckets}), version)
+
+@app.route('/dashboard_api/series')
+def get_series():
+    entity = request.args.get("entity")
+    column = request.args.get("column")
+    points = min(request.args.get("points", 1000, type=int), MAX_SERIES_POINTS)
+    x = request.args.get("x", "row")
+    if x not in ("row", "time"):
+        return jsonify({"message": "x must be row or time"}), 400
+    version = dataset_version()
+    series = aggregates.series(entity, column, points=points, x=x)
+    if series is None:
+        return jsonify({"message": f"No numeric column {column} for entity type {entity}"}), 404
+    total = series.pop("total")
+    format = wire.accepted(request.headers.get("Accept"))
+    if format == "json":
+        response = jsonify({**series, "total": total})
+    else:
+        # Arrow or msgpack, as the client asked; the columns are x and y.
+        body, headers = wire.encode(pd.DataFrame(series), format)
+        response = Response(body, headers={**headers, "X-Series-Total": str(total)})
+    return versioned(response, version)
+
+@app.route('/dashboard_api/query', methods=['POST'])
+def query_records():
+    """Stored records matching a JSON query, as JSON or in the format the Accept header asks for.
+
+    {"entity": "Report", "columns": ["account", "sales"],
+     "where": [["sales", ">", 100], ["currency", "in", ["USD", "EUR"]]],
+     "filename": "sales.csv", "upload_id": "...", "since": "2024-06-01", "until": ...,
+     "limit": 1000, "offset": 0}
+    Every key is optional; since and until bound the ingest time.
+    """
+    params = request.get_json(silent=True) or {}
+    try:
+        where = [list(predicate) for predicate in params.get("where", [])]
+        if params.get("filename") is not None:
+            where.append([SOURCE_FILE, "=", params["filename"]])
+        if params.get("upload_id") is not None:
+            where.append([UPLOAD_ID, "=", params["upload_id"]])
+        if params.get("since") is not None:
+            where.append([INGESTED_AT, ">=", timestamp(params["since"])])
+        if params.get("until") is not None:
+            where.append([INGESTED_AT, "<", timestamp(params["until"])])
+        limit = min(int(params.get("limit", QUERY_LIMIT)), MAX_QUERY_ROWS)
+        with metrics.timed("query"):
+            table = store.query(params.get("entity"), params.get("columns"), where,
+                                limit=limit, offset=int(params.get("offset", 0)))
+    except (ValueError, TypeError) as e:
+        return jsonify({"message": f"Invalid query: {e}"}), 400
+    body, headers = wire.encode(table, wire.accepted(request.headers.get("Accept")))
+    return Response(body, headers=headers)
+
+@app.route('/dashboard_api/store')
+def store_stats():
+    return jsonify(store.stats())
+
+@app.route('/dashboard_api/stats')
+def buffer_stats():
+    return jsonify(buffer.stats())
 
 if __name__ == "__main__":
-    app.run(debug=False, use_reloader=False, port=8502)
+    try:
+        app.run(debug=False, use_reloader=False, port=8502, threaded=True)
+    finally:
+        store.close()
@@ -1,65 +1,242 @@
 import asyncio
+import hashlib
+import json
 import queue
+import threading
+from collections import OrderedDict
 import requests
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-import json
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from groovybytes import wire
 
 RECEIVED_DATA = None
+INGESTION_URL = "http://127.0.0.1:5000"
+DASHBOARD_API_URL = "http://127.0.0.1:8502/dashboard_api"
+CHART_POINTS = 1000  # the backend downsamples every series to at most this many points
+UPLOAD_PARALLEL = 4
+CHUNK_RETRIES = 3
+SUMMARY_VERSIONS = 8  # dataset versions whose summary stays cached
+FRAME_CACHE_BYTES = 256 * 1024 * 1024  # decoded series kept across reruns and sessions
 input_queue = queue.Queue()
 warnings.filterwarnings("ignore", message="missing ScriptRunContext!")
 
+
+@st.cache_resource
+def http_session():
+    # Streamlit runs this script again on every interaction; the session and
+    # its open connections are kept across reruns and shared by all sessions.
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=UPLOAD_PARALLEL)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+http = http_session()
+
+
+class FrameCache:
+    """Decoded frames by key; the least recently used are dropped past max_bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.frames = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.frames:
+                return None
+            self.frames.move_to_end(key)
+            return self.frames[key]
+
+    def put(self, key, frame):
+        size = int(frame.memory_usage(deep=True).sum())
+        with self.lock:
+            if key in self.frames or size > self.max_bytes:
+                return
+            self.frames[key] = frame
+            self.size += size
+            while self.size > self.max_bytes:
+                _, dropped = self.frames.popitem(last=False)
+                self.size -= int(dropped.memory_usage(deep=True).sum())
+
+@st.cache_resource
+def frame_cache():
+    return FrameCache(FRAME_CACHE_BYTES)
+
+
+def dataset_version():
+    # The backend's version changes with every batch it receives and every time
+    # it restarts; everything fetched for a version is cached under it.
+    response = http.get(f"{DASHBOARD_API_URL}/version")
+    response.raise_for_status()
+    return response.json()["version"]
+
+@st.cache_data(max_entries=SUMMARY_VERSIONS, show_spinner=False)
+def load_summary(version):
+    """{entity: (rows, column stats DataFrame, numeric columns)} at a dataset version."""
+    response = http.get(f"{DASHBOARD_API_URL}/summary")
+    response.raise_for_status()
+    summary = {}
+    for entity, stats in response.json()["entities"].items():
+        columns = pd.DataFrame.from_dict(stats["columns"], orient="index")
+        columns.insert(1, "missing", stats["rows"] - columns["present"])
+        numeric = [column for column, values in stats["columns"].items() if "sum" in values]
+        summary[entity] = (stats["rows"], columns, numeric)
+    return summary
+
+def load_series(version, entity, column):
+    """The downsampled series of a column as a DataFrame of x and y, fetched as Arrow."""
+    cache = frame_cache()
+    key = (version, entity, column)
+    frame = cache.get(key)
+    if frame is None:
+        response = http.get(f"{DASHBOARD_API_URL}/series", headers={"Accept": wire.ARROW},
+                            params={"entity": entity, "column": column, "points": CHART_POINTS})
+        if response.status_code != 200:
+            return None
+        frame = wire.decode(response.content, response.headers.get("Content-Type"), as_frame=True)
+        frame.attrs["total"] = int(response.headers.get("X-Series-Total", len(frame)))
+        cache.put(key, frame)
+    return frame
+
+def load_query(version, query):
+    """Stored records matching query (the JSON of a /query body), as a DataFrame fetched as Arrow."""
+    cache = frame_cache()
+    key = (version, "query", query)
+    frame = cache.get(key)
+    if frame is None:
+        response = http.post(f"{DASHBOARD_API_URL}/query", data=query,
+                             headers={"Accept": wire.ARROW, "Content-Type": "application/json"})
+        if response.status_code != 200:
+            st.error(f"Query failed: {response.json().get('message', response.text)}")
+            return None
+        frame = wire.decode(response.content, response.headers.get("Content-Type"), as_frame=True)
+        cache.put(key, frame)
+    return frame
+
+def upload_state(name):
+    """The ingestion service's state for an upload, such as queued or processed."""
+    response = http.get(f"{INGESTION_URL}/status", params={"name": name})
+    items = response.json()["items"] if response.status_code == 200 else []
+    return items[0]["state"] if items else None
+
 # Asynchronous function to fetch processed data
 async def fetch_data_async():
+    # The backend keeps the aggregates up to date; only the summary comes over the wire.
     try:
-        response = requests.get("http://127.0.0.1:8502/dashboard_api/data")
-        if response.status_code == 200:
-            input_queue.put(response.json())
+        version = dataset_version()
+        if load_summary(version):
+            input_queue.put(version)
         else:
-            st.warning("Failed to fetch data or received empty response.")
+            st.warning("No data received by the dashboard backend yet.")
     except Exception as e:
         st.error(f"Failed to fetch data: {e}")
 
-def format_display_data(data):
-    data = pd.DataFrame(data)
-    if len(data.columns) == 1 and isinstance(data.iloc[0, 0], str):
-        try:
-            # Parse JSON strings in the single column
-            data = pd.json_normalize(data.iloc[:, 0].apply(json.loads))
-        except Exception as e:
-            st.error(f"Failed to parse JSON data: {e}")
-            return None
+def upload_in_chunks(uploaded_file, progress):
+    """Send a file to the ingestion service in checksummed chunks, several at a time.
 
-    if 'other' in data.columns:
-        try:
-            # Expand the 'other' column
-            flattened_other = pd.json_normalize(data['other'])
-            data = data.drop(columns=['other'])
-            pd.concat([data, flattened_other], axis=1)
-        except Exception as e:
-            st.error(f"Failed to flatten 'other' column: {e}")
-            return None
+    The upload id is kept in the session state, so after a failure the next
+    attempt only sends the ranges the ingestion service is still missing.
+    """
+    upload = st.session_state.get("upload")
+    if upload is not None and (upload["filename"], upload["size"]) == (uploaded_file.name, uploaded_file.size):
+        response = http.get(f"{INGESTION_URL}/ingestion/uploads/{upload['id']}")
+        upload = response.json() if response.status_code == 200 else None
+    else:
+        upload = None
+    if upload is None:
+        response = http.post(f"{INGESTION_URL}/ingestion/uploads",
+                             json={"filename": uploaded_file.name, "size": uploaded_file.size})
+        if response.status_code != 201:
+            return response
+        upload = response.json()
+    st.session_state.upload = {"id": upload["id"], "filename": uploaded_file.name, "size": uploaded_file.size}
 
-    return data
+    url = f"{INGESTION_URL}/ingestion/uploads/{upload['id']}"
+    chunk_size = upload["chunk_size"]
+    chunks = [(offset, min(offset + chunk_size, end))
+              for start, end in upload["missing"] for offset in range(start, end, chunk_size)]
+    # The threads share the one file object.
+    file_lock = threading.Lock()
+
+    def send(chunk):
+        start, end = chunk
+        with file_lock:
+            uploaded_file.seek(start)
+            body = uploaded_file.read(end - start)
+        headers = {"X-Chunk-SHA256": hashlib.sha256(body).hexdigest()}
+        for _ in range(CHUNK_RETRIES):
+            try:
+                response = http.put(url, params={"offset": start}, data=body, headers=headers)
+                if response.status_code == 200:
+                    return response.json()["received_bytes"]
+            except requests.RequestException:
+                pass
+        raise RuntimeError(f"Chunk at offset {start} was not accepted")
+
+    done = 0
+    with ThreadPoolExecutor(UPLOAD_PARALLEL) as pool:
+        for received in pool.map(send, chunks):
+            done = max(done, received)
+            progress.progress(min(done / max(uploaded_file.size, 1), 1.0))
+
+    response = http.post(f"{url}/finalize")
+    if response.status_code == 200:
+        del st.session_state.upload
+    return response
 
 # Display Data Overview
-def display_data_overview(data):
+def display_data_overview(summary, version):
     st.write("### Data Overview")
-    st.write(f"Total Records: {len(data)}")
-    st.write(f"Columns: {', '.join(map(str, data.columns))}")
+    st.write(f"Total Records: {sum(rows for rows, _, _ in summary.values())}")
 
-    if not isinstance(data, pd.DataFrame):
-        st.error("Data is not a DataFrame!")
-        st.write(type(data))
-        return
+    for entity, (rows, columns, numeric) in summary.items():
+        st.write(f"#### {entity}: {rows} records")
+        st.dataframe(columns, height=min(35 * (len(columns) + 1) + 3, 500))
 
-    if data.empty:
-        st.warning("The dataset is empty!")
-        return
+        if numeric:
+            column = st.selectbox(f"Plot a {entity} column", numeric, key=f"plot-{entity}")
+            series = load_series(version, entity, column)
+            if series is not None:
+                st.plotly_chart(px.line(series, x="x", y="y", labels={"x": "record", "y": column},
+                                        title=f"{column} ({len(series)} of {series.attrs['total']} points)"))
 
-    st.dataframe(data, height=500)
+    display_query(summary, version)
+
+def display_query(summary, version):
+    st.write("### Query Stored Records")
+    entity = st.selectbox("Entity type", list(summary), key="query-entity")
+    columns = list(summary[entity][1].index)
+    query = {"entity": entity, "limit": int(st.number_input("Rows", 1, 100000, 100, key="query-limit"))}
+    selected = st.multiselect("Columns", columns, key="query-columns")
+    if selected:
+        query["columns"] = selected
+    filename = st.text_input("Uploaded file", key="query-filename")
+    if filename:
+        query["filename"] = filename
+    upload_id = st.text_input("Upload id", key="query-upload")
+    if upload_id:
+        query["upload_id"] = upload_id
+    column = st.selectbox("Filter column", ["", *columns], key="query-column")
+    op = st.selectbox("Operator", ["=", "!=", "<", "<=", ">", ">="], key="query-op")
+    value = st.text_input("Value", key="query-value")
+    if column and value:
+        try:
+            # Numbers are compared as numbers, anything else as text.
+            value = json.loads(value)
+        except ValueError:
+            pass
+        query["where"] = [[column, op, value]]
+
+    frame = load_query(version, json.dumps(query, sort_keys=True))
+    if frame is not None:
+        st.write(f"{len(frame)} records")
+        st.dataframe(frame, height=400)
 
 
 async def main():
@@ -89,23 +266,34 @@ async def main():
 
         # Upload to ingestion system only after clicking the upload button
         st.info("Uploading to ingestion system...")
-        files = {'file': (uploaded_file.name, uploaded_file.getvalue())}
-        response = requests.post("http://127.0.0.1:5000/ingestion/upload", files=files)
+        try:
+            response = upload_in_chunks(uploaded_file, st.progress(0.0))
+        except Exception as e:
+            # The chunks that made it are kept; uploading again sends the rest.
+            st.error(f"Upload interrupted: {e}. Click Upload File again to resume.")
+            response = None
 
-        if response.status_code == 200:
+        if response is not None and response.status_code == 200:
             st.success("File successfully sent to ingestion system.")
+            st.session_state.upload_name = response.json()["name"]
             st.session_state.data_uploaded = True  # Mark the file as uploaded
             st.session_state.data_fetched = False  # Reset data fetching state after upload
             st.session_state.data_ready = False  # Reset data readiness state after upload
-        else:
+        elif response is not None:
             st.error(f"Ingestion system error: {response.text}")
 
         # Show a warning message until the data is ready
         st.warning("No data received yet. Please wait...")
 
-    # Notify the user when the data is ready for fetching
+    # The data is ready once the ingestion service has processed the upload.
     if st.session_state.data_uploaded and not st.session_state.data_ready:
-        st.info("Data is being processed. Please wait until it's ready for fetching.")
+        state = upload_state(st.session_state.get("upload_name"))
+        if state in ("processed", "duplicate"):
+            st.session_state.data_ready = True
+        elif state in ("error", "cancelled"):
+            st.error(f"Ingestion of the file failed ({state}).")
+        else:
+            st.info(f"Data is being processed ({state or 'pending'}). Please wait until it's ready for fetching.")
 
     # Fetch data logic is only executed when the fetch button is clicked
     data_placeholder = st.empty()
@@ -121,36 +309,32 @@ async def main():
             while not input_queue.empty():
                 item = input_queue.get()
                 if item is not None:
-                    display_data = format_display_data(item)
-                    if display_data is not None:
-                        with data_placeholder.container():
-                            st.success("Displaying formatted data")
-                            display_data_overview(display_data)
+                    st.session_state.version = item
+                    with data_placeholder.container():
+                        st.success("Displaying formatted data")
+                        display_data_overview(load_summary(item), item)
 
             st.warning("Data fetch completed. Click the button again to fetch new data.")
         else:
             st.warning("Data is not ready yet. Please wait for it to be processed.")
 
+    # Keep the last summary on screen: picking another column to plot reruns the
+    # script, and everything for the fetched version comes from the caches.
+    if not fetch_button and st.session_state.get("version") is not None:
+        with data_placeholder.container():
+            display_data_overview(load_summary(st.session_state.version), st.session_state.version)
+
     # Ensure fetch button can trigger data fetch again only if new data is uploaded
     if not st.session_state.data_uploaded:
         st.warning("Please upload a file first before fetching data.")
 
-    # Simulate data processing status change (just for demo purposes)
-    if st.session_state.data_uploaded and not st.session_state.data_ready:
-        # Simulating a data processing delay (this would typically come from a real backend check)
-        import time
-        time.sleep(5)  # Simulate a processing delay
-        st.session_state.data_ready = True  # Mark data as ready after processing
-
-        # Update status here, ensuring it happens after processing
-        # st.success("Data is now ready to be fetched. You can click the 'Fetch Data' button.")
-
     # Allow a new file upload and start over
     reset_button = st.sidebar.button("Upload New File")
     if reset_button:
         st.session_state.data_uploaded = False
         st.session_state.data_fetched = False
         st.session_state.data_ready = False
+        st.session_state.version = None
         st.rerun()  # This will reset the app and allow the user to upload a new file
 
 
@@ -0,0 +1,479 @@
+import json
+import os
+import queue
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from groovybytes import records as entity_records, wire
+
+# Columns the store adds to every row: where it was ingested from, and when it arrived.
+SOURCE_FILE = "source_file"
+UPLOAD_ID = "upload_id"
+INGESTED_AT = "ingested_at"
+SOURCE_COLUMNS = (SOURCE_FILE, UPLOAD_ID, INGESTED_AT)
+# Columns with a hash index from value to the segments holding it.
+INDEXED_COLUMNS = ("filename", SOURCE_FILE, UPLOAD_ID)
+
+COMPARISONS = {"=": pc.equal, "!=": pc.not_equal, "<": pc.less, "<=": pc.less_equal,
+               ">": pc.greater, ">=": pc.greater_equal}
+OPERATORS = (*COMPARISONS, "in")
+
+
+def ingest_date(timestamp):
+    return time.strftime("%Y-%m-%d", time.gmtime(timestamp))
+
+
+class Segment:
+    """One immutable Arrow file, and what is known about its rows without reading it.
+
+    zones holds [min, max, nulls] for every column (min and max are None for
+    columns that are not numbers or text); keys holds the distinct values of
+    the indexed columns.
+    """
+
+    __slots__ = ("id", "order", "entity", "date", "path", "rows", "zones", "keys", "replaces")
+
+    def __init__(self, id, order, entity, date, path, rows, zones, keys, replaces=()):
+        self.id = id
+        self.order = order
+        self.entity = entity
+        self.date = date
+        self.path = path
+        self.rows = rows
+        self.zones = zones
+        self.keys = keys
+        self.replaces = list(replaces)
+
+    @classmethod
+    def describe(cls, id, order, entity, date, path, table, replaces=()):
+        json_columns = set(wire.arrow_json_columns(table))
+        zones = {}
+        keys = {}
+        for name in table.column_names:
+            column = table.column(name)
+            low = high = None
+            kind = column.type
+            if name not in json_columns and column.null_count < len(column) and (
+                    pa.types.is_integer(kind) or pa.types.is_floating(kind) or pa.types.is_string(kind)):
+                bounds = pc.min_max(column)
+                low, high = bounds["min"].as_py(), bounds["max"].as_py()
+            zones[name] = [low, high, column.null_count]
+            if name in INDEXED_COLUMNS:
+                keys[name] = [str(value) for value in pc.unique(column.drop_null()).to_pylist()]
+        return cls(id, order, entity, date, path, table.num_rows, zones, keys, replaces)
+
+    def to_json(self):
+        return {"id": self.id, "order": self.order, "entity": self.entity, "date": self.date,
+                "rows": self.rows, "zones": self.zones, "keys": self.keys, "replaces": self.replaces}
+
+    @classmethod
+    def from_json(cls, meta, path):
+        return cls(meta["id"], meta["order"], meta["entity"], meta["date"], path, meta["rows"],
+                   meta["zones"], meta["keys"], meta.get("replaces", ()))
+
+    def may_match(self, column, op, value):
+        """False when the zone map shows no row can satisfy column op value."""
+        zone = self.zones.get(column)
+        if zone is None or zone[2] == self.rows:
+            # Nulls never match, and a column the segment lacks is all nulls.
+            return False
+        low, high, _ = zone
+        if low is None:
+            return True
+        try:
+            if op == "=":
+                return low <= value <= high
+            if op == "in":
+                return any(low <= item <= high for item in value)
+            if op == "<":
+                return low < value
+            if op == "<=":
+                return low <= value
+            if op == ">":
+                return high > value
+            if op == ">=":
+                return high >= value
+        except TypeError:
+            # Compared across types; reading the rows decides.
+            return True
+        return True
+
+    def matches_all(self, column, op, value):
+        """True when the zone map shows every row satisfies column op value."""
+        zone = self.zones.get(column)
+        if zone is None or zone[2] or zone[0] is None:
+            return False
+        low, high, _ = zone
+        try:
+            if op == "=":
+                return low == high == value
+            if op == "<":
+                return high < value
+            if op == "<=":
+                return high <= value
+            if op == ">":
+                return low > value
+            if op == ">=":
+                return low >= value
+        except TypeError:
+            return False
+        return False
+
+    def read(self, columns=None):
+        # Memory-mapped: only the columns that are used are ever paged in.
+        table = pa.ipc.open_file(pa.memory_map(self.path)).read_all()
+        if columns is not None:
+            table = table.select([name for name in columns if name in table.column_names])
+        return table
+
+
+class RecordStore:
+    """Formatted records on disk, partitioned by entity type and ingest date, and queryable.
+
+    Every batch is written as one Arrow file per entity type under
+    <directory>/<entity>/<date>/. A zone map and the values of the indexed
+    columns are kept in memory for every file, so a query only opens the
+    files that can hold matching rows, and only reads the columns it uses.
+    Once a partition has compact_segments files of fewer than segment_rows
+    rows, they are merged into one, by a background thread.
+    """
+
+    def __init__(self, directory, compact_segments=16, segment_rows=100000):
+        self.directory = directory
+        self.compact_segments = compact_segments
+        self.segment_rows = segment_rows
+        self.lock = threading.Lock()
+        self.segments = {}
+        # (entity, date) -> segment ids, oldest rows first
+        self.partitions = {}
+        # (column, value) -> ids of the segments holding that value
+        self.index = {}
+        self.next_id = 1
+        self.compacting = set()
+        # Queries running, and the files of merged segments waiting for them to finish.
+        self.readers = 0
+        self.doomed = []
+        # Partitions written to since the compactor last looked at them.
+        self.due = queue.Queue()
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+        self.compactor = threading.Thread(target=self.run_compactor, daemon=True)
+        self.compactor.start()
+
+    def load(self):
+        found = []
+        for root, _, names in os.walk(self.directory):
+            names = set(names)
+            for name in names:
+                path = os.path.join(root, name)
+                base, ext = os.path.splitext(name)
+                if ext == ".tmp" or (ext == ".arrow" and f"{base}.json" not in names):
+                    # Left by a write that never finished.
+                    os.remove(path)
+                elif ext == ".json":
+                    if f"{base}.arrow" not in names:
+                        # The write stopped after the metadata; the rows never made it.
+                        os.remove(path)
+                        continue
+                    with open(path) as f:
+                        found.append(Segment.from_json(json.load(f), os.path.join(root, f"{base}.arrow")))
+        # A merged segment whose parts were not deleted yet replaces them.
+        replaced = {old for segment in found for old in segment.replaces}
+        for segment in sorted(found, key=lambda segment: segment.order):
+            self.next_id = max(self.next_id, segment.id + 1)
+            if segment.id in replaced:
+                self.delete_files([segment.path])
+            else:
+                self.register(segment)
+
+    def register(self, segment):
+        self.segments[segment.id] = segment
+        self.partitions.setdefault((segment.entity, segment.date), []).append(segment.id)
+        for column, values in segment.keys.items():
+            for value in values:
+                self.index.setdefault((column, value), set()).add(segment.id)
+
+    def unregister(self, segment):
+        del self.segments[segment.id]
+        for column, values in segment.keys.items():
+            for value in values:
+                ids = self.index[(column, value)]
+                ids.discard(segment.id)
+                if not ids:
+                    del self.index[(column, value)]
+
+    @staticmethod
+    def delete_files(paths):
+        for path in paths:
+            for name in (path, path[:-len(".arrow")] + ".json"):
+                try:
+                    os.remove(name)
+                except FileNotFoundError:
+                    pass
+
+    def partition_path(self, entity, date):
+        return os.path.join(self.directory, urllib.parse.quote(str(entity), safe=""), date)
+
+    def append(self, records, received_at):
+        """Store a batch of formatted records; returns the number of rows written."""
+        groups = {}
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            source = entity_records.source_of(record)
+            row = dict(entity_records.flatten(record))
+            row[SOURCE_FILE] = source.get("filename")
+            row[UPLOAD_ID] = source.get("upload_id")
+            row[INGESTED_AT] = received_at
+            groups.setdefault(entity_records.entity_type(record), []).append(row)
+
+        date = ingest_date(received_at)
+        for entity, rows in groups.items():
+            self.write(entity, date, wire.arrow_table(rows))
+            # Merging small files rewrites them, so it is left to the compactor
+            # rather than holding up the batch.
+            self.due.put((entity, date))
+        return sum(len(rows) for rows in groups.values())
+
+    def write(self, entity, date, table, order=None, replaces=()):
+        with self.lock:
+            id = self.next_id
+            self.next_id += 1
+        directory = self.partition_path(entity, date)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{id:010d}.arrow")
+        segment = Segment.describe(id, id if order is None else order, entity, date, path, table, replaces)
+        # The metadata goes first: a file whose rows are there always says
+        # which segments it replaces, and load() drops metadata without rows.
+        meta_path = path[:-len(".arrow")] + ".json"
+        with open(f"{meta_path}.tmp", "w") as f:
+            json.dump(segment.to_json(), f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+        with pa.OSFile(f"{path}.tmp", "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(f"{path}.tmp", path)
+        if not replaces:
+            with self.lock:
+                self.register(segment)
+        return segment
+
+    def run_compactor(self):
+        while True:
+            partition = self.due.get()
+            try:
+                if partition is None:
+                    return
+                self.compact(partition)
+            except Exception as e:
+                # The files stay as they are; the next batch for the partition tries again.
+                print(f"Could not compact {partition[0]} records of {partition[1]}: {e}")
+            finally:
+                self.due.task_done()
+
+    def wait_for_compaction(self):
+        """Block until every partition written to so far has been compacted."""
+        self.due.join()
+
+    def close(self):
+        self.due.put(None)
+        self.compactor.join()
+
+    def compact(self, partition):
+        with self.lock:
+            if partition in self.compacting:
+                return
+            ids = self.partitions.get(partition, [])
+            # The newest files that are still small; older ones were merged already.
+            run = []
+            for id in reversed(ids):
+                if self.segments[id].rows >= self.segment_rows:
+                    break
+                run.insert(0, id)
+            if len(run) < self.compact_segments:
+                return
+            self.compacting.add(partition)
+            segments = [self.segments[id] for id in run]
+        try:
+            merged = self.write(partition[0], partition[1], concat([segment.read() for segment in segments]),
+                                order=segments[0].order, replaces=[segment.id for segment in segments])
+            with self.lock:
+                ids = self.partitions[partition]
+                at = ids.index(run[0])
+                for segment in segments:
+                    ids.remove(segment.id)
+                    self.unregister(segment)
+                self.register(merged)
+                # register appended it; it belongs where its parts were.
+                ids.remove(merged.id)
+                ids.insert(at, merged.id)
+                self.doomed.extend(segment.path for segment in segments)
+                self.delete_doomed()
+        finally:
+            with self.lock:
+                self.compacting.discard(partition)
+
+    def delete_doomed(self):
+        # Called with the lock held.
+        if not self.readers:
+            self.delete_files(self.doomed)
+            self.doomed = []
+
+    def candidates(self, entity, where):
+        """The segments that may hold rows matching every predicate, in order. Called with the lock held."""
+        ids = None
+        first_date = last_date = None
+        for column, op, value in where:
+            if column in INDEXED_COLUMNS and op in ("=", "in"):
+                values = [value] if op == "=" else value
+                found = set().union(*(self.index.get((column, str(item)), ()) for item in values))
+                ids = found if ids is None else ids & found
+            elif column == INGESTED_AT and isinstance(value, (int, float)):
+                if op in (">", ">="):
+                    first_date = max(first_date or "", ingest_date(value))
+                elif op in ("<", "<="):
+                    last_date = min(last_date or "9999", ingest_date(value))
+
+        segments = []
+        for (partition_entity, date), partition in sorted(self.partitions.items()):
+            if entity is not None and partition_entity != entity:
+                continue
+            if (first_date is not None and date < first_date) or (last_date is not None and date > last_date):
+                continue
+            segments.extend(self.segments[id] for id in partition if ids is None or id in ids)
+        return [segment for segment in segments if all(segment.may_match(*predicate) for predicate in where)]
+
+    def query(self, entity=None, columns=None, where=(), limit=None, offset=0):
+        """Rows matching every (column, op, value) predicate in where, as a pyarrow Table.
+
+        op is one of =, !=, <, <=, >, >= or in (with a list of values).
+        columns limits the columns returned; rows come in ingest order
+        within each entity type.
+        """
+        where = [tuple(predicate) for predicate in where]
+        for predicate in where:
+            if len(predicate) != 3 or predicate[1] not in OPERATORS:
+                raise ValueError(f"Invalid predicate {list(predicate)}: expected [column, op, value] "
+                                 f"with op one of {', '.join(OPERATORS)}")
+            if predicate[1] == "in" and not isinstance(predicate[2], list):
+                raise ValueError(f'The value of an "in" predicate on {predicate[0]} must be a list')
+        needed = None if columns is None else list(dict.fromkeys([*columns, *(column for column, _, _ in where)]))
+
+        with self.lock:
+            segments = self.candidates(entity, where)
+            self.readers += 1
+        try:
+            tables = []
+            skipped = taken = 0
+            for segment in segments:
+                if limit is not None and taken >= limit:
+                    break
+                if skipped + segment.rows <= offset and all(segment.matches_all(*p) for p in where):
+                    # Before the offset, and known to match in full without reading it.
+                    skipped += segment.rows
+                    continue
+                table = segment.read(needed)
+                mask = self.mask(table, where)
+                if mask is False:
+                    continue
+                if mask is not None:
+                    table = table.filter(mask)
+                if skipped < offset:
+                    drop = min(offset - skipped, table.num_rows)
+                    table = table.slice(drop)
+                    skipped += drop
+                if limit is not None:
+                    table = table.slice(0, limit - taken)
+                if table.num_rows:
+                    tables.append(table)
+                    taken += table.num_rows
+        finally:
+            with self.lock:
+                self.readers -= 1
+                self.delete_doomed()
+
+        result = concat(tables) if tables else pa.table({})
+        if columns is not None:
+            for name in columns:
+                if name not in result.column_names:
+                    result = result.append_column(name, pa.nulls(result.num_rows))
+            result = result.select(list(columns))
+        return result
+
+    @staticmethod
+    def mask(table, where):
+        """The rows of table matching every predicate; None for all of them, False for none."""
+        mask = None
+        json_columns = wire.arrow_json_columns(table)
+        for column, op, value in where:
+            if column in json_columns:
+                # Mixed columns hold the JSON of each value.
+                value = [json.dumps(item) for item in value] if op == "in" else json.dumps(value)
+            try:
+                if op == "in":
+                    values = pa.array(value)
+                    if values.type != table.column(column).type:
+                        values = values.cast(table.column(column).type)
+                    matched = pc.is_in(table.column(column), value_set=values)
+                else:
+                    matched = COMPARISONS[op](table.column(column), pa.scalar(value))
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+                # The column holds another type in this segment than the value.
+                return False
+            mask = matched if mask is None else pc.and_kleene(mask, matched)
+        return mask
+
+    def stats(self):
+        with self.lock:
+            partitions = {}
+            for (entity, date), ids in sorted(self.partitions.items()):
+                partitions.setdefault(entity, {})[date] = {
+                    "segments": len(ids), "rows": sum(self.segments[id].rows for id in ids)}
+            return {"partitions": partitions, "source_columns": list(SOURCE_COLUMNS)}
+
+
+def concat(tables):
+    """Concatenate tables of one entity type whose columns may differ, or differ in type."""
+    json_columns = set().union(*(wire.arrow_json_columns(table) for table in tables))
+    types = {}
+    for table in tables:
+        for field in table.schema:
+            if not pa.types.is_null(field.type):
+                types.setdefault(field.name, set()).add(field.type)
+    # Columns whose types cannot be reconciled are carried as JSON text, like wire does.
+    mixed = {name for name, found in types.items()
+             if len(found) > 1 and not all(pa.types.is_integer(kind) or pa.types.is_floating(kind) for kind in found)}
+    json_columns |= mixed
+    if json_columns:
+        tables = [as_json(table, json_columns, set(wire.arrow_json_columns(table))) for table in tables]
+    table = pa.concat_tables([table.replace_schema_metadata(None) for table in tables], promote_options="permissive")
+    if json_columns:
+        table = table.replace_schema_metadata({wire.JSON_COLUMNS_KEY: json.dumps(sorted(json_columns))})
+    return table
+
+
+def as_json(table, names, already_json):
+    for name in names:
+        if name in table.column_names and name not in already_json:
+            values = [None if value is None else json.dumps(value, default=str)
+                      for value in table.column(name).to_pylist()]
+            table = table.set_column(table.column_names.index(name), name, pa.array(values, type=pa.string()))
+    return table
+
+
+def timestamp(value):
+    """Seconds since the epoch, from a number or an ISO date/datetime (UTC unless it says otherwise)."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
@@ -0,0 +1,70 @@
+import json
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+
+class RingBuffer:
+    """The latest formatted batches, kept for any number of readers.
+
+    Every batch gets the next offset and is serialized once, when it is
+    appended, along with the time it was received; readers ask for the batches after the last offset they saw and
+    get the stored JSON back. The oldest batches are dropped past max_batches
+    or max_bytes.
+    """
+
+    def __init__(self, max_batches=10000, max_bytes=256 * 1024 * 1024):
+        self.max_batches = max_batches
+        self.max_bytes = max_bytes
+        # (offset, rows, json, received_at)
+        self.batches = deque()
+        self.size = 0
+        self.last_offset = 0
+        self.cond = threading.Condition()
+
+    def append(self, records, received_at=None):
+        body = json.dumps(records)
+        with self.cond:
+            self.last_offset += 1
+            self.batches.append((self.last_offset, len(records), body,
+                                 time.time() if received_at is None else received_at))
+            self.size += len(body)
+            while self.batches and (len(self.batches) > self.max_batches or self.size > self.max_bytes):
+                _, _, dropped, _ = self.batches.popleft()
+                self.size -= len(dropped)
+            self.cond.notify_all()
+            return self.last_offset
+
+    def first_offset(self):
+        return self.batches[0][0] if self.batches else self.last_offset + 1
+
+    def read(self, since=0, limit=None, timeout=0):
+        """Batches after offset since, waiting up to timeout seconds for one to arrive.
+
+        Returns (batches, missed); missed is True when batches after since
+        were dropped before this reader got to them.
+        """
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            if since > self.last_offset:
+                # A cursor from before the backend restarted.
+                since = 0
+            while self.last_offset <= since and timeout > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.cond.wait(remaining):
+                    break
+            first = self.first_offset()
+            # Offsets are consecutive, so the first batch to return is found by position.
+            start = max(since + 1 - first, 0)
+            end = None if limit is None else start + limit
+            return list(islice(self.batches, start, end)), since + 1 < first
+
+    def latest(self):
+        with self.cond:
+            return self.batches[-1] if self.batches else None
+
+    def stats(self):
+        with self.cond:
+            return {"first_offset": self.first_offset(), "last_offset": self.last_offset,
+                    "batches": len(self.batches), "bytes": self.size}
@@ -0,0 +1,134 @@
+import os
+import shutil
+
+import pytest
+
+from record_store import RecordStore, Segment, SOURCE_FILE, INGESTED_AT
+
+DAY = 24 * 60 * 60
+# 2024-06-01, midday UTC.
+NOON = 1717243200
+
+
+def people(filename, ages):
+    return [{"name": f"person {age}", "age": age, "entity": "Person", "source": {"filename": filename}}
+            for age in ages]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = RecordStore(str(tmp_path / "store"), compact_segments=100)
+    store.append(people("a.csv", range(0, 10)), NOON)
+    store.append(people("b.csv", range(10, 20)), NOON + 1)
+    store.append(people("c.csv", range(20, 30)), NOON + DAY)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """The paths of the segment files read, as they are read."""
+    paths = []
+    read = Segment.read
+
+    def counted(segment, columns=None):
+        paths.append(segment.path)
+        return read(segment, columns)
+
+    monkeypatch.setattr(Segment, "read", counted)
+    return paths
+
+
+def ages(table):
+    return table.column("age").to_pylist()
+
+
+def test_zone_maps_skip_segments_that_cannot_match(store, reads):
+    assert ages(store.query("Person", ["age"], [("age", ">=", 25)])) == list(range(25, 30))
+    assert len(reads) == 1
+    assert ages(store.query("Person", ["age"], [("age", "in", [5, 15])])) == [5, 15]
+    assert len(reads) == 3
+    assert store.query("Person", ["age"], [("age", ">", 100)]).num_rows == 0
+    assert len(reads) == 3
+
+
+def test_index_finds_the_segments_of_a_source_file(store, reads):
+    table = store.query("Person", ["age", SOURCE_FILE], [(SOURCE_FILE, "=", "b.csv")])
+    assert ages(table) == list(range(10, 20))
+    assert set(table.column(SOURCE_FILE).to_pylist()) == {"b.csv"}
+    assert len(reads) == 1
+    assert len(store.query("Person", ["age"], [(SOURCE_FILE, "in", ["a.csv", "c.csv"])])) == 20
+    assert len(reads) == 3
+    assert store.query("Person", ["age"], [(SOURCE_FILE, "=", "d.csv")]).num_rows == 0
+    assert len(reads) == 3
+
+
+def test_ingest_time_skips_the_partitions_of_other_days(store, reads):
+    assert ages(store.query("Person", ["age"], [(INGESTED_AT, ">=", NOON + DAY)])) == list(range(20, 30))
+    assert len(reads) == 1
+    assert ages(store.query("Person", ["age"], [(INGESTED_AT, "<", NOON + 1)])) == list(range(0, 10))
+    assert len(reads) == 2
+
+
+def test_filters_combine_and_rows_come_in_ingest_order(store):
+    where = [("age", ">=", 5), ("age", "<", 25), ("age", "!=", 12), ("name", "in", ["person 6", "person 12",
+                                                                                     "person 24"])]
+    assert ages(store.query("Person", ["age"], where)) == [6, 24]
+    assert ages(store.query("Person", ["age"], [("age", "<=", 1)])) == [0, 1]
+    assert ages(store.query("Person", ["age"], [("name", "=", "person 7")])) == [7]
+
+
+def test_limit_and_offset_page_through_the_matches(store, reads):
+    assert ages(store.query("Person", ["age"], limit=5, offset=8)) == [8, 9, 10, 11, 12]
+    # A page past the first segment skips it without reading it.
+    del reads[:]
+    assert ages(store.query("Person", ["age"], limit=3, offset=12)) == [12, 13, 14]
+    assert len(reads) == 1
+    assert ages(store.query("Person", ["age"], [("age", ">=", 5)], limit=4, offset=3)) == [8, 9, 10, 11]
+
+
+def test_requested_columns_a_segment_lacks_come_back_empty(store):
+    table = store.query("Person", ["age", "email"], [("age", "=", 3)])
+    assert table.column_names == ["age", "email"]
+    assert table.column("email").to_pylist() == [None]
+
+
+@pytest.mark.parametrize("predicate", [("age", "~", 3), ("age", "in", 3), ("age", ">")])
+def test_invalid_predicates_are_rejected(store, predicate):
+    with pytest.raises(ValueError):
+        store.query("Person", where=[predicate])
+
+
+def test_small_segments_are_merged_in_the_background(tmp_path):
+    directory = str(tmp_path / "store")
+    store = RecordStore(directory, compact_segments=3)
+    for i in range(3):
+        store.append(people("a.csv", range(i * 10, i * 10 + 10)), NOON + i)
+    store.wait_for_compaction()
+    (partition,) = store.partitions.values()
+    assert len(partition) == 1
+    assert ages(store.query("Person", ["age"])) == list(range(30))
+    assert ages(store.query("Person", ["age"], [(SOURCE_FILE, "=", "a.csv"), ("age", ">=", 25)])) == list(range(25, 30))
+    store.close()
+
+    reopened = RecordStore(directory, compact_segments=3)
+    assert ages(reopened.query("Person", ["age"])) == list(range(30))
+    reopened.close()
+
+
+def test_segments_whose_write_did_not_finish_are_dropped_on_load(tmp_path):
+    directory = str(tmp_path / "store")
+    store = RecordStore(directory)
+    store.append(people("a.csv", range(5)), NOON)
+    store.close()
+    (segment,) = store.segments.values()
+    partition = os.path.dirname(segment.path)
+    # Metadata written without its rows, and rows without their metadata.
+    shutil.copy(segment.path[:-len(".arrow")] + ".json", os.path.join(partition, "0000000098.json"))
+    shutil.copy(segment.path, os.path.join(partition, "0000000099.arrow"))
+
+    reopened = RecordStore(directory)
+    assert ages(reopened.query("Person", ["age"])) == list(range(5))
+    assert sorted(os.listdir(partition)) == [os.path.basename(segment.path),
+                                             os.path.basename(segment.path)[:-len(".arrow")] + ".json"]
+    reopened.close()
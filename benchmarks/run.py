@@ -0,0 +1,409 @@
+"""Throughput benchmarks for the ingestion and formatting systems.
+
+Runs everything in-process over the sample files and over synthetic files
+scaled up from them, and writes the results to a JSON file:
+
+    python benchmarks/run.py
+    python benchmarks/run.py --synthetic-rows 1000000 2000000 --compare benchmarks/results/baseline.json
+"""
+import argparse
+import collections
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from rich.console import Console
+from rich.table import Table
+from groovybytes import metrics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FORMATTING_DIR = os.path.join(ROOT, 'systems', 'formatting')
+INGESTION_DIR = os.path.join(ROOT, 'systems', 'ingestion')
+SAMPLE_DIR = os.path.join(INGESTION_DIR, 'sample files')
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+BENCHMARKS = ('process_file', 'fitness_score', 'match_headers', 'pipeline')
+SYNTHETIC_SOURCES = {'csv': 'CSV Sample 1_3MB.csv', 'json': 'JSON Sample 1MB.json'}
+
+console = Console()
+
+
+def load_systems(workdir):
+    # The services keep their state (upload history, output workbook) in the
+    # working directory and import their modules by bare name.
+    os.chdir(workdir)
+    sys.path[:0] = [FORMATTING_DIR, INGESTION_DIR]
+    import app as ingestion
+    import server as formatting
+    ingestion.workers.shutdown()
+    return ingestion, formatting
+
+
+class Response:
+    def __init__(self, status_code, body=b'{}', headers=None):
+        self.status_code = status_code
+        self.content = body
+        self.headers = headers or {}
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ClientSession:
+    """Stands in for requests.Session, posting to a Flask app without a socket."""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        path = url.split('://', 1)[-1]
+        path = path[path.find('/'):]
+        res = self.client.post(path, data=data, headers=headers)
+        return Response(res.status_code, res.get_data(), dict(res.headers))
+
+
+class NullSession:
+    """Accepts every post; stands in for the dashboard at the end of the pipeline."""
+
+    def __init__(self):
+        self.bytes = 0
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        self.bytes += len(data)
+        return Response(200)
+
+
+def sample_files(directory=SAMPLE_DIR):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if os.path.splitext(name)[1] in ('.csv', '.json', '.xls', '.xlsx'))
+
+
+def read_file(path):
+    ext = os.path.splitext(path)[1]
+    if ext == '.csv':
+        return pd.read_csv(path)
+    if ext in ('.xls', '.xlsx'):
+        return pd.read_excel(path)
+    return pd.read_json(path)
+
+
+def make_synthetic(kind, rows, directory):
+    """Tile a sample file up to the given number of rows."""
+    path = os.path.join(directory, f'synthetic-{rows}.{kind}')
+    if os.path.exists(path):
+        return path
+
+    source = read_file(os.path.join(SAMPLE_DIR, SYNTHETIC_SOURCES[kind]))
+    frame = source.iloc[np.arange(rows) % len(source)].reset_index(drop=True)
+    if 'Index' in frame.columns:
+        frame['Index'] = np.arange(1, rows + 1)
+    if kind == 'csv':
+        frame.to_csv(path, index=False)
+    else:
+        frame.to_json(path, orient='records')
+    return path
+
+
+class Benchmarks:
+    """Each benchmark runs over one file and returns (samples, seconds): one
+    (seconds, items) sample per batch, and the time the whole file took.
+    """
+
+    def __init__(self, ingestion, formatting, batch_size, repeat):
+        self.ingestion = ingestion
+        self.formatting = formatting
+        self.batch_size = batch_size
+        self.repeat = repeat
+        self.frames = {}
+        # process_file looks this up as a module global, which the
+        # process_file benchmark swaps out.
+        self.send_to_output_sink = ingestion.send_to_output_sink
+
+    def frame(self, path):
+        if path not in self.frames:
+            self.frames[path] = read_file(path)
+        return self.frames[path]
+
+    def headers(self, path):
+        return [str(column) for column in self.frame(path).columns]
+
+    def process_file(self, path):
+        """Parsing only: each chunk is dropped instead of being sent.
+
+        One sample per chunk, from the previous chunk (or the start) until the
+        chunk is ready to send.
+        """
+        timings = []
+        last = None
+
+        def drop(data, schema=None, source=None):
+            nonlocal last
+            now = time.perf_counter()
+            timings.append((now - last, len(data)))
+            last = now
+
+        self.ingestion.send_to_output_sink = drop
+        start = last = time.perf_counter()
+        self.ingestion.process_file(path)
+        elapsed = time.perf_counter() - start
+        if self.ingestion.status_store.get(os.path.basename(path)) != 'processed':
+            raise RuntimeError(f'process_file failed on {path}')
+        return timings, elapsed
+
+    def fitness_score(self, path):
+        headers = self.headers(path)
+        timings = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            self.formatting.FormattingSystem.fitness_score(headers)
+            timings.append((time.perf_counter() - start, 1))
+        return timings, sum(seconds for seconds, _ in timings)
+
+    def match_headers(self, path):
+        from entities.entity import Entity
+        records = self.frame(path).astype(object).where(self.frame(path).notna(), None).to_dict('records')
+        entity = self.formatting.FormattingSystem.fitness_score(self.headers(path))
+        timings = []
+        for i in range(0, len(records), self.batch_size):
+            batch = records[i:i + self.batch_size]
+            start = time.perf_counter()
+            for record in batch:
+                Entity.match_headers(record, entity.common_attributes, entity.schema.record())
+            timings.append((time.perf_counter() - start, len(batch)))
+        return timings, sum(seconds for seconds, _ in timings)
+
+    def pipeline(self, path):
+        """Upload to formatted output: parse, send, decode, format and encode for the dashboard.
+
+        The formatting queue is drained and the output flushed on their own
+        threads, as in the server, so chunks are formatted while the file is
+        still being read. One sample per chunk, from when ingestion sends it
+        until formatting has mapped all of its rows.
+        """
+        formatting = self.formatting
+        formatting.input_sink = formatting.Sink(capacity=formatting.INPUT_CAPACITY)
+        output_sink = formatting.Sink(url='http://dashboard/dashboard_api/data',
+                                      max_items=formatting.OUTPUT_BATCH_SIZE,
+                                      max_bytes=formatting.OUTPUT_BATCH_BYTES,
+                                      max_latency=formatting.OUTPUT_MAX_LATENCY,
+                                      capacity=formatting.OUTPUT_CAPACITY,
+                                      format=formatting.OUTPUT_WIRE_FORMAT,
+                                      compression=formatting.OUTPUT_WIRE_COMPRESSION)
+        output_sink.session = NullSession()
+        system = formatting.FormattingSystem(formatting.input_sink, output_sink,
+                                             columnar=formatting.COLUMNAR_FORMATTING,
+                                             show_progress=False)
+        self.ingestion.session = ClientSession(formatting.app)
+
+        # Batches are formatted in the order they are sent, so the rows of each
+        # "map" observation belong to the oldest chunk not yet fully mapped.
+        in_flight = collections.deque()
+        timings = []
+
+        def send(data, schema=None, source=None):
+            in_flight.append([time.perf_counter(), len(data), len(data)])
+            self.send_to_output_sink(data, schema, source)
+
+        def mapped(stage, seconds, items):
+            if stage != 'map' or not in_flight:
+                return
+            in_flight[0][2] -= items
+            if in_flight[0][2] <= 0:
+                sent_at, rows, _ = in_flight.popleft()
+                timings.append((time.perf_counter() - sent_at, rows))
+
+        self.ingestion.send_to_output_sink = send
+        metrics.listeners.append(mapped)
+
+        done = threading.Event()
+        stop_flushing = threading.Event()
+
+        def drain():
+            while not done.is_set():
+                system.process_queue()
+                done.wait(0.01)
+            system.process_queue()
+
+        workers = [threading.Thread(target=drain),
+                   threading.Thread(target=output_sink.run_flusher, args=(stop_flushing,))]
+        # Both services share the metrics registry here, labelled with the last one imported.
+        formatted = metrics.STAGE_ITEMS.value(service=metrics.service_name, stage='map')
+
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        self.ingestion.process_file(path)
+        done.set()
+        workers[0].join()
+        stop_flushing.set()
+        with output_sink.cond:
+            output_sink.cond.notify_all()
+        workers[1].join()
+        output_sink.send_output(force=True)
+        elapsed = time.perf_counter() - start
+        metrics.listeners.remove(mapped)
+
+        rows = metrics.STAGE_ITEMS.value(service=metrics.service_name, stage='map') - formatted
+        if rows != len(self.frame(path)):
+            raise RuntimeError(f'The pipeline formatted {rows} of {len(self.frame(path))} rows of {path}')
+        return timings, elapsed
+
+
+def summarize(name, dataset, paths, timings, total, peak_memory):
+    # Batches overlap in the pipeline, so throughput is over the time the files took.
+    seconds = [elapsed for elapsed, _ in timings]
+    items = sum(count for _, count in timings)
+    return {
+        'benchmark': name,
+        'dataset': dataset,
+        'files': len(paths),
+        'batches': len(timings),
+        'items': items,
+        'unit': 'header sets' if name == 'fitness_score' else 'rows',
+        'seconds': round(total, 6),
+        'items_per_second': round(items / total, 1) if total else None,
+        'p50_ms': round(float(np.percentile(seconds, 50)) * 1000, 3),
+        'p99_ms': round(float(np.percentile(seconds, 99)) * 1000, 3),
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def run(benchmarks, name, dataset, paths, memory):
+    method = getattr(benchmarks, name)
+    timings = []
+    total = 0.0
+    for path in paths:
+        samples, seconds = method(path)
+        timings.extend(samples)
+        total += seconds
+
+    peak_memory = None
+    if memory:
+        # Traced separately so tracemalloc does not slow down the timed pass.
+        largest = max(paths, key=os.path.getsize)
+        tracemalloc.start()
+        method(largest)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return summarize(name, dataset, paths, timings, total, peak_memory)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'r') as f:
+        baseline = {(row['benchmark'], row['dataset']): row for row in json.load(f)['results']}
+
+    table = Table(title=f'Compared with {os.path.basename(baseline_path)}')
+    for column in ('benchmark', 'dataset', 'items/s', 'baseline items/s', 'speedup', 'p99 ms', 'baseline p99 ms'):
+        table.add_column(column)
+    for row in results:
+        base = baseline.get((row['benchmark'], row['dataset']))
+        if base is None or not base['items_per_second']:
+            continue
+        table.add_row(row['benchmark'], row['dataset'], f"{row['items_per_second']:,.0f}",
+                      f"{base['items_per_second']:,.0f}",
+                      f"{row['items_per_second'] / base['items_per_second']:.2f}x",
+                      f"{row['p99_ms']:.2f}", f"{base['p99_ms']:.2f}")
+    console.print(table)
+
+
+def print_results(results):
+    table = Table(title='Benchmarks')
+    for column in ('benchmark', 'dataset', 'items', 'items/s', 'p50 ms', 'p99 ms', 'peak MiB'):
+        table.add_column(column)
+    for row in results:
+        peak = row['peak_memory_bytes']
+        table.add_row(row['benchmark'], row['dataset'], f"{row['items']:,} {row['unit']}",
+                      f"{row['items_per_second']:,.0f}", f"{row['p50_ms']:.2f}", f"{row['p99_ms']:.2f}",
+                      '-' if peak is None else f'{peak / 2 ** 20:.1f}')
+    console.print(table)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument('--synthetic-rows', nargs='*', type=int, default=[100000],
+                        help='Row counts of the synthetic files; pass none to skip them.')
+    parser.add_argument('--synthetic-formats', nargs='+', choices=sorted(SYNTHETIC_SOURCES), default=['csv'])
+    parser.add_argument('--batch-size', type=int, default=5000, help='Rows per timed batch in match_headers.')
+    parser.add_argument('--repeat', type=int, default=20, help='Calls per file in fitness_score.')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the traced pass for peak memory.')
+    parser.add_argument('--output', help='Where to write the JSON results (default: benchmarks/results/<time>.json).')
+    parser.add_argument('--compare', help='A previous results file to compare against.')
+    parser.add_argument('--verbose', action='store_true', help='Show the output of the services.')
+    args = parser.parse_args(argv)
+
+    started = datetime.datetime.now(datetime.timezone.utc)
+    output = args.output or os.path.join(RESULTS_DIR, started.strftime('%Y%m%dT%H%M%SZ') + '.json')
+    output = os.path.abspath(output)
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    with tempfile.TemporaryDirectory(prefix='groovybytes-bench-') as workdir:
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with quiet:
+            ingestion, formatting = load_systems(workdir)
+        benchmarks = Benchmarks(ingestion, formatting, args.batch_size, args.repeat)
+
+        datasets = [('samples', sample_files())]
+        for kind in args.synthetic_formats:
+            for rows in args.synthetic_rows:
+                console.print(f'Generating {rows:,} {kind} rows...', style='bold')
+                datasets.append((f'synthetic-{kind}-{rows}', [make_synthetic(kind, rows, workdir)]))
+
+        results = []
+        for dataset, paths in datasets:
+            for name in args.benchmarks:
+                console.print(f'Running {name} on {dataset}...', style='bold')
+                quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+                with quiet:
+                    results.append(run(benchmarks, name, dataset, paths, not args.no_memory))
+            # Frames of one dataset are not needed for the next one.
+            benchmarks.frames.clear()
+
+    print_results(results)
+    report = {
+        'started': started.isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'settings': {'batch_size': args.batch_size, 'repeat': args.repeat,
+                     'columnar': formatting.COLUMNAR_FORMATTING,
+                     'wire_format': ingestion.WIRE_FORMAT},
+        'results': results,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4)
+    console.print(f'Results saved to {output}', style='green')
+
+    if baseline:
+        compare(results, baseline)
+
+
+if __name__ == '__main__':
+    main()
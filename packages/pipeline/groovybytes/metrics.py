@@ -0,0 +1,167 @@
+"""In-process counters and latency histograms, exposed in Prometheus text format.
+
+Each service records into the module registry and serves it with
+register_endpoint(app), which adds GET /metrics.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def label_text(self, key, extra=None):
+        pairs = list(zip(self.labels, key)) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{label}="{escape(value)}"' for label, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            series = list(self.series.items())
+        for key, value in series:
+            lines.extend(self.render_series(key, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.series.get(self.key(labels), 0)
+
+    def render_series(self, key, value):
+        return [f"{self.name}{self.label_text(key)} {value}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            state = self.series.get(key)
+            if state is None:
+                state = self.series[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += 1
+            state[2] += value
+
+    def render_series(self, key, state):
+        counts, count, total = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"{self.name}_bucket{self.label_text(key, ('le', repr(float(bound))))} {cumulative}")
+        lines.append(f"{self.name}_bucket{self.label_text(key, ('le', '+Inf'))} {count}")
+        lines.append(f"{self.name}_sum{self.label_text(key)} {total}")
+        lines.append(f"{self.name}_count{self.label_text(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram("groovybytes_stage_duration_seconds",
+                                   "Time spent in each pipeline stage.", labels=("service", "stage"))
+STAGE_ITEMS = registry.counter("groovybytes_stage_items_total",
+                               "Rows handled by each pipeline stage.", labels=("service", "stage"))
+STAGE_ERRORS = registry.counter("groovybytes_stage_errors_total",
+                                "Failures in each pipeline stage.", labels=("service", "stage"))
+
+service_name = ""
+# Called with (stage, seconds, items) for every observation, for callers that need
+# each sample rather than the histogram, such as the benchmarks.
+listeners = []
+
+
+def set_service(name):
+    global service_name
+    service_name = name
+
+
+def observe(stage, seconds, items=0):
+    STAGE_SECONDS.observe(seconds, service=service_name, stage=stage)
+    count(stage, items)
+    for listener in listeners:
+        listener(stage, seconds, items)
+
+
+def count(stage, items):
+    if items:
+        STAGE_ITEMS.inc(items, service=service_name, stage=stage)
+
+
+@contextmanager
+def timed(stage, items=0):
+    """Time the block as one observation of stage; errors are counted and re-raised."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(service=service_name, stage=stage)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start, items)
+
+
+def register_endpoint(app, path="/metrics"):
+    def metrics():
+        return registry.render(), 200, {"Content-Type": PROMETHEUS_CONTENT_TYPE}
+
+    app.add_url_rule(path, "metrics", metrics)
@@ -0,0 +1,63 @@
+"""Formatted entity records, as the formatting service sends them on.
+
+A record is a dict of its entity's fields plus an optional "other" list
+holding the source columns no field took, as [{column: value}, ...], and an
+"entity" key naming the schema it was formatted with.
+
+Records formatted from an upload also carry a "source" key: the file, sheet
+and upload id ingestion sent the batch with.
+"""
+import numpy as np
+import pandas as pd
+
+ENTITY_KEY = "entity"
+SOURCE_KEY = "source"
+# Keys that describe the record rather than hold one of its fields.
+METADATA_KEYS = ("other", ENTITY_KEY, SOURCE_KEY)
+# The entity of records from formatting services that did not name it yet.
+UNKNOWN_ENTITY = "Unknown"
+
+
+def entity_type(record):
+    return record.get(ENTITY_KEY) or UNKNOWN_ENTITY
+
+
+def source_of(record):
+    """{"filename", "sheet", "upload_id"} for the record, as far as they are known."""
+    source = record.get(SOURCE_KEY)
+    if isinstance(source, str):
+        # MQTT windows and older ingestion services send a plain label.
+        return {"filename": source}
+    return source or {}
+
+
+def flatten(record):
+    """The record with the columns in "other" moved up next to its fields, without its entity and source."""
+    if not any(key in record for key in METADATA_KEYS):
+        return record
+    row = {key: value for key, value in record.items() if key not in METADATA_KEYS}
+    for entry in record.get("other") or ():
+        row.update(entry)
+    return row
+
+
+def entity_frames(records):
+    """Split a batch of records into one flattened DataFrame per entity type."""
+    groups = {}
+    for record in records:
+        if isinstance(record, dict):
+            groups.setdefault(entity_type(record), []).append(flatten(record))
+    return {entity: pd.DataFrame.from_records(rows) for entity, rows in groups.items()}
+
+
+def numbers(values):
+    """values as a float64 array (NaN where missing) if every present value is a number, else None."""
+    if values.dtype.kind not in "iufb":
+        if values.dtype.kind != "O":
+            return None
+        converted = pd.to_numeric(values, errors="coerce")
+        # Text columns stay text, even when some of their values look like numbers.
+        if converted.count() != values.count():
+            return None
+        values = converted
+    return values.to_numpy(dtype="float64", na_value=np.nan)
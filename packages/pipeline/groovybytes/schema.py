@@ -0,0 +1,156 @@
+"""Compact dtypes for ingested batches, and the schema that records them.
+
+A schema maps each column name to a dtype name pandas understands
+("category", "int16", "Int8", "float32", "datetime64[ns]", ...), so it can
+travel as JSON next to a batch and be reapplied by whoever receives it.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+
+# Rows looked at when deciding whether strings are dates.
+SAMPLE_ROWS = 1000
+# Strings become categorical when at most this share of the values are distinct.
+CATEGORY_RATIO = 0.5
+INT_DTYPES = ("int8", "int16", "int32", "int64")
+
+
+def shrink(frame, schema=None):
+    """Return (frame, schema) with every column converted to the most compact dtype that fits.
+
+    Pass the schema returned for the previous chunk of the same file to keep
+    chunks consistent; columns a chunk does not fit are widened, and new
+    columns are inferred.
+    """
+    schema = dict(schema or {})
+    columns = {}
+    for name in frame.columns:
+        key = str(name)
+        values = frame[name]
+        dtype = schema.get(key)
+        converted = None
+        if dtype is not None:
+            converted = convert(values, dtype)
+        if converted is None:
+            dtype = infer_column(values)
+            converted = convert(values, dtype)
+            if converted is None:
+                dtype, converted = str(values.dtype), values
+        schema[key] = dtype
+        columns[name] = converted
+    return pd.DataFrame(columns, index=frame.index), schema
+
+
+def infer(frame):
+    return {str(name): infer_column(frame[name]) for name in frame.columns}
+
+
+def infer_column(values):
+    kind = values.dtype.kind
+    if kind in "iu":
+        return int_dtype(values.min(), values.max()) if len(values) else "int8"
+    if kind == "f":
+        present = values.dropna()
+        if not len(present):
+            return str(values.dtype)
+        if (present == np.floor(present)).all() and np.isfinite(present).all():
+            # Integers with gaps, which pandas read as floats.
+            return int_dtype(present.min(), present.max()).capitalize()
+        if (present.astype("float32").astype("float64") == present).all():
+            return "float32"
+        return "float64"
+    if kind == "b":
+        return "bool"
+    if kind == "O" or isinstance(values.dtype, pd.StringDtype):
+        present = values.dropna()
+        kind = pd.api.types.infer_dtype(present, skipna=False)
+        if kind == "boolean":
+            return "boolean"
+        if kind != "string":
+            return "object"
+        sample = present.iloc[:SAMPLE_ROWS]
+        if is_datetime(sample):
+            return "datetime64[ns]"
+        # Mostly distinct strings (names, descriptions) usually show in the sample already.
+        if (sample.nunique() <= CATEGORY_RATIO * len(sample)
+                and present.nunique() <= CATEGORY_RATIO * len(present)):
+            return "category"
+        return "object"
+    return str(values.dtype)
+
+
+def int_dtype(low, high):
+    for dtype in INT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return "float64"
+
+
+def is_datetime(strings):
+    # Numbers ("2023", "20240101") would parse too, but are not dates.
+    if pd.to_numeric(strings, errors="coerce").notna().any():
+        return False
+    return parse_datetimes(strings) is not None
+
+
+def parse_datetimes(values):
+    """Parse date strings in the format of the first one, or return None if any does not fit it."""
+    present = values.dropna()
+    date_format = guess_datetime_format(present.iloc[0]) if len(present) else None
+    if date_format is None:
+        return None
+    try:
+        return pd.to_datetime(values, format=date_format)
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+def convert(values, dtype):
+    """Return values as dtype, or None if that would lose or change any of them."""
+    if dtype == str(values.dtype):
+        return values
+    try:
+        if dtype.lower() in INT_DTYPES:
+            present = values.dropna()
+            if len(present):
+                info = np.iinfo(dtype.lower())
+                if not (present == np.floor(present)).all() or present.min() < info.min or present.max() > info.max:
+                    return None
+            if dtype.islower() and len(present) != len(values):
+                return None
+            return values.astype(dtype)
+        if dtype == "float32":
+            converted = values.astype("float32")
+            if not (converted.astype("float64") == values).where(values.notna(), True).all():
+                return None
+            return converted
+        if dtype.startswith("datetime64"):
+            if values.dtype.kind == "M":
+                return values.astype(dtype)
+            return parse_datetimes(values)
+        if dtype == "boolean" and pd.api.types.infer_dtype(values, skipna=True) != "boolean":
+            return None
+        return values.astype(dtype)
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+def apply(frame, schema):
+    """Give the columns of a received batch the dtypes in schema, leaving those that do not fit."""
+    columns = {}
+    for name in frame.columns:
+        dtype = schema.get(str(name))
+        converted = convert(frame[name], dtype) if dtype else None
+        columns[name] = frame[name] if converted is None else converted
+    return pd.DataFrame(columns, index=frame.index)
+
+
+def dumps(schema):
+    return json.dumps(schema, separators=(",", ":"))
+
+
+def loads(text):
+    return json.loads(text) if text else None
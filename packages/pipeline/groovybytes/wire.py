@@ -0,0 +1,242 @@
+"""Encoding of the batches the services send each other.
+
+A batch is a DataFrame or a list of records. Senders pick a format and an
+optional compression; receivers decode whatever the Content-Type and
+Content-Encoding headers say, so both sides never need to agree up front.
+JSON is single-encoded: the body is the array of records itself. A batch
+can carry its groovybytes.schema in a header, which decoding to a DataFrame
+applies.
+"""
+import gzip
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+
+from groovybytes import schema as schemas
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON = "application/json"
+ARROW = "application/vnd.apache.arrow.stream"
+MSGPACK = "application/msgpack"
+
+FORMATS = {"json": JSON, "arrow": ARROW, "msgpack": MSGPACK}
+COMPRESSIONS = ("gzip", "zstd")
+SCHEMA_HEADER = "X-Groovybytes-Schema"
+SOURCE_HEADER = "X-Groovybytes-Source"
+
+# Arrow columns whose values had to be carried as JSON text (nested or mixed types).
+JSON_COLUMNS_KEY = b"groovybytes.json_columns"
+
+
+def content_type(format):
+    if format not in FORMATS:
+        raise ValueError(f'Unknown wire format "{format}", expected one of {", ".join(FORMATS)}')
+    return FORMATS[format]
+
+
+def encode(data, format="json", compression=None, schema=None, source=None):
+    """Return (body, headers) for a DataFrame, a pyarrow Table or a list of records.
+
+    A list of strings is taken to be records that were already serialized to
+    JSON, and is only joined into an array. source labels where the batch
+    came from, such as a file and sheet.
+    """
+    mime = content_type(format)
+    if isinstance(data, pa.Table) and mime != ARROW:
+        data = from_arrow_table(data)
+    if mime == JSON:
+        body = encode_json(data)
+    elif mime == MSGPACK:
+        body = encode_msgpack(data)
+    else:
+        body = encode_arrow(data)
+
+    headers = {"Content-Type": mime}
+    if schema:
+        headers[SCHEMA_HEADER] = schemas.dumps(schema)
+    if source:
+        # Header values are latin-1; anything else is escaped.
+        headers[SOURCE_HEADER] = json.dumps(source)
+    if compression:
+        body = compress(body, compression)
+        headers["Content-Encoding"] = compression
+    return body, headers
+
+
+def decode(body, mime=None, encoding=None, as_frame=False, schema=None):
+    """Decode a body produced by encode into a list of records, or a DataFrame.
+
+    schema (a dict, or the JSON of the schema header) is applied to DataFrames.
+    """
+    if encoding:
+        body = decompress(body, encoding)
+    if isinstance(schema, str):
+        schema = schemas.loads(schema)
+
+    mime = (mime or JSON).split(";")[0].strip().lower()
+    if mime == ARROW:
+        data = decode_arrow(body, as_frame)
+        return schemas.apply(data, schema) if as_frame and schema else data
+
+    if mime == MSGPACK:
+        require(msgpack, "msgpack")
+        records = msgpack.unpackb(body)
+    else:
+        records = json.loads(body)
+        # Older senders posted a JSON string that held the JSON array.
+        if isinstance(records, str):
+            records = json.loads(records)
+
+    if as_frame:
+        frame = pd.DataFrame(records)
+        return schemas.apply(frame, schema) if schema else frame
+    return records
+
+
+def accepted(accept, default="json"):
+    """Pick the format to answer with from an Accept header."""
+    for part in (accept or "").split(","):
+        mime = part.split(";")[0].strip().lower()
+        for format, format_mime in FORMATS.items():
+            if mime == format_mime:
+                return format
+    return default
+
+
+def encode_json(data):
+    if isinstance(data, pd.DataFrame):
+        # Dates stay readable text rather than epoch milliseconds.
+        return data.to_json(orient="records", date_format="iso").encode("utf-8")
+    if data and all(isinstance(record, str) for record in data):
+        return ("[" + ",".join(data) + "]").encode("utf-8")
+    return json.dumps(data).encode("utf-8")
+
+
+def encode_msgpack(data):
+    require(msgpack, "msgpack")
+    if isinstance(data, pd.DataFrame):
+        data = frame_records(data)
+    elif data and isinstance(data[0], str):
+        data = [json.loads(record) for record in data]
+    return msgpack.packb(data, default=str)
+
+
+def frame_records(frame):
+    """The rows of a DataFrame as dicts of plain values, with None for missing ones.
+
+    Dates become ISO text, as in JSON bodies, so a batch reads the same
+    whichever format it travelled in.
+    """
+    dates = [name for name in frame.columns if frame[name].dtype.kind == "M"]
+    frame = frame.astype(object).where(frame.notna(), None)
+    for name in dates:
+        frame[name] = json.loads(frame[name].to_json(orient="values", date_format="iso"))
+    return frame.to_dict("records")
+
+
+def encode_arrow(data):
+    table = arrow_table(data)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def arrow_table(data):
+    """A DataFrame or list of records as a pyarrow Table.
+
+    Columns Arrow cannot type (nested or mixed values) are carried as JSON
+    text and listed in the schema metadata, for from_arrow_table to restore.
+    """
+    if isinstance(data, pa.Table):
+        return data
+    if isinstance(data, pd.DataFrame):
+        columns = {str(name): data[name] for name in data.columns}
+    else:
+        if data and isinstance(data[0], str):
+            data = [json.loads(record) for record in data]
+        names = {}
+        for record in data:
+            names.update(dict.fromkeys(record))
+        columns = {str(name): [record.get(name) for record in data] for name in names}
+
+    arrays = []
+    json_columns = []
+    for name, values in columns.items():
+        try:
+            array = pa.array(values, from_pandas=True)
+            if pa.types.is_nested(array.type):
+                raise pa.ArrowTypeError("nested values are carried as JSON")
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            array = pa.array([None if value is None else json.dumps(value, default=str) for value in values],
+                             type=pa.string())
+            json_columns.append(name)
+        arrays.append(array)
+
+    metadata = {JSON_COLUMNS_KEY: json.dumps(json_columns)} if json_columns else None
+    return pa.Table.from_arrays(arrays, names=list(columns), metadata=metadata)
+
+
+def decode_arrow(body, as_frame=False):
+    return from_arrow_table(pa.ipc.open_stream(body).read_all(), as_frame)
+
+
+def arrow_json_columns(table):
+    """Names of the columns of a Table that arrow_table had to carry as JSON text."""
+    metadata = table.schema.metadata or {}
+    return json.loads(metadata.get(JSON_COLUMNS_KEY, b"[]"))
+
+
+def from_arrow_table(table, as_frame=False):
+    """A Table made by arrow_table as a list of records, or a DataFrame."""
+    json_columns = [name for name in arrow_json_columns(table) if name in table.column_names]
+
+    if as_frame:
+        frame = table.to_pandas()
+        for name in json_columns:
+            frame[name] = [None if value is None else json.loads(value) for value in frame[name]]
+        return frame
+
+    records = table.to_pylist()
+    for name in json_columns:
+        for record in records:
+            if record[name] is not None:
+                record[name] = json.loads(record[name])
+    return records
+
+
+def compress(body, compression):
+    if compression == "gzip":
+        return gzip.compress(body, compresslevel=5)
+    if compression == "zstd":
+        require(zstandard, "zstandard")
+        return zstandard.ZstdCompressor().compress(body)
+    raise ValueError(f'Unknown compression "{compression}", expected one of {", ".join(COMPRESSIONS)}')
+
+
+def decompress(body, encoding):
+    encoding = encoding.strip().lower()
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "zstd":
+        require(zstandard, "zstandard")
+        return zstandard.ZstdDecompressor().decompress(body)
+    if encoding == "identity":
+        return body
+    raise ValueError(f'Unsupported Content-Encoding "{encoding}"')
+
+
+def require(module, name):
+    if module is None:
+        raise ValueError(f'The "{name}" package is required for this wire format but is not installed')
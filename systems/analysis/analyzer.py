@@ -0,0 +1,176 @@
+import os
+import pickle
+import threading
+
+from groovybytes import records as entity_records
+
+from sketches import HyperLogLog, Moments, Quantiles, TopK
+
+DEFAULT_QUANTILES = (0.01, 0.25, 0.5, 0.75, 0.99)
+
+
+class FieldStats:
+    """Everything kept about one field of one entity type; its size does not grow with the data."""
+
+    def __init__(self, hll_precision, quantile_k, top_capacity):
+        self.count = 0
+        self.nulls = 0
+        self.distinct = HyperLogLog(hll_precision)
+        self.top = TopK(top_capacity)
+        # Only for fields whose values have all been numbers.
+        self.moments = Moments()
+        self.quantiles = Quantiles(quantile_k)
+        self.numeric = True
+
+    def update(self, values):
+        present = values.dropna()
+        self.count += len(present)
+        self.nulls += len(values) - len(present)
+        if not len(present):
+            return
+        numbers = entity_records.numbers(present) if self.numeric else None
+        if numbers is None:
+            # One batch of text makes the field text from then on.
+            self.numeric = False
+            present = present.astype(str)
+            self.distinct.update(present)
+            self.top.update(present)
+        else:
+            self.distinct.update(numbers)
+            self.top.update(numbers)
+            self.moments.update(numbers)
+            self.quantiles.update(numbers)
+
+    def describe(self, quantiles=DEFAULT_QUANTILES, top=10):
+        rows = self.count + self.nulls
+        stats = {
+            "count": self.count,
+            "nulls": self.nulls,
+            "null_rate": self.nulls / rows if rows else 0.0,
+            "distinct": self.distinct.count(),
+            "top": self.top.top(top),
+            # Each top count may be short of the true count by up to this much.
+            "top_error": self.top.error,
+        }
+        if self.numeric and self.moments.count:
+            stats.update(self.moments.to_dict())
+            stats["quantiles"] = dict(zip(map(str, quantiles), self.quantiles.quantiles(quantiles)))
+        return stats
+
+
+class Analyzer:
+    """Streaming statistics of the formatted records, by entity type and field.
+
+    Batches are folded in as they arrive and never kept, so statistics over
+    the whole history cost the same to read after a thousand rows as after a
+    billion. Fields absent from a record count as nulls.
+
+    position is where in the dashboard backend's batches the statistics are
+    up to, and is saved with them: {"run", "offset", "received_at"} of the
+    last batch folded in, or None before the first.
+    """
+
+    def __init__(self, hll_precision=12, quantile_k=200, top_capacity=64):
+        self.hll_precision = hll_precision
+        self.quantile_k = quantile_k
+        self.top_capacity = top_capacity
+        self.lock = threading.Lock()
+        # entity -> {"rows": int, "fields": {field: FieldStats}}
+        self.entities = {}
+        self.batches = 0
+        self.position = None
+        self.backfilling = False
+
+    def add(self, records, position=None):
+        frames = entity_records.entity_frames(records)
+        with self.lock:
+            self.batches += 1
+            for entity, frame in frames.items():
+                self.add_frame(entity, frame)
+            if position is not None:
+                self.position = position
+
+    def add_frame(self, entity, frame):
+        """Fold in rows of one entity type, already flattened. Called with the lock held."""
+        stats = self.entities.setdefault(entity, {"rows": 0, "fields": {}})
+        fields = stats["fields"]
+        for name in frame.columns:
+            if str(name) not in fields:
+                field = fields[str(name)] = FieldStats(self.hll_precision, self.quantile_k, self.top_capacity)
+                # Rows from before the field first showed up did not have it.
+                field.nulls = stats["rows"]
+            fields[str(name)].update(frame[name])
+        for name, field in fields.items():
+            if name not in frame.columns:
+                field.nulls += len(frame)
+        stats["rows"] += len(frame)
+
+    def start_backfill(self):
+        """Rows read back from the record store follow, up to finish_backfill."""
+        with self.lock:
+            self.backfilling = True
+
+    def backfill(self, entity, frame):
+        """Fold in rows read back from the record store rather than received."""
+        with self.lock:
+            self.add_frame(entity, frame)
+
+    def finish_backfill(self, position):
+        with self.lock:
+            self.position = position
+            self.backfilling = False
+
+    def summary(self, quantiles=DEFAULT_QUANTILES, top=10):
+        with self.lock:
+            return {"batches": self.batches, "entities": {
+                entity: {"rows": stats["rows"],
+                         "fields": {name: field.describe(quantiles, top) for name, field in stats["fields"].items()}}
+                for entity, stats in self.entities.items()}}
+
+    def field(self, entity, name, quantiles=DEFAULT_QUANTILES, top=10):
+        """The statistics of one field, or None if it has not been seen."""
+        with self.lock:
+            field = self.entities.get(entity, {}).get("fields", {}).get(name)
+            return None if field is None else field.describe(quantiles, top)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def save(self, path):
+        """Snapshot the statistics to path; False if a backfill is under way and nothing was saved."""
+        with self.lock:
+            if self.backfilling:
+                # The position does not cover the rows read back so far, so
+                # after a restart they would be read back, and counted, again.
+                return False
+            body = pickle.dumps(self)
+        # Written aside and renamed, so a crash mid-write keeps the previous snapshot.
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(body)
+        os.replace(f"{path}.tmp", path)
+        return True
+
+    @classmethod
+    def load(cls, path, **options):
+        """The analyzer saved at path, or a new one if there is none yet or it cannot be read."""
+        try:
+            with open(path, "rb") as f:
+                analyzer = pickle.load(f)
+        except FileNotFoundError:
+            return cls(**options)
+        except Exception as e:
+            # Cut short, or not a snapshot of this analyzer: unpickling a bad
+            # file can fail in many ways. The statistics are rebuilt instead.
+            print(f"Could not load the snapshot {path}, starting over: {e}")
+            return cls(**options)
+        if not isinstance(analyzer, cls) or not hasattr(analyzer, "position"):
+            # From before the position was saved; rebuilt rather than counted twice.
+            print(f"The snapshot {path} does not say what it covers, starting over")
+            return cls(**options)
+        return analyzer
@@ -0,0 +1,110 @@
+import requests
+
+from groovybytes import wire, metrics
+
+# The record store's column for when a row was received.
+INGESTED_AT = "ingested_at"
+
+
+class Follower:
+    """Feeds an Analyzer every batch the dashboard backend receives, from where its statistics are up to.
+
+    Batches are read from the backend's ring buffer, after the analyzer's
+    position. Those the ring buffer no longer has, because it dropped them or
+    because the backend restarted, and those from before the analyzer's
+    first batch, are read back from the backend's record store instead.
+    """
+
+    def __init__(self, analyzer, data_url, store_url, query_url, wait=30, batches=100, page_rows=50000,
+                 retry_interval=5, session=None):
+        self.analyzer = analyzer
+        self.data_url = data_url
+        self.store_url = store_url
+        self.query_url = query_url
+        self.wait = wait
+        self.batches = batches
+        self.page_rows = page_rows
+        self.retry_interval = retry_interval
+        self.session = session or requests.Session()
+
+    def run(self, stop):
+        while self.read(stop):
+            pass
+
+    def read(self, stop):
+        """Fold in the next batches, waiting up to wait seconds for one; False if stop was set first."""
+        position = self.analyzer.position
+        params = {"since": 0, "wait": self.wait, "limit": self.batches}
+        if position is not None:
+            params.update(run=position["run"], since=position["offset"])
+        response = self.retrying(stop, lambda: self.session.get(self.data_url, params=params,
+                                                                 timeout=self.wait + 10))
+        if response is None:
+            return False
+        body = response.json()
+
+        until = None
+        if position is None or body["missed"]:
+            # Every batch received before until is in the store, and is read from
+            # there; the ring buffer's batches from until on are read from it.
+            until = body["stored_until"]
+            self.analyzer.start_backfill()
+            if not self.backfill(stop, None if position is None else position["received_at"], until):
+                return False
+        received_at = until
+        for batch in body["batches"]:
+            if until is not None and batch["received_at"] < until:
+                continue
+            received_at = batch["received_at"]
+            with metrics.timed("analyze", items=batch["rows"]):
+                self.analyzer.add(batch["records"], {"run": body["run"], "offset": batch["offset"],
+                                                     "received_at": received_at})
+            metrics.count("analyze", batch["rows"])
+        if until is not None:
+            self.analyzer.finish_backfill({"run": body["run"], "offset": body["cursor"],
+                                           "received_at": received_at})
+        return True
+
+    def backfill(self, stop, after, until):
+        """Fold in the stored records received after after (None: from the first) and before until.
+
+        Returns False if stop was set first.
+        """
+        where = [[INGESTED_AT, "<", until]]
+        if after is not None:
+            where.append([INGESTED_AT, ">", after])
+        response = self.retrying(stop, lambda: self.session.get(self.store_url, timeout=10))
+        if response is None:
+            return False
+        store = response.json()
+        for entity in store["partitions"]:
+            offset = 0
+            while True:
+                response = self.retrying(stop, lambda: self.session.post(
+                    self.query_url, headers={"Accept": wire.ARROW}, timeout=60,
+                    json={"entity": entity, "where": where, "limit": self.page_rows, "offset": offset}))
+                if response is None:
+                    return False
+                frame = wire.decode(response.content, response.headers.get("Content-Type"), as_frame=True)
+                if frame.empty:
+                    break
+                # The columns the store added say where rows came from; they are not fields.
+                with metrics.timed("backfill", items=len(frame)):
+                    self.analyzer.backfill(entity, frame.drop(columns=[name for name in store["source_columns"]
+                                                                       if name in frame.columns]))
+                offset += len(frame)
+            if offset:
+                print(f"Backfilled {offset} {entity} records from the record store")
+        return True
+
+    def retrying(self, stop, send):
+        """The response of send() once it succeeds, trying again every retry_interval; None once stop is set."""
+        while not stop.is_set():
+            try:
+                response = send()
+                response.raise_for_status()
+                return response
+            except requests.RequestException as e:
+                print(f"Could not reach the dashboard backend: {e}")
+                stop.wait(self.retry_interval)
+        return None
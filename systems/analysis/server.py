@@ -0,0 +1,81 @@
+import threading
+from flask import Flask, request, jsonify
+from groovybytes import metrics
+from analyzer import Analyzer, DEFAULT_QUANTILES
+from follower import Follower
+
+STATE_FILE = "analysis_state.pickle"
+SNAPSHOT_INTERVAL = 60  # seconds between saves of the statistics to STATE_FILE
+HLL_PRECISION = 12  # 4096 registers per field, about 1.6% error on distinct counts
+QUANTILE_K = 200  # about 1% rank error on quantiles
+TOP_CAPACITY = 64  # values tracked per field for the top-k lists
+MAX_TOP = TOP_CAPACITY
+# The dashboard backend's ring buffer, read from the last batch analyzed.
+DASHBOARD_DATA_URL = "http://localhost:8502/dashboard_api/data"
+FOLLOW_WAIT = 30  # seconds a read of the ring buffer waits for a new batch
+FOLLOW_BATCHES = 100  # batches taken per read
+RETRY_INTERVAL = 5  # seconds between tries while the dashboard backend cannot be reached
+# The dashboard backend's record store, read back for batches the ring buffer no longer has.
+STORE_URL = "http://localhost:8502/dashboard_api/store"
+STORE_QUERY_URL = "http://localhost:8502/dashboard_api/query"
+BACKFILL_PAGE_ROWS = 50000
+
+app = Flask(__name__)
+app.json.sort_keys = False  # keep fields in entity field order
+metrics.set_service("analysis")
+metrics.register_endpoint(app)
+
+
+def query_options():
+    quantiles = request.args.get("quantiles")
+    if quantiles:
+        quantiles = tuple(float(q) for q in quantiles.split(","))
+        if not all(0 <= q <= 1 for q in quantiles):
+            raise ValueError("quantiles must be between 0 and 1")
+    else:
+        quantiles = DEFAULT_QUANTILES
+    top = min(request.args.get("top", 10, type=int), MAX_TOP)
+    return quantiles, top
+
+@app.route('/analysis/stats')
+def get_stats():
+    try:
+        quantiles, top = query_options()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    return jsonify(analyzer.summary(quantiles, top))
+
+@app.route('/analysis/stats/<entity>/<field>')
+def get_field_stats(entity, field):
+    try:
+        quantiles, top = query_options()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    stats = analyzer.field(entity, field, quantiles, top)
+    if stats is None:
+        return jsonify({"message": f"No field {field} for entity type {entity}"}), 404
+    return jsonify(stats)
+
+def save_periodically(stop):
+    while not stop.wait(SNAPSHOT_INTERVAL):
+        analyzer.save(STATE_FILE)
+
+if __name__ == "__main__":
+    # Statistics cover every batch ever received, so they outlive restarts, and
+    # pick up from the batch they were saved at.
+    analyzer = Analyzer.load(STATE_FILE, hll_precision=HLL_PRECISION, quantile_k=QUANTILE_K,
+                             top_capacity=TOP_CAPACITY)
+    follower = Follower(analyzer, DASHBOARD_DATA_URL, STORE_URL, STORE_QUERY_URL, wait=FOLLOW_WAIT,
+                        batches=FOLLOW_BATCHES, page_rows=BACKFILL_PAGE_ROWS, retry_interval=RETRY_INTERVAL)
+    stop = threading.Event()
+    following = threading.Thread(target=follower.run, args=(stop,), daemon=True)
+    following.start()
+    saver = threading.Thread(target=save_periodically, args=(stop,), daemon=True)
+    saver.start()
+    try:
+        app.run(debug=False, use_reloader=False, port=5002, threaded=True)
+    finally:
+        stop.set()
+        saver.join()
+        following.join(FOLLOW_WAIT + 10)
+        analyzer.save(STATE_FILE)
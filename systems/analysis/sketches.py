@@ -0,0 +1,162 @@
+"""Fixed-size summaries of a stream of values, updated a batch at a time.
+
+Every sketch takes whole numpy arrays or pandas Series, so a batch costs a
+few vectorized passes, and keeps the same (small) amount of memory however
+many values it has seen.
+"""
+import math
+import random
+
+import numpy as np
+import pandas as pd
+
+
+class Moments:
+    """Count, mean, variance, min and max of numbers (Chan et al.'s parallel update)."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, values):
+        n = len(values)
+        if not n:
+            return
+        mean = float(values.mean())
+        m2 = float(((values - mean) ** 2).sum())
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def to_dict(self):
+        if not self.count:
+            return {}
+        variance = self.variance()
+        return {"mean": self.mean, "variance": variance, "std": math.sqrt(variance),
+                "min": self.min, "max": self.max}
+
+
+class HyperLogLog:
+    """Approximate count of distinct values; 2 ** precision one-byte registers.
+
+    The standard error is about 1.04 / sqrt(2 ** precision): 1.6% at the
+    default of 12.
+    """
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    @staticmethod
+    def hashes(values):
+        # Numbers are hashed as floats so 3 and 3.0 count once; anything else as its text.
+        values = pd.Series(values)
+        if values.dtype.kind in "iufb":
+            return pd.util.hash_array(values.to_numpy(dtype="float64"))
+        return pd.util.hash_array(values.astype(str).to_numpy(dtype=object))
+
+    def update(self, values):
+        if not len(values):
+            return
+        hashes = self.hashes(values)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        rest = (hashes << np.uint64(self.precision)) | np.uint64(1 << (self.precision - 1))
+        # Position of the first 1 bit in what is left of the hash.
+        rank = (64 - np.floor(np.log2(rest.astype("float64")))).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.ldexp(1.0, -self.registers.astype(int)).sum()
+        empty = int((self.registers == 0).sum())
+        if estimate <= 2.5 * m and empty:
+            # Linear counting is more accurate while many registers are unset.
+            estimate = m * math.log(m / empty)
+        return int(round(estimate))
+
+
+class Quantiles:
+    """KLL sketch: approximate quantiles of numbers in O(k) memory.
+
+    Level h holds values that each stand for 2 ** h of the originals; a level
+    past its capacity is sorted and every other value moves up a level.
+    Rank error is about 1.7 / k (under 1% at the default of 200).
+    """
+
+    def __init__(self, k=200):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.count = 0
+
+    def capacity(self, level):
+        # Lower levels get smaller capacities; the top level gets k.
+        return max(2, int(math.ceil(self.k * (2 / 3) ** (len(self.levels) - 1 - level))))
+
+    def update(self, values):
+        if not len(values):
+            return
+        self.levels[0] = np.concatenate([self.levels[0], np.asarray(values, dtype="float64")])
+        self.count += len(values)
+        self.compress()
+
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) <= self.capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(items)
+            # An odd one out stays; a random half of the pairs moves up.
+            kept, items = (items[-1:], items[:-1]) if len(items) % 2 else (items[:0], items)
+            self.levels[level] = kept
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], items[random.getrandbits(1)::2]])
+            # Capacities depend on the number of levels, so start over from the bottom.
+            level = 0
+
+    def quantiles(self, qs):
+        if not self.count:
+            return [None] * len(qs)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        values, ranks = values[order], np.cumsum(weights[order])
+        positions = np.searchsorted(ranks, np.asarray(qs) * ranks[-1], side="left")
+        return values[np.minimum(positions, len(values) - 1)].tolist()
+
+
+class TopK:
+    """The most frequent values (Misra-Gries), with counts that are at most off by error."""
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.counts = {}
+        self.error = 0
+
+    def update(self, values):
+        if not len(values):
+            return
+        for value, count in pd.Series(values).value_counts(sort=False).items():
+            value = value.item() if hasattr(value, "item") else value
+            self.counts[value] = self.counts.get(value, 0) + int(count)
+        if len(self.counts) > self.capacity:
+            # Take away the count of the first value that does not fit from every value.
+            cut = sorted(self.counts.values(), reverse=True)[self.capacity]
+            self.counts = {value: count - cut for value, count in self.counts.items() if count > cut}
+            self.error += cut
+
+    def top(self, k=10):
+        return [{"value": value, "count": count}
+                for value, count in sorted(self.counts.items(), key=lambda item: -item[1])[:k]]
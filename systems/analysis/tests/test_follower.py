@@ -0,0 +1,165 @@
+import threading
+
+import pandas as pd
+import requests
+
+from analyzer import Analyzer
+from follower import Follower, INGESTED_AT
+from groovybytes import wire
+
+DATA_URL = "http://dashboard/dashboard_api/data"
+STORE_URL = "http://dashboard/dashboard_api/store"
+QUERY_URL = "http://dashboard/dashboard_api/query"
+
+
+class Response:
+    def __init__(self, body=None, content=None, headers=None, status_code=200):
+        self.body = body
+        self.content = content
+        self.headers = headers or {}
+        self.status_code = status_code
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code != 200:
+            raise requests.HTTPError(f"{self.status_code}")
+
+
+class Backend:
+    """Stands in for the dashboard backend: a ring buffer of the newest batches over a record store."""
+
+    def __init__(self, run="first", keep=10):
+        self.run = run
+        self.keep = keep
+        self.last_offset = 0
+        self.buffer = []
+        self.stored = []
+        self.down = False
+
+    def receive(self, received_at, *names):
+        records = [{"name": name, "entity": "Person"} for name in names]
+        self.stored.extend({"name": name, INGESTED_AT: received_at} for name in names)
+        self.last_offset += 1
+        self.buffer = (self.buffer + [(self.last_offset, received_at, records)])[-self.keep:]
+
+    def restart(self, run):
+        self.run = run
+        self.last_offset = 0
+        self.buffer = []
+
+    def get(self, url, params=None, timeout=None):
+        if self.down:
+            raise requests.ConnectionError("backend is down")
+        if url == STORE_URL:
+            return Response({"partitions": {"Person": {}}, "source_columns": [INGESTED_AT]})
+        since = params["since"]
+        restarted = params.get("run", self.run) != self.run
+        if restarted:
+            since = 0
+        first = self.buffer[0][0] if self.buffer else self.last_offset + 1
+        batches = [batch for batch in self.buffer if batch[0] > since][:params["limit"]]
+        return Response({
+            "run": self.run, "cursor": batches[-1][0] if batches else since,
+            "missed": restarted or since + 1 < first,
+            "stored_until": max((batch[1] for batch in self.buffer), default=0) + 0.5,
+            "batches": [{"offset": offset, "rows": len(records), "received_at": received_at, "records": records}
+                        for offset, received_at, records in batches]})
+
+    def post(self, url, headers=None, timeout=None, json=None):
+        rows = [row for row in self.stored if all(matches(row, *predicate) for predicate in json["where"])]
+        rows = rows[json["offset"]:json["offset"] + json["limit"]]
+        body, headers = wire.encode(pd.DataFrame(rows, columns=["name", INGESTED_AT]), "arrow")
+        return Response(content=body, headers=headers)
+
+
+def matches(row, column, op, value):
+    return row[column] < value if op == "<" else row[column] > value
+
+
+def names(analyzer):
+    stats = analyzer.field("Person", "name")
+    return 0 if stats is None else stats["count"]
+
+
+def follow(analyzer, backend, page_rows=2):
+    follower = Follower(analyzer, DATA_URL, STORE_URL, QUERY_URL, wait=0, page_rows=page_rows,
+                        retry_interval=0, session=backend)
+    return follower.read(threading.Event())
+
+
+def test_a_new_analyzer_reads_the_store_then_follows_the_ring_buffer():
+    backend = Backend(keep=2)
+    backend.receive(1.0, "Ada", "Grace")
+    backend.receive(2.0, "Alan")
+    backend.receive(3.0, "Edsger", "Barbara")
+    analyzer = Analyzer()
+
+    assert follow(analyzer, backend)
+    assert names(analyzer) == 5
+    assert analyzer.position == {"run": "first", "offset": 3, "received_at": 3.5}
+    assert not analyzer.backfilling
+
+    backend.receive(4.0, "Donald")
+    assert follow(analyzer, backend)
+    assert names(analyzer) == 6
+    assert analyzer.position == {"run": "first", "offset": 4, "received_at": 4.0}
+
+
+def test_batches_lost_to_a_backend_restart_are_read_back_from_the_store():
+    backend = Backend()
+    backend.receive(1.0, "Ada")
+    analyzer = Analyzer()
+    follow(analyzer, backend)
+    backend.receive(2.0, "Grace")
+    follow(analyzer, backend)
+    assert analyzer.position["offset"] == 2
+
+    # Received, then lost with the ring buffer when the backend restarted.
+    backend.receive(3.0, "Alan")
+    backend.restart("second")
+    backend.receive(4.0, "Edsger")
+    assert follow(analyzer, backend)
+    assert names(analyzer) == 4
+    assert analyzer.position == {"run": "second", "offset": 1, "received_at": 4.5}
+
+
+def test_batches_dropped_from_the_ring_buffer_are_read_back_from_the_store():
+    backend = Backend(keep=1)
+    analyzer = Analyzer()
+    backend.receive(1.0, "Ada")
+    follow(analyzer, backend)
+    for at, name in enumerate(["Grace", "Alan", "Edsger"], start=2):
+        backend.receive(float(at), name)
+    assert follow(analyzer, backend)
+    assert names(analyzer) == 4
+
+
+def test_a_snapshot_taken_mid_backfill_is_not_saved(tmp_path):
+    path = str(tmp_path / "state.pickle")
+    analyzer = Analyzer()
+    analyzer.start_backfill()
+    analyzer.backfill("Person", pd.DataFrame({"name": ["Ada"]}))
+    assert not analyzer.save(path)
+    analyzer.finish_backfill({"run": "first", "offset": 0, "received_at": 1.0})
+    assert analyzer.save(path)
+    assert names(Analyzer.load(path)) == 1
+
+
+def test_an_unreadable_snapshot_starts_over(tmp_path):
+    path = tmp_path / "state.pickle"
+    Analyzer().save(str(path))
+    path.write_bytes(path.read_bytes()[:20])
+    analyzer = Analyzer.load(str(path), top_capacity=8)
+    assert analyzer.position is None and analyzer.top_capacity == 8
+
+
+def test_reading_stops_while_the_backend_is_down():
+    backend = Backend()
+    backend.down = True
+    stop = threading.Event()
+    follower = Follower(Analyzer(), DATA_URL, STORE_URL, QUERY_URL, wait=0, retry_interval=0.01, session=backend)
+    timer = threading.Timer(0.05, stop.set)
+    timer.start()
+    assert not follower.read(stop)
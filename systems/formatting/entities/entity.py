@@ -1,6 +1,9 @@
 import re
-from rapidfuzz import fuzz
+import sys
+from rapidfuzz import fuzz, process
 
+WHITESPACE = re.compile(r'\s+')
+FUZZY_THRESHOLD = 80
 
 
 class CommonAttributesBuilder:
@@ -35,7 +38,7 @@ class CommonAttributesBuilder:
         return self
 
     def build(self):
-        return self.attributes
+        return AttributeMatcher(self.attributes)
 
     @staticmethod
     def invalid_attribute(name, e):
@@ -45,6 +48,155 @@ class CommonAttributesBuilder:
         exit(9)
 
 
+class AttributeMatcher:
+    """Compiled form of the attributes produced by CommonAttributesBuilder."""
+
+    MAX_CACHED_HEADERS = 4096
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+        self.patterns = []
+        self.weights = []
+        self.synonyms = []
+        self.exact = {}
+
+        for attribute, properties in attributes.items():
+            synonyms = [synonym for synonym, _ in properties["synonyms"]]
+            weights = [weight for _, weight in properties["synonyms"]]
+
+            # One alternation per attribute; the alternatives are tried in synonym
+            # order, so the group that matched is the first synonym that would have.
+            alternatives = "|".join(f"({re.escape(synonym)})" for synonym in synonyms)
+            self.patterns.append(re.compile(r'\b(?:' + alternatives + r')\b', re.IGNORECASE))
+            self.weights.append(weights)
+            self.synonyms.append(synonyms)
+
+            # Exact header -> target field table, first attribute/synonym wins.
+            target_attribute = preprocess_string(attribute)
+            for synonym in synonyms:
+                if properties["fuzzy_map"]:
+                    target = properties["fuzz_map"].get(synonym, synonym)
+                elif not properties["fuzzy_match"]:
+                    target = target_attribute
+                else:
+                    target = synonym
+                self.exact.setdefault(synonym, target)
+
+        self.header_scores = {}
+        self.header_targets = {}
+
+    def score(self, headers):
+        score = 0
+        for header in headers:
+            for current_score in self.score_header(header):
+                score += current_score
+
+        return score / 100
+
+    def score_header(self, header):
+        scores = self.header_scores.get(header)
+        if scores is None:
+            scores = self.compute_header_scores(preprocess_string(header))
+            if len(self.header_scores) >= self.MAX_CACHED_HEADERS:
+                self.header_scores.clear()
+            self.header_scores[header] = scores
+        return scores
+
+    def compute_header_scores(self, header):
+        scores = []
+        for pattern, synonyms, weights in zip(self.patterns, self.synonyms, self.weights):
+            match = pattern.match(header)
+            if match:
+                scores.append(100 * weights[match.lastindex - 1])
+                continue
+
+            # Highest weight among synonyms above the threshold, earliest on ties.
+            current_score = 0
+            max_weight = 0
+            best_index = -1
+            for _, similarity, index in process.extract(header, synonyms, scorer=fuzz.ratio,
+                                                        score_cutoff=FUZZY_THRESHOLD, limit=None):
+                weight = weights[index]
+                if similarity > FUZZY_THRESHOLD and (weight > max_weight or
+                                                     (weight == max_weight and index < best_index)):
+                    max_weight = weight
+                    best_index = index
+                    current_score = similarity * weight
+            scores.append(current_score)
+
+        return tuple(scores)
+
+    def target(self, header):
+        target = self.header_targets.get(header)
+        if target is None:
+            processed_header = preprocess_string(header)
+            target = self.exact.get(processed_header, processed_header)
+            if len(self.header_targets) >= self.MAX_CACHED_HEADERS:
+                self.header_targets.clear()
+            self.header_targets[header] = target
+        return target
+
+
+class EntitySchema:
+    """Field layout shared by every record of one entity class."""
+
+    registry = {}
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = tuple(fields)
+        self.index = {field: i for i, field in enumerate(self.fields)}
+        self.empty = (None,) * len(self.fields)
+        EntitySchema.registry[name] = self
+
+    @staticmethod
+    def get(name):
+        return EntitySchema.registry[name]
+
+    def __reduce__(self):
+        # Records sent between processes resolve to the already loaded schema.
+        return EntitySchema.get, (self.name,)
+
+    def record(self):
+        return EntityRecord(self)
+
+
+class EntityRecord:
+    """One formatted row.
+
+    values holds one entry per schema field followed by the overflow values,
+    whose keys are in other_keys. Records built from the same mapping plan
+    share a single other_keys tuple. source is where the row was ingested
+    from, when that is known.
+    """
+
+    __slots__ = ("schema", "values", "other_keys", "source")
+
+    def __init__(self, schema, values=None, other_keys=()):
+        self.schema = schema
+        self.values = list(schema.empty) if values is None else values
+        self.other_keys = other_keys
+        self.source = None
+
+    def set(self, key, value):
+        index = self.schema.index.get(key)
+        if index is not None:
+            self.values[index] = value
+        else:
+            self.other_keys += (sys.intern(key),)
+            self.values.append(value)
+
+    def to_dict(self):
+        data = dict(zip(self.schema.fields, self.values))
+        if self.other_keys:
+            overflow = self.values[len(self.schema.fields):]
+            data["other"] = [{key: value} for key, value in zip(self.other_keys, overflow)]
+        data["entity"] = self.schema.name
+        if self.source is not None:
+            data["source"] = self.source
+        return data
+
+
 class Entity:
 
     @staticmethod
@@ -53,64 +205,20 @@ class Entity:
 
     @staticmethod
     def score_attributes(headers, attributes):
-        score = 0
-        for header in headers:
-            header = preprocess_string(header)
-            for (attribute, properties) in attributes.items():
-                max_weight = 0
-                current_score = 0
-                for synonym_property in properties["synonyms"]:
-                    synonym, weight = synonym_property
-                    pattern = r'\b' + re.escape(synonym) + r'\b'
-                    if re.match(pattern, header, re.IGNORECASE):
-                        current_score = 100 * weight
-                        break
-
-                    similarity = fuzz.ratio(header, synonym)
-                    if similarity > 80 and weight > max_weight:
-                        max_weight = weight
-                        current_score = similarity * weight
-                score += current_score
-
-        return score / 100
+        return attributes.score(headers)
 
     @staticmethod
     def match_headers(data, common_attributes, entity_data):
-        headers = list(data.keys())
-        for header in headers:
-            processed_header = preprocess_string(header)
-            found = False
-            for attribute, properties in common_attributes.items():
-               attribute = preprocess_string(attribute)
-               synonyms = properties["synonyms"]
-               fuzzy_match = properties["fuzzy_match"]
-               fuzzy_map = properties["fuzzy_map"]
-               fuzz_map = properties["fuzz_map"]
-               for synonym, _ in synonyms:
-                   if processed_header == synonym:
-                       found = True
-                       if fuzzy_map:
-                           if synonym in fuzz_map:
-                               mapped_name  = fuzz_map[synonym]
-                               update_entity_data(entity_data, mapped_name, data[header])
-                               break
-                           else:
-                               update_entity_data(entity_data, processed_header, data[header])
-                               break
-                       elif not fuzzy_match:
-                           update_entity_data(entity_data, attribute, data[header])
-                           break
-                       else:
-                           update_entity_data(entity_data, synonym, data[header])
-                           break
-               if found:
-                   break
-            if not found:
-                update_entity_data(entity_data, processed_header, data[header])
+        for header, value in data.items():
+            update_entity_data(entity_data, common_attributes.target(header), value)
 
         return entity_data
 
 def update_entity_data(entity_data, key, value):
+    if isinstance(entity_data, EntityRecord):
+        entity_data.set(key, value)
+        return entity_data
+
     if key in entity_data:
         entity_data[key] = value
     else:
@@ -122,5 +230,5 @@ def update_entity_data(entity_data, key, value):
 
 def preprocess_string(string):
     string = string.strip().lower()
-    string = re.sub(r'\s+', " ", string)
+    string = WHITESPACE.sub(" ", string)
     return string
\ No newline at end of file
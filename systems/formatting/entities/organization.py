@@ -1,6 +1,6 @@
 import traceback
 
-from .entity import Entity, CommonAttributesBuilder
+from .entity import Entity, EntitySchema, CommonAttributesBuilder
 
 class Organization(Entity):
     builder = CommonAttributesBuilder()
@@ -43,25 +43,20 @@ class Organization(Entity):
     except AttributeError:
         CommonAttributesBuilder.invalid_attribute(__name__, traceback.format_exc())
 
+    schema = EntitySchema("Organization", [
+        "organization name", "personal name", "first name", "last name", "email",
+        "location", "city", "address", "country", "industry", "employees", "founded",
+        "filename"])
+
     def __init__(self):
-        self.data = {
-            "organization name": None,
-            "personal name": None,
-            "first name": None,
-            "last name": None,
-            "email": None,
-            "location": None,
-            "city": None,
-            "address": None,
-            "country": None,
-            "industry": None,
-            "employees": None,
-            "founded": None,
-            "filename": None,
-        }
+        self.record = self.schema.record()
+
+    @property
+    def data(self):
+        return self.record.to_dict()
 
     def add_data(self, data):
-        self.data = Entity.match_headers(data, self.common_attributes, self.data)
+        self.record = Entity.match_headers(data, self.common_attributes, self.record)
 
     @classmethod
     def score_attributes(cls, headers):
@@ -1,4 +1,4 @@
-from .entity import Entity, CommonAttributesBuilder
+from .entity import Entity, EntitySchema, CommonAttributesBuilder
 import traceback
 
 class Person:
@@ -55,31 +55,20 @@ class Person:
         CommonAttributesBuilder.invalid_attribute(__name__, traceback.format_exc())
 
 
+    schema = EntitySchema("Person", [
+        "name", "full name", "first name", "last name", "sex", "gender", "age",
+        "birthday", "race", "ethnicity", "nationality", "job", "address", "location",
+        "country", "city", "email", "phone", "filename"])
+
     def __init__(self):
-        self.data = {
-            "name": None,
-            "full name": None,
-            "first name": None,
-            "last name": None,
-            "sex": None,
-            "gender": None,
-            "age": None,
-            "birthday": None,
-            "race": None,
-            "ethnicity": None,
-            "nationality": None,
-            "job": None,
-            "address": None,
-            "location": None,
-            "country": None,
-            "city": None,
-            "email": None,
-            "phone": None,
-            "filename": None,
-        }
+        self.record = self.schema.record()
+
+    @property
+    def data(self):
+        return self.record.to_dict()
 
     def add_data(self, data):
-        self.data = Entity.match_headers(data, self.common_attributes, self.data)
+        self.record = Entity.match_headers(data, self.common_attributes, self.record)
 
     @classmethod
     def score_attributes(cls, headers):
@@ -1,5 +1,5 @@
 import traceback
-from .entity import Entity, CommonAttributesBuilder
+from .entity import Entity, EntitySchema, CommonAttributesBuilder
 
 class Report(Entity):
     builder = CommonAttributesBuilder()
@@ -26,20 +26,19 @@ class Report(Entity):
         CommonAttributesBuilder.invalid_attribute(__name__, traceback.format_exc())
 
 
+    schema = EntitySchema("Report", [
+        "account", "currency", "sales", "expenses", "profit", "sold", "revenue",
+        "filename"])
+
     def __init__(self):
-        self.data = {
-            "account": None,
-            "currency": None,
-            "sales": None,
-            "expenses": None,
-            "profit": None,
-            "sold": None,
-            "revenue": None,
-            "filename": None,
-        }
+        self.record = self.schema.record()
+
+    @property
+    def data(self):
+        return self.record.to_dict()
 
     def add_data(self, data):
-        self.data = Entity.match_headers(data, self.common_attributes, self.data)
+        self.record = Entity.match_headers(data, self.common_attributes, self.record)
 
     @classmethod
     def score_attributes(cls, headers):
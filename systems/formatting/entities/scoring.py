@@ -0,0 +1,109 @@
+import re
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from .entity import FUZZY_THRESHOLD, preprocess_string
+
+BOUNDARY = re.compile(r'\b')
+
+
+class EntityScorer:
+    """Scores a set of headers against every registered entity in one pass.
+
+    All synonyms of all entities are laid out as the columns of a single
+    similarity matrix computed with process.cdist, so adding entities or
+    synonyms widens one vectorized call instead of adding Python loops.
+    """
+
+    def __init__(self, entities):
+        self.entities = list(entities)
+        self.choices = []
+        weights = []
+        self.exact = {}
+        self.attribute_slices = []
+        self.attribute_bounds = []
+
+        attribute_index = 0
+        for entity in self.entities:
+            matcher = entity.common_attributes
+            slices = []
+            for synonyms, synonym_weights in zip(matcher.synonyms, matcher.weights):
+                start = len(self.choices)
+                self.choices.extend(synonyms)
+                weights.extend(synonym_weights)
+                slices.append((start, len(self.choices)))
+
+                # Word-boundary prefix lookups replace the per-attribute regex.
+                for order, (synonym, weight) in enumerate(zip(synonyms, synonym_weights)):
+                    self.exact.setdefault(synonym, []).append((attribute_index, order, weight))
+                attribute_index += 1
+
+            self.attribute_slices.append(slices)
+            self.attribute_bounds.append(np.array([100 * max(w) for w in matcher.weights]))
+
+        self.weights = np.array(weights, dtype=np.float64)
+        self.attribute_count = attribute_index
+
+    def best_match(self, headers):
+        headers = [preprocess_string(header) for header in headers]
+        if not headers:
+            return self.entities[0]
+
+        exact_scores = self.exact_scores(headers)
+        similarity = process.cdist(headers, self.choices, scorer=fuzz.ratio,
+                                   score_cutoff=FUZZY_THRESHOLD, dtype=np.float64)
+        candidate_weights = np.where(similarity > FUZZY_THRESHOLD, self.weights, 0)
+        rows = np.arange(len(headers))
+
+        leader, leader_score = None, None
+        offset = 0
+        for entity, slices, bounds in zip(self.entities, self.attribute_slices, self.attribute_bounds):
+            columns = np.empty((len(headers), len(slices)))
+            remaining = len(headers) * bounds.sum()
+            pruned = False
+            for i, (start, stop) in enumerate(slices):
+                # First synonym with the highest weight among those above the threshold.
+                weights = candidate_weights[:, start:stop]
+                best = weights.argmax(axis=1)
+                chosen = weights[rows, best]
+                fuzzy = np.where(chosen > 0, similarity[rows, start + best] * chosen, 0)
+                exact = exact_scores[:, offset + i]
+                columns[:, i] = np.where(np.isnan(exact), fuzzy, exact)
+
+                # Stop once this entity cannot reach the leader's score even with full
+                # marks on the rest. One that could still tie is scored: a tie keeps
+                # the leader anyway, and the margin keeps rounding in this sum from
+                # pruning an entity whose full score would beat it.
+                remaining -= len(headers) * bounds[i]
+                if leader is not None and columns[:, :i + 1].sum() + remaining < leader_score * 100 - 1e-6:
+                    pruned = True
+                    break
+            offset += len(slices)
+            if pruned:
+                continue
+
+            # Accumulate header by header, like Entity.score_attributes does.
+            score = 0
+            for current_score in columns.ravel().tolist():
+                score += current_score
+            score /= 100
+            if leader is None or score > leader_score:
+                leader, leader_score = entity, score
+
+        return leader
+
+    def exact_scores(self, headers):
+        scores = np.full((len(headers), self.attribute_count), np.nan)
+        for row, header in enumerate(headers):
+            first = {}
+            boundaries = [match.start() for match in BOUNDARY.finditer(header)]
+            if not boundaries or boundaries[0] != 0:
+                continue
+            for end in boundaries[1:]:
+                for attribute_index, order, weight in self.exact.get(header[:end], ()):
+                    if attribute_index not in first or order < first[attribute_index][0]:
+                        first[attribute_index] = (order, weight)
+            for attribute_index, (_, weight) in first.items():
+                scores[row, attribute_index] = 100 * weight
+
+        return scores
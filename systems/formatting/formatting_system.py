@@ -1,64 +1,210 @@
 import ast
-import time
 import json
+import time
 import threading
+import multiprocessing
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from entities.person import Person
 from entities.organization import Organization
 from entities.report import Report
+from entities.scoring import EntityScorer
+from entities.entity import EntityRecord
+from mapping_plan import MappingPlan, MappingPlanCache
 from rich.console import Console
 from rich.progress import Progress
 from rich.logging import RichHandler
+from groovybytes import metrics, wire
 
+ENTITIES = [Person, Organization, Report]
 
-class FormattingSystem:
+worker_system = None
 
-    def __init__(self, input_sink, out_sink, console=Console()):
-        self.in_sink = input_sink
-        self.out_sink = out_sink
-        self.lock = threading.Lock()
-        self.console = console
 
-    def process_queue(self):
-        while not self.in_sink.is_empty():
-            items = self.in_sink.dequeue()
+def format_shard(items, columnar, plan):
+    # Runs in a pool worker. The parent has already classified the batch; rows
+    # with other keys fall back to the worker's own plan cache.
+    global worker_system
+    if worker_system is None:
+        worker_system = FormattingSystem(None, None, columnar=columnar)
+    return worker_system.format_items(items, plan)
 
-            entity_class = None
-            prev_headers = None
 
-            with Progress() as progress:
-                task = progress.add_task(f'Processing {len(items)} item(s)...',
-                                         total=len(items),
-                                         style='bold green')
-                for i, item in enumerate(items):
-                    headers = self.get_column_headers(item.keys())
-                    if prev_headers != headers or entity_class is None:
-                        prev_headers = headers
-                        entity_class = self.fitness_score(headers)
-                        entity = entity_class()
-                    else:
-                        entity = entity_class()
+def json_values(column):
+    """The values of a column as JSON text: missing ones as null, dates as ISO text, like wire.frame_records."""
+    if column.dtype.kind == "M":
+        values = json.loads(column.to_json(orient="values", date_format="iso"))
+    else:
+        values = column.astype(object).where(column.notna(), None).tolist()
+    return list(map(json.dumps, values))
 
-                    entity.add_data(item)
-                    json_data = json.dumps(entity.data)
-                    self.out_sink.enqueue(json_data)
 
-                    progress.update(task, advance=1)
+def prefixed(prefix, values, suffix=''):
+    return [prefix + value + suffix for value in values]
 
-            self.console.print('\nCompleted processing items.', style='green')
 
-    @staticmethod
-    def fitness_score(headers):
-        person_score = Person.score_attributes(headers)
-        organization_score = Organization.score_attributes(headers)
-        report_score = Report.score_attributes(headers)
-        scoreboard = {Person: person_score,
-                      Organization: organization_score,
-                      Report: report_score}
-
-        top_scorer = max(scoreboard, key=scoreboard.get)
-        # print(f'\nThis document relates to a(n) {top_scorer.__name__}.\n'
-        #            f'All entries in this document will be treated as such.')
-        return top_scorer
+class Batch:
+    """A received batch and its source: the file, sheet and upload id ingestion sent it with."""
+
+    __slots__ = ("items", "source")
+
+    def __init__(self, items, source=None):
+        self.items = items
+        self.source = source
+
+    def __len__(self):
+        return len(self.items)
+
+
+def with_source(output, source):
+    """Tag formatted output (an EntityRecord or a list of JSON lines) with the source of its batch."""
+    if isinstance(output, EntityRecord):
+        output.source = source
+        return output
+    suffix = f', "source": {json.dumps(source)}}}'
+    return [line[:-1] + suffix for line in output]
+
+
+class FormattingSystem:
+    scorer = EntityScorer(ENTITIES)
+
+    def __init__(self, input_sink, out_sink, console=Console(), plan_cache=None, columnar=False,
+                 workers=1, shard_size=5000, show_progress=True):
+        self.in_sink = input_sink
+        self.out_sink = out_sink
+        self.lock = threading.Lock()
+        self.console = console
+        self.plans = plan_cache if plan_cache is not None else MappingPlanCache(ENTITIES)
+        self.columnar = columnar
+        self.shard_size = shard_size
+        self.show_progress = show_progress
+        self.executor = None
+        if workers > 1:
+            # Spawned rather than forked: the server forks from a process that is
+            # already running scheduler and Flask threads.
+            self.executor = ProcessPoolExecutor(max_workers=workers,
+                                                mp_context=multiprocessing.get_context("spawn"))
+
+    def process_queue(self):
+        # The scheduler may start overlapping runs; only one drains the queue so
+        # batches leave in the order they arrived.
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            while not self.in_sink.is_empty():
+                items = self.in_sink.dequeue()
+                source = None
+                if isinstance(items, Batch):
+                    items, source = items.items, items.source
+
+                with Progress(disable=not self.show_progress) as progress:
+                    task = progress.add_task(f'Processing {len(items)} item(s)...',
+                                             total=len(items),
+                                             style='bold green')
+                    start = time.perf_counter()
+                    for shard, formatted in self.format_shards(items):
+                        metrics.observe("map", time.perf_counter() - start, len(shard))
+                        for output in formatted:
+                            self.out_sink.enqueue(output if source is None else with_source(output, source))
+                        progress.update(task, advance=len(shard))
+                        start = time.perf_counter()
+
+                if self.show_progress:
+                    self.console.print('\nCompleted processing items.', style='green')
+        finally:
+            self.lock.release()
+
+    def format_shards(self, items):
+        if self.executor is None or len(items) <= self.shard_size:
+            return [(items, self.format_items(items))]
+
+        if isinstance(items, pd.DataFrame):
+            headers = self.get_column_headers(items.columns)
+            shards = [items.iloc[i:i + self.shard_size] for i in range(0, len(items), self.shard_size)]
+        else:
+            headers = self.get_column_headers(items[0].keys())
+            shards = [items[i:i + self.shard_size] for i in range(0, len(items), self.shard_size)]
+        plan = self.plan_for(headers)
+        # map yields results in submission order, which keeps the batch in order.
+        return zip(shards, self.executor.map(format_shard, shards, [self.columnar] * len(shards),
+                                             [plan] * len(shards)))
+
+    def format_items(self, items, plan=None):
+        if self.columnar:
+            # JSON records keep their Python types in object columns, so ints
+            # next to nulls are not widened to floats.
+            frame = items if isinstance(items, pd.DataFrame) else pd.DataFrame(items, dtype=object)
+            return [self.format_frame(frame, plan)]
+
+        if isinstance(items, pd.DataFrame):
+            # Dates from Arrow batches become ISO text, as in JSON batches.
+            items = wire.frame_records(items)
+
+        records = []
+        prev_keys = plan.mapping.keys() if plan is not None else None
+        for item in items:
+            # Rows of one upload share their keys, so this is usually a
+            # single plan lookup per batch.
+            keys = item.keys()
+            if plan is None or keys != prev_keys:
+                prev_keys = keys
+                plan = self.plan_for(self.get_column_headers(keys))
+
+            records.append(plan.apply(item))
+
+        return records
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+    def format_frame(self, frame, plan=None):
+        """Format a whole batch at once, returning one JSON document per row.
+
+        All rows are treated as having every column of the frame, which is how
+        ingestion sends them.
+        """
+        headers = self.get_column_headers(frame.columns)
+        if plan is None or plan.mapping.keys() != set(headers):
+            plan = self.plan_for(headers)
+        fields = plan.fields
+
+        # Later columns win when several map to the same field, as in update_entity_data.
+        sources = {}
+        overflow = []
+        for header in headers:
+            target = plan.mapping[header]
+            if target in fields:
+                sources[target] = header
+            else:
+                overflow.append((target, header))
+
+        with metrics.timed("serialize", items=len(frame)):
+            # Each row is joined from its values' JSON text, written with
+            # json.dumps as the per-row path writes whole records.
+            parts = [prefixed(f'{json.dumps(field)}: ', json_values(frame[sources[field]]))
+                     if field in sources else [f'{json.dumps(field)}: null'] * len(frame)
+                     for field in fields]
+            if overflow:
+                packed = [prefixed(f'{{{json.dumps(target)}: ', json_values(frame[header]), '}')
+                          for target, header in overflow]
+                parts.append([f'"other": [{", ".join(other)}]' for other in zip(*packed)])
+            parts.append([f'"entity": {json.dumps(plan.schema.name)}'] * len(frame))
+            lines = [f'{{{", ".join(row)}}}' for row in zip(*parts)]
+
+        return lines
+
+    def plan_for(self, headers):
+        plan = self.plans.get(headers)
+        if plan is None:
+            with metrics.timed("classify", items=len(headers)):
+                plan = MappingPlan.compile(self.fitness_score(headers), headers)
+            self.plans.put(headers, plan)
+        return plan
+
+    @classmethod
+    def fitness_score(cls, headers):
+        return cls.scorer.best_match(headers)
 
     @staticmethod
     def get_column_headers(keys):
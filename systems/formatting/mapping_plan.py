@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from entities.entity import EntityRecord
+
+
+def fingerprint(headers):
+    return hashlib.sha1("\x1f".join(sorted(headers)).encode("utf-8")).hexdigest()
+
+
+class MappingPlan:
+    """Which source key goes to which entity field (or into "other") for one header set."""
+
+    def __init__(self, entity, mapping):
+        self.entity = entity
+        self.mapping = mapping
+        self.schema = entity.schema
+        self.fields = entity.schema.fields
+
+        # Each source key gets a slot: its field, or its own place after the fields.
+        self.positions = {}
+        other_keys = []
+        for key, target in mapping.items():
+            index = self.schema.index.get(target)
+            if index is None:
+                index = len(self.fields) + len(other_keys)
+                other_keys.append(sys.intern(target))
+            self.positions[key] = index
+        self.other_keys = tuple(other_keys)
+        self.width = len(self.fields) + len(other_keys)
+
+    @classmethod
+    def compile(cls, entity, headers):
+        matcher = entity.common_attributes
+        return cls(entity, {header: matcher.target(header) for header in headers})
+
+    def apply(self, item):
+        values = [None] * self.width
+        positions = self.positions
+        for key, value in item.items():
+            position = positions.get(key)
+            if position is None:
+                return self.apply_unplanned(item)
+            values[position] = value
+
+        if len(item) != len(positions):
+            return self.apply_unplanned(item)
+        return EntityRecord(self.schema, values, self.other_keys)
+
+    def apply_unplanned(self, item):
+        # Keys outside the plan: map them one by one, like Entity.match_headers.
+        record = self.schema.record()
+        for key, value in item.items():
+            target = self.mapping.get(key)
+            if target is None:
+                target = self.entity.common_attributes.target(key)
+            record.set(target, value)
+        return record
+
+
+class MappingPlanCache:
+    """LRU of mapping plans keyed by header-set fingerprint, optionally saved to disk."""
+
+    def __init__(self, entities, max_size=256, path=None):
+        self.entities = {entity.__name__: entity for entity in entities}
+        self.max_size = max_size
+        self.path = path
+        self.plans = OrderedDict()
+        self.lock = threading.Lock()
+        self.signature = hashlib.sha1(json.dumps(
+            {name: entity.common_attributes.attributes for name, entity in self.entities.items()},
+            sort_keys=True).encode("utf-8")).hexdigest()
+
+        if path and os.path.exists(path):
+            self.load()
+
+    def get(self, headers):
+        key = fingerprint(headers)
+        with self.lock:
+            plan = self.plans.get(key)
+            if plan is not None:
+                self.plans.move_to_end(key)
+            return plan
+
+    def put(self, headers, plan):
+        with self.lock:
+            self.plans[fingerprint(headers)] = plan
+            while len(self.plans) > self.max_size:
+                self.plans.popitem(last=False)
+        if self.path:
+            self.save()
+
+    def __len__(self):
+        return len(self.plans)
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not load mapping plans from {self.path}: {e}")
+            return
+
+        # Plans compiled against different entity definitions are stale.
+        if stored.get("signature") != self.signature:
+            return
+
+        for key, plan in stored.get("plans", {}).items():
+            entity = self.entities.get(plan["entity"])
+            if entity is not None:
+                self.plans[key] = MappingPlan(entity, plan["mapping"])
+        while len(self.plans) > self.max_size:
+            self.plans.popitem(last=False)
+
+    def save(self):
+        with self.lock:
+            stored = {
+                "signature": self.signature,
+                "plans": {key: {"entity": plan.entity.__name__, "mapping": plan.mapping}
+                          for key, plan in self.plans.items()}
+            }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(stored, f)
+        os.replace(tmp_path, self.path)
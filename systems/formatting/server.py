@@ -1,37 +1,197 @@
 import json
 import requests
 from flask import Flask, request, jsonify
-from queue import Queue
-from formatting_system import FormattingSystem
+import time
+import threading
+from collections import deque
+from queue import Full
+from formatting_system import FormattingSystem, Batch, ENTITIES
+from mapping_plan import MappingPlanCache
+from entities.entity import EntityRecord
 from apscheduler.schedulers.background import BackgroundScheduler
 from rich.console import Console
+from groovybytes import wire, metrics
 
 OUTPUT_URL = "http://localhost:8502/dashboard_api/data"
+PLAN_CACHE_FILE = "mapping_plans.json"
+PLAN_CACHE_SIZE = 256
+COLUMNAR_FORMATTING = False
+# Above 1, batches larger than a shard are formatted in a pool of this many processes.
+FORMATTING_WORKERS = 1
+FORMATTING_SHARD_SIZE = 5000
+PROCESS_INTERVAL = 2
+INPUT_CAPACITY = 500000
+OUTPUT_BATCH_SIZE = 5000
+OUTPUT_BATCH_BYTES = 4 * 1024 * 1024
+OUTPUT_MAX_LATENCY = 2.0
+OUTPUT_CAPACITY = 200000
+OUTPUT_WIRE_FORMAT = "json"
+OUTPUT_WIRE_COMPRESSION = None
+FLUSH_RETRY_INTERVAL = 5.0  # seconds before a batch that could not be sent is tried again
+SHOW_PROGRESS = True
 console = Console()
 
 app = Flask(__name__)
+metrics.set_service("formatting")
+metrics.register_endpoint(app)
+
+
+class SendFailed(Exception):
+    """A batch did not reach the output; sent is how many of its rows did before it failed."""
+
+    def __init__(self, message, sent=0):
+        super().__init__(message)
+        self.sent = sent
 
 
 class Sink:
-    def __init__(self, url=None, max_items=100):
+    """Bounded queue that flushes downstream by row count, byte size or age.
+
+    Sizes are counted in rows: a formatted record is one row, a batch (a list
+    of records or of JSON documents, or a DataFrame) is as many rows as it
+    holds. enqueue blocks, or raises queue.Full, once capacity rows are waiting.
+    With max_bytes, the queued rows are also counted in bytes, and a flush is
+    due once they reach it.
+    """
+
+    def __init__(self, url=None, max_items=100, max_bytes=None, max_latency=None, capacity=None,
+                 format="json", compression=None):
         self.MAX_ITEM_COUNT = max_items
-        self.q = Queue()
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self.capacity = capacity
+        self.q = deque()
+        self.size = 0
+        self.bytes = 0
+        self.cond = threading.Condition()
+        self.send_lock = threading.Lock()
         self.url = url
+        self.format = format
+        self.compression = compression
+        self.session = requests.Session()
+
+    @staticmethod
+    def item_size(item):
+        return 1 if isinstance(item, (str, EntityRecord)) else len(item)
 
+    def measure(self, item):
+        """item as it is queued, and its size in bytes when there is a byte limit.
 
-    def enqueue(self, item):
-        self.q.put(item)
+        JSON rows are serialized here rather than when they are sent, so their
+        size is exact. For the other formats the text of the values stands in
+        for their encoded size.
+        """
+        if self.max_bytes is None:
+            return item, 0
+        if self.format == "json":
+            item = self.rows(item)
+            return item, sum(map(len, item))
+        rows = [item] if isinstance(item, (str, EntityRecord)) else item
+        return item, sum(len(row) if isinstance(row, str) else len(str(row.values)) for row in rows)
+
+    def enqueue(self, item, block=True, timeout=None):
+        size = self.item_size(item)
+        item, nbytes = self.measure(item)
+        with self.cond:
+            # A batch larger than the whole capacity still goes through on its own.
+            if self.capacity is not None and not self.cond.wait_for(
+                    lambda: self.size == 0 or self.size + size <= self.capacity,
+                    timeout if block else 0):
+                raise Full
+            self.q.append((time.monotonic(), item, size, nbytes))
+            self.size += size
+            self.bytes += nbytes
+            self.cond.notify_all()
 
     def dequeue(self):
-        return self.q.get()
+        with self.cond:
+            self.cond.wait_for(lambda: self.q)
+            queued_at, item, size, nbytes = self.q.popleft()
+            self.size -= size
+            self.bytes -= nbytes
+            self.cond.notify_all()
+        metrics.observe("queue_wait", time.monotonic() - queued_at, size)
+        return item
 
     def is_empty(self):
-        return self.q.empty()
+        return not self.q
 
     def get_size(self):
-        return self.q.qsize()
+        return self.size
+
+    def should_flush(self):
+        with self.cond:
+            if not self.q:
+                return False
+            if self.size >= self.MAX_ITEM_COUNT:
+                return True
+            if self.max_bytes is not None and self.bytes >= self.max_bytes:
+                return True
+            return self.max_latency is not None and time.monotonic() - self.q[0][0] >= self.max_latency
+
+    def run_flusher(self, stop, retry_interval=FLUSH_RETRY_INTERVAL):
+        # Woken by every enqueue, and otherwise when the oldest item is due.
+        while not stop.is_set():
+            with self.cond:
+                timeout = 1.0
+                if self.q and self.max_latency is not None:
+                    timeout = max(0.0, self.max_latency - (time.monotonic() - self.q[0][0]))
+                self.cond.wait(timeout)
+            try:
+                if self.should_flush():
+                    self.send_output()
+            except Exception as e:
+                # The batch is back in the queue; the thread lives on to retry it.
+                console.print(f"\nCould not send formatted data, retrying in {retry_interval}s: {e!r}",
+                              style='red')
+                stop.wait(retry_interval)
+
+    def rows(self, item):
+        # JSON bodies are spliced from serialized rows; other formats need the dicts.
+        if isinstance(item, (str, EntityRecord)):
+            item = [item]
+        if self.format == "json":
+            return [row if isinstance(row, str) else json.dumps(row.to_dict()) for row in item]
+        return [json.loads(row) if isinstance(row, str) else row.to_dict() for row in item]
 
-    def send_output(self):
+    def take_batch(self):
+        """Take the queued items of the next batch, oldest first.
+
+        Limits are checked between queued items, so a batch can overshoot
+        them by at most one item.
+        """
+        taken = []
+        rows = 0
+        taken_bytes = 0
+        with self.cond:
+            while (self.q and rows < self.MAX_ITEM_COUNT
+                   and (self.max_bytes is None or taken_bytes < self.max_bytes)):
+                entry = self.q.popleft()
+                taken.append(entry)
+                rows += entry[2]
+                taken_bytes += entry[3]
+            self.size -= rows
+            self.bytes -= taken_bytes
+            self.cond.notify_all()
+        return taken
+
+    def requeue(self, taken, sent=0):
+        """Put items back at the front of the queue, as take_batch found them.
+
+        The first sent rows were delivered already; only the rest go back.
+        """
+        if sent:
+            rows = [row for _, item, _, _ in taken for row in self.rows(item)]
+            nbytes = sum(entry[3] for entry in taken)
+            left = rows[sent:]
+            taken = [(taken[0][0], left, len(left), nbytes * len(left) // len(rows))] if left else []
+        with self.cond:
+            self.q.extendleft(reversed(taken))
+            self.size += sum(entry[2] for entry in taken)
+            self.bytes += sum(entry[3] for entry in taken)
+            self.cond.notify_all()
+
+    def send_output(self, force=False):
 
         if not self.url:
             console.print("There was no endpoint provided "
@@ -39,65 +199,99 @@ class Sink:
                           style='bold yellow')
             return
 
-        out_data = []
-        count = 0
-        print("\nSending formatted data...")
-
-        while not self.is_empty():
-            item = self.q.get()
-            out_data.append(item)
-            count += 1
-        json_data = json.dumps(out_data)
+        # One sender at a time keeps batches in queue order.
+        with self.send_lock:
+            while (force and not self.is_empty()) or self.should_flush():
+                taken = self.take_batch()
+                try:
+                    out_data = [row for _, item, _, _ in taken for row in self.rows(item)]
+                    print(f"\nSending {len(out_data)} formatted item(s)...")
+                    self.post(out_data)
+                except SendFailed as e:
+                    self.requeue(taken, e.sent)
+                    raise
+                except Exception:
+                    self.requeue(taken)
+                    raise
 
-        with app.app_context():
+    def post(self, out_data):
+        """Send rows to url; raises SendFailed unless every one of them was accepted."""
+        with metrics.timed("serialize", items=len(out_data)):
+            body, headers = wire.encode(out_data, self.format, self.compression)
+        # Split batches whose encoded size is over the byte limit.
+        if self.max_bytes is not None and len(body) > self.max_bytes and len(out_data) > 1:
+            middle = len(out_data) // 2
+            self.post(out_data[:middle])
             try:
-                res = requests.post(self.url, json=json_data, timeout=10)
-                if res.status_code == 200:
-                    console.print("\nSuccessfully sent formatted data", style='green')
-                    return jsonify({"status": "success", "message": res.json()}, 200)
-                else:
-                    console.print(f"\nAn error occurred when sending the data:\n"
-                                  f"Error code: {res.status_code}\nMessage: {res.text}")
-                    return jsonify({"status": "error", "message": res.text}, res.status_code)
-            except requests.exceptions.Timeout:
-                print('Request timed out. the URL might be down or unreachable.')
-                return jsonify({"status": "error", "message": "Request timed out."}, 500)
-            except requests.exceptions.RequestException as e:
-                print(f'An error occurred: {e}')
-                return jsonify({"status": "error", "message": str(e)}, 500)
-
-
+                self.post(out_data[middle:])
+            except SendFailed as e:
+                e.sent += middle
+                raise
+            return
 
+        try:
+            with metrics.timed("flush", items=len(out_data)):
+                res = self.session.post(self.url, data=body, headers=headers, timeout=10)
+        except requests.exceptions.Timeout:
+            raise SendFailed('Request timed out. the URL might be down or unreachable.')
+        except requests.exceptions.RequestException as e:
+            raise SendFailed(f'An error occurred: {e}')
+        if res.status_code != 200:
+            raise SendFailed(f"An error occurred when sending the data:\n"
+                             f"Error code: {res.status_code}\nMessage: {res.text}")
+        console.print("\nSuccessfully sent formatted data", style='green')
 
 
 @app.route('/formatting/process', methods=['POST'])
 def process_data():
     try:
-        data = json.loads(request.json)  # Get JSON data from request
+        # Arrow batches stay columnar; JSON and msgpack arrive as a list of records.
+        # Ingestion sends the dtypes it inferred, so frames are not re-inferred here.
+        data = wire.decode(request.get_data(), request.content_type, request.content_encoding,
+                           as_frame=request.mimetype == wire.ARROW,
+                           schema=request.headers.get(wire.SCHEMA_HEADER))
+        # Where the batch came from goes on every record formatted from it.
+        source = request.headers.get(wire.SOURCE_HEADER)
         console.print('Received data', style='bold green')
-        input_sink.enqueue(data)
+        input_sink.enqueue(Batch(data, json.loads(source)) if source else data, block=False)
         console.print('Added data to processing queue', style='bold green')
-        return jsonify({"status": "success"}, 200)
-    except json.JSONDecodeError as e:
-        console.print(f'JSON error: {e}', style='red')
+        return jsonify({"status": "success"}), 200
+    except Full:
+        console.print('Processing queue is full, rejecting data', style='yellow')
+        return jsonify({"status": "error", "message": "Processing queue is full, retry later."}), 429, \
+            {"Retry-After": str(PROCESS_INTERVAL)}
+    except ValueError as e:
+        console.print(f'Decoding error: {e}', style='red')
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         console.print(f'Error processing data: {e}', style='red')
-        return jsonify({"status": "error", "message": str(e)}, 500)
-
-def process_output():
-    if not output_sink.is_empty():
-        output_sink.send_output()
-
+        return jsonify({"status": "error", "message": str(e)}), 500
 
 if __name__ == '__main__':
-    input_sink = Sink()
-    output_sink = Sink(url=OUTPUT_URL)
-    formatting_system = FormattingSystem(input_sink, output_sink)
+    input_sink = Sink(capacity=INPUT_CAPACITY)
+    output_sink = Sink(url=OUTPUT_URL, max_items=OUTPUT_BATCH_SIZE, max_bytes=OUTPUT_BATCH_BYTES,
+                       max_latency=OUTPUT_MAX_LATENCY, capacity=OUTPUT_CAPACITY,
+                       format=OUTPUT_WIRE_FORMAT, compression=OUTPUT_WIRE_COMPRESSION)
+    plan_cache = MappingPlanCache(ENTITIES, max_size=PLAN_CACHE_SIZE, path=PLAN_CACHE_FILE)
+    formatting_system = FormattingSystem(input_sink, output_sink, plan_cache=plan_cache,
+                                         columnar=COLUMNAR_FORMATTING,
+                                         workers=FORMATTING_WORKERS,
+                                         shard_size=FORMATTING_SHARD_SIZE,
+                                         show_progress=SHOW_PROGRESS)
     scheduler = BackgroundScheduler()
-    scheduler.add_job(formatting_system.process_queue, 'interval', seconds=2, max_instances=3)
-    scheduler.add_job(process_output, 'interval', seconds=5, max_instances=2)
+    scheduler.add_job(formatting_system.process_queue, 'interval', seconds=PROCESS_INTERVAL, max_instances=3)
     scheduler.start()
+    stop_flushing = threading.Event()
+    flusher = threading.Thread(target=output_sink.run_flusher, args=(stop_flushing,), daemon=True)
+    flusher.start()
     try:
         app.run(host='0.0.0.0', port=5001)
     finally:
         scheduler.shutdown(wait=True)
+        formatting_system.close()
+        stop_flushing.set()
+        flusher.join()
+        try:
+            output_sink.send_output(force=True)
+        except SendFailed as e:
+            console.print(f"\nCould not send the last formatted data: {e}", style='red')
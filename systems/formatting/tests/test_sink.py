@@ -0,0 +1,132 @@
+import json
+import threading
+
+import pandas as pd
+import pytest
+import requests
+
+import server
+from formatting_system import Batch, FormattingSystem
+from groovybytes import wire
+
+
+def test_records_from_frames_have_iso_dates():
+    frame = pd.DataFrame({"name": ["Ada", "Grace"],
+                          "birth date": pd.to_datetime(["1815-12-10", None])})
+    record = FormattingSystem(None, None).format_items(frame)[0].to_dict()
+    assert record["other"] == [{"birth date": "1815-12-10T00:00:00.000"}]
+
+
+
+def test_planned_records_can_still_be_set():
+    (record,) = FormattingSystem(None, None).format_items([{"name": "Ada", "shoe size": 38}])
+    record.set("email", "ada@example.com")
+    record.set("hat size", 7)
+    data = record.to_dict()
+    assert data["name"] == "Ada" and data["email"] == "ada@example.com"
+    assert data["other"] == [{"shoe size": 38}, {"hat size": 7}]
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_a_worker_pool_keeps_each_batch_in_order(columnar):
+    input_sink = server.Sink(capacity=1000)
+    output_sink = server.Sink()
+    batches = {f"upload {i}": [{"name": f"{i}.{row}", "email": f"{row}@example.com"} for row in range(7 + i)]
+               for i in range(4)}
+    for upload_id, rows in batches.items():
+        input_sink.enqueue(Batch(rows, {"upload_id": upload_id}))
+
+    system = FormattingSystem(input_sink, output_sink, columnar=columnar, workers=2, shard_size=3,
+                              show_progress=False)
+    try:
+        system.process_queue()
+    finally:
+        system.close()
+
+    names = {}
+    for item in output_sink.q:
+        for row in output_sink.rows(item[1]):
+            record = json.loads(row)
+            names.setdefault(record["source"]["upload_id"], []).append(record["name"])
+    assert names == {upload_id: [row["name"] for row in rows] for upload_id, rows in batches.items()}
+
+def test_flusher_requeues_a_batch_it_could_not_send():
+    sink = server.Sink(url="http://localhost:9/unused", max_items=1)
+    rows = sink.rows
+    failures = [TypeError("not serializable")]
+
+    def failing_rows(item):
+        if failures:
+            raise failures.pop()
+        return rows(item)
+
+    sent = []
+    posted = threading.Event()
+    sink.rows = failing_rows
+    sink.post = lambda out_data: (sent.append(out_data), posted.set())
+    sink.enqueue('{"name": "Ada"}')
+
+    stop = threading.Event()
+    flusher = threading.Thread(target=sink.run_flusher, args=(stop, 0.01), daemon=True)
+    flusher.start()
+    try:
+        assert posted.wait(5)
+        assert sent == [['{"name": "Ada"}']]
+        assert sink.is_empty()
+    finally:
+        stop.set()
+        flusher.join()
+
+
+class Output:
+    """Stands in for the session the Sink posts with, answering each post with the next status code."""
+
+    def __init__(self, *codes):
+        self.codes = list(codes)
+        self.received = []
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        response = requests.Response()
+        response.status_code = self.codes.pop(0)
+        if response.status_code == 200:
+            self.received.append(wire.decode(data, headers["Content-Type"]))
+        return response
+
+
+def queued_rows(sink):
+    return [row for _, item, _, _ in sink.q for row in sink.rows(item)]
+
+
+def test_a_rejected_batch_stays_queued():
+    sink = server.Sink(url="http://dashboard/data", max_items=10)
+    sink.session = Output(503, 200)
+    sink.enqueue(['{"name": "Ada"}', '{"name": "Grace"}'])
+    with pytest.raises(server.SendFailed, match="503"):
+        sink.send_output(force=True)
+    assert queued_rows(sink) == ['{"name": "Ada"}', '{"name": "Grace"}']
+
+    sink.send_output(force=True)
+    assert sink.is_empty()
+    assert sink.session.received == [[{"name": "Ada"}, {"name": "Grace"}]]
+
+
+def test_only_the_unsent_half_of_a_split_batch_is_queued_again():
+    rows = [f'{{"name": "person {i}"}}' for i in range(4)]
+    sink = server.Sink(url="http://dashboard/data", max_items=10, max_bytes=70)
+    sink.session = Output(200, 503)
+    for row in rows:
+        sink.enqueue(row)
+    with pytest.raises(server.SendFailed) as failure:
+        sink.send_output(force=True)
+    assert failure.value.sent == 2
+    assert queued_rows(sink) == rows[2:]
+    assert sink.size == 2
+    assert [row["name"] for batch in sink.session.received for row in batch] == ["person 0", "person 1"]
+
+
+def test_accepted_batches_are_answered_with_a_json_object():
+    server.input_sink = server.Sink(capacity=10)
+    body, headers = wire.encode([{"name": "Ada"}], "json")
+    response = server.app.test_client().post("/formatting/process", data=body, headers=headers)
+    assert response.status_code == 200
+    assert response.get_json() == {"status": "success"}
@@ -0,0 +1,76 @@
+import pandas as pd
+import pytest
+
+import server
+from formatting_system import FormattingSystem, with_source
+from groovybytes import schema as schemas, wire
+
+SOURCE = {"filename": "people.csv", "upload_id": "abc123"}
+
+
+class Dashboard:
+    """Stands in for the session the output Sink posts with, keeping what it was sent."""
+
+    def __init__(self):
+        self.batches = []
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        self.batches.append(wire.decode(data, headers["Content-Type"], headers.get("Content-Encoding")))
+        return self
+
+    status_code = 200
+
+    def json(self):
+        return {"status": "success"}
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+@pytest.mark.parametrize("format", sorted(wire.FORMATS))
+def test_shrunk_dates_reach_the_dashboard_in_every_wire_format(format, columnar):
+    # As ingestion sends a parsed chunk: compact dtypes, with the schema in a header.
+    frame, schema = schemas.shrink(pd.DataFrame({
+        "name": ["Ada Lovelace", "Grace Hopper", "Alan Turing"],
+        "email": ["ada@example.com", "grace@example.com", None],
+        "birth date": ["1815-12-10", "1906-12-09", None],
+    }))
+    assert schema["birth date"] == "datetime64[ns]"
+    body, headers = wire.encode(frame, format, schema=schema, source=SOURCE)
+
+    server.input_sink = server.Sink(capacity=1000)
+    output_sink = server.Sink(url="http://dashboard/dashboard_api/data", max_items=1000, max_bytes=1 << 20,
+                              format=format)
+    output_sink.session = dashboard = Dashboard()
+    response = server.app.test_client().post("/formatting/process", data=body, headers=headers)
+    assert response.status_code == 200
+
+    FormattingSystem(server.input_sink, output_sink, columnar=columnar, show_progress=False).process_queue()
+    output_sink.send_output(force=True)
+
+    (records,) = dashboard.batches
+    assert [record["name"] for record in records] == ["Ada Lovelace", "Grace Hopper", "Alan Turing"]
+    assert all(record["source"] == SOURCE for record in records)
+    assert all(record["entity"] == "Person" for record in records)
+    dates = [dict(pair for other in record["other"] for pair in other.items())["birth date"]
+             for record in records]
+    assert dates[2] is None
+    assert [pd.Timestamp(date) for date in dates[:2]] == [pd.Timestamp("1815-12-10"), pd.Timestamp("1906-12-09")]
+    assert all(isinstance(date, str) for date in dates[:2])
+
+
+def test_columnar_rows_are_the_documents_the_row_path_writes():
+    frame = pd.DataFrame({
+        "name": ["Ada/Lovelace", "Grace Hopper", None],
+        "score": [0.1 + 0.2, 12345678901234567.0, float("nan")],
+        "homepage": ["https://example.com/ada", None, "a\\/b é"],
+        "visits": pd.array([3, None, 12345678901234567], dtype=object),
+        "seen": pd.to_datetime(["2021-05-05 10:00:00.123", None, "1815-12-10 00:00:00.000"]),
+    })
+    system = FormattingSystem(None, None, show_progress=False)
+    sink = server.Sink(format="json")
+
+    rows = sink.rows(system.format_items(frame))
+    columnar = FormattingSystem(None, None, columnar=True, show_progress=False).format_items(frame)[0]
+    assert sink.rows(columnar) == rows
+    assert "0.30000000000000004" in rows[0] and "Ada/Lovelace" in rows[0]
+    assert sink.rows(with_source(columnar, SOURCE)) == sink.rows(
+        [with_source(record, SOURCE) for record in system.format_items(frame)])
@@ -1,47 +1,83 @@
 from flask import Flask, request, jsonify, render_template, render_template_string, send_file
 from werkzeug.utils import secure_filename
-from apscheduler.schedulers.background import BackgroundScheduler
 from paho.mqtt.client import Client as MQTTClient
 import pandas as pd
 import os
-import json
 import requests
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Font
-import datetime
+import time
+import json
+import hashlib
+import threading
+import uuid
+import multiprocessing
+from queue import Full
+from groovybytes import wire, metrics, schema as schemas
+import readers
+from jobs import Job, JobQueue, WorkerPool
+from status_store import StatusStore
+from segment_store import SegmentStore
+from output_view import OutputView
+from parse_cache import ParseCache
+from parse_pool import ParsePool
+from chunked_uploads import UploadSessions, UploadTooLarge
+from mqtt_windows import WindowBatcher, LocalBroker
 
 UPLOAD_FOLDER = 'uploads'
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = 512 * 1024 * 1024  # per request; larger files go through /ingestion/uploads in chunks
+UPLOAD_SESSIONS = 'upload_sessions'
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+UPLOAD_SESSION_TTL = 24 * 3600
+UPLOAD_SESSION_MAX_BYTES = 16 * 1024 * 1024 * 1024  # largest file a chunked upload may announce
+DUPLICATE_UPLOADS = 'skip'  # 'skip' repeats of content already uploaded, or 'resend' them from the parse cache
+PARSE_CACHE = 'parse_cache'  # only kept when duplicates are resent
+PARSE_CACHE_BYTES = 1024 * 1024 * 1024
 OUTPUT_FILE = 'output_data.xlsx'
+OUTPUT_SEGMENTS = 'output_segments'
+OUTPUT_BUFFER_ROWS = 5000
+OUTPUT_FLUSH_INTERVAL = 5.0
 HISTORY_FILE = 'upload_history.json'
+STATUS_DB = 'ingestion_status.db'
+STATUS_RETENTION = None  # seconds to keep finished statuses; None keeps them all
+STATUS_PAGE_SIZE = 100
+VIEW_PAGE_SIZE = 100
+VIEW_CACHE_BYTES = 64 * 1024 * 1024  # decoded blocks kept for paging through /view_data
 OUTPUT_URL = 'http://localhost:5001/formatting/process'
-ALLOWED_EXTENSIONS = {'csv', 'xls', 'xlsx', 'json'}
-file_queue = []
-file_status = {}
+SEND_RETRIES = 5
+SEND_RETRY_DELAY = 1.0  # seconds before a batch that could not be sent is tried again
+WIRE_FORMAT = 'json'
+WIRE_COMPRESSION = None
+CHUNK_ROWS = readers.CHUNK_ROWS
+INFER_DTYPES = True  # shrink parsed chunks to compact dtypes and send their schema along
+PARSE_WORKERS = None  # processes parsing spreadsheet sheets; None uses one per CPU, 0 parses in the job's thread
+ALLOWED_EXTENSIONS = set(readers.READERS)
+INGESTION_WORKERS = 4
+JOB_QUEUE_SIZE = 1000
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+metrics.set_service('ingestion')
+metrics.register_endpoint(app)
 
-mqtt_client = MQTTClient()
 MQTT_BROKER = "broker.emqx.io"  # broker.hivemq.com   broker.emqx.io
 MQTT_TOPIC = "sensor/temperature"
+MQTT_LOCAL_BROKER = False  # use the in-process stand-in instead of MQTT_BROKER
+MQTT_WINDOW_MESSAGES = 1000
+MQTT_WINDOW_SECONDS = 1.0
+MQTT_ID_FIELD = 'message_id'  # payload field used to drop redelivered messages
+mqtt_client = LocalBroker() if MQTT_LOCAL_BROKER else MQTTClient()
 
-scheduler = BackgroundScheduler()
-scheduler.start()
-
-
-def load_history():
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+session = requests.Session()
 
 
-def save_history(history):
-    with open(HISTORY_FILE, 'w') as f:
-        json.dump(history, f, indent=4)
+def set_status(name, state, digest=None):
+    with metrics.timed('status'):
+        status_store.set(name, state, digest)
 
 
-file_status = load_history()
+export_lock = threading.Lock()
+exported_version = None
 
 
 def on_connect(client, userdata, flags, rc):
@@ -51,9 +87,8 @@ def on_connect(client, userdata, flags, rc):
 
 
 def on_message(client, userdata, msg):
-    print(f"Received message from MQTT: {msg.payload.decode()}")
-    data = msg.payload.decode()
-
+    # Messages are only collected here; each window is processed as one batch.
+    mqtt_windows.add(msg.payload)
 
 
 def allowed_file(filename):
@@ -76,147 +111,369 @@ def upload_file():
 
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-
-        file_status[filename] = 'uploaded'
-        file_queue.append(file_path)
+        with metrics.timed('upload'):
+            digest, file_path = save_upload(file, filename.rsplit('.', 1)[1].lower())
 
-        save_history(file_status)
-
-        return jsonify({'status': 'success', 'message': 'File uploaded successfully and queued for processing',
-                        'file_path': file_path}, 200)
+        return accept_upload(filename, digest, file_path, uuid.uuid4().hex,
+                             request.form.get('priority', 0, type=int))
     else:
         return jsonify({'status': 'fail', 'message': 'Invalid file type'})
 
 
-def append_to_excel(data, source_label):
-    # Check if the output file exists, and load it; otherwise, create a new workbook
-    if os.path.exists(OUTPUT_FILE):
-        workbook = load_workbook(OUTPUT_FILE)
-    else:
-        workbook = Workbook()
-        workbook.save(OUTPUT_FILE)
-        workbook = load_workbook(OUTPUT_FILE)
-
-    sheet = workbook.active
-    next_row = sheet.max_row + 2 if sheet.max_row > 1 else 1  # Leave a blank row between entries
-
-    # Add source label (filename or MQTT source) in bold in the first column
-    sheet.cell(row=next_row, column=1, value=source_label).font = Font(bold=True)
-
-    # Set the first row of CSV as headers in Excel if not set
-    headers = data.columns
-    for col_num, col_name in enumerate(headers, start=2):  # Start from second column for headers
-        sheet.cell(row=next_row + 1, column=col_num, value=col_name).font = Font(bold=True)
-
-    # Move the row pointer down after setting headers
-    next_row += 1
+def accept_upload(filename, digest, file_path, upload_id, priority):
+    """Record a stored upload and queue it, unless the same content was uploaded before."""
+    # Every upload gets its own status entry, even when the name was used before.
+    name = f'{filename} #{upload_id[:8]}'
 
-    # Append data with formatted content: cell_content::source_label::COLUMN_NAME
-    for row in data.itertuples(index=False, name=None):
-        for col_num, (value, col_name) in enumerate(zip(row, data.columns), start=2):  # Start from second column
-            formatted_value = f"{value}::{source_label}::{col_name}"
-            sheet.cell(row=next_row + 1, column=col_num, value=formatted_value)
-        next_row += 1
+    skip = DUPLICATE_UPLOADS == 'skip'
+    with metrics.timed('status'):
+        earlier = status_store.claim(name, digest, 'duplicate' if skip else None)
+    if earlier is not None and skip:
+        metrics.count('duplicate', 1)
+        return jsonify({'status': 'success', 'message': f'Same content as {earlier}, not processed again',
+                        'file_path': file_path, 'upload_id': upload_id, 'name': name,
+                        'duplicate_of': earlier}), 200
 
-    # Save the modified workbook
-    workbook.save(OUTPUT_FILE)
-
-
-def process_file(file_path):
-    filename = os.path.basename(file_path)
-    file_status[filename] = 'processing'
-    save_history(file_status)
+    # Higher priorities are picked up first.
+    job = Job(file_path, priority=priority, name=name, digest=digest,
+              source={'filename': filename, 'upload_id': upload_id})
+    try:
+        job_queue.put(job)
+    except Full:
+        set_status(name, 'error')
+        return jsonify({'status': 'fail', 'message': 'Processing queue is full, retry later'}), 503, \
+            {'Retry-After': '10'}
+    set_status(name, 'queued')
+
+    return jsonify({'status': 'success', 'message': 'File uploaded successfully and queued for processing',
+                    'file_path': file_path, 'upload_id': upload_id, 'name': name, 'job_id': job.id}), 200
+
+
+def save_upload(file, ext):
+    """Write an upload to UPLOAD_FOLDER, hashing it on the way; returns (digest, path).
+
+    The digest covers the extension too, since that picks the reader. Files
+    are stored under it, so identical uploads share one file.
+    """
+    sha = hashlib.sha256()
+    tmp_path = os.path.join(app.config['UPLOAD_FOLDER'], f'{uuid.uuid4().hex}.tmp')
+    with open(tmp_path, 'wb') as f:
+        while True:
+            block = file.stream.read(UPLOAD_BLOCK_SIZE)
+            if not block:
+                break
+            sha.update(block)
+            f.write(block)
+    return store_upload(tmp_path, sha.hexdigest(), ext)
+
+
+def store_upload(tmp_path, sha256, ext):
+    digest = f'{sha256}.{ext}'
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], digest)
+    os.replace(tmp_path, file_path)
+    return digest, file_path
+
+
+@app.route('/ingestion/uploads', methods=['POST'])
+def create_upload():
+    # Chunked uploads: create a session, PUT the chunks, then finalize it.
+    params = request.get_json(silent=True) or request.form
+    filename = secure_filename(params.get('filename', ''))
+    size = params.get('size')
+    if not filename or not allowed_file(filename):
+        return jsonify({'status': 'fail', 'message': 'Invalid file type'}), 400
+    try:
+        upload = upload_sessions.create(filename, int(size), chunk_size=int(params.get('chunk_size') or 0),
+                                        priority=int(params.get('priority') or 0))
+    except UploadTooLarge as e:
+        return jsonify({'status': 'fail', 'message': str(e)}), 413
+    except (TypeError, ValueError) as e:
+        return jsonify({'status': 'fail', 'message': f'Invalid upload size: {e}'}), 400
+    return jsonify({'status': 'success', **upload.describe()}), 201
+
+
+@app.route('/ingestion/uploads/<upload_id>', methods=['GET'])
+def upload_progress(upload_id):
+    # What a client resuming the upload still has to send.
+    upload = upload_sessions.get(upload_id)
+    if upload is None:
+        return jsonify({'status': 'fail', 'message': 'No upload with that id'}), 404
+    return jsonify({'status': 'success', **upload.describe()})
+
+
+@app.route('/ingestion/uploads/<upload_id>', methods=['PUT'])
+def put_chunk(upload_id):
+    upload = upload_sessions.get(upload_id)
+    if upload is None:
+        return jsonify({'status': 'fail', 'message': 'No upload with that id'}), 404
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({'status': 'fail', 'message': 'offset is required'}), 400
+    try:
+        with metrics.timed('upload'):
+            upload_sessions.write_chunk(upload, offset, request.stream, request.content_length,
+                                        request.headers.get('X-Chunk-SHA256'))
+    except ValueError as e:
+        return jsonify({'status': 'fail', 'message': str(e)}), 400
+    return jsonify({'status': 'success', 'received_bytes': upload.received(), 'size': upload.meta['size']})
+
+
+@app.route('/ingestion/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    upload = upload_sessions.get(upload_id)
+    if upload is None:
+        return jsonify({'status': 'fail', 'message': 'No upload with that id'}), 404
+    params = request.get_json(silent=True) or request.form
+    try:
+        # Only one of several concurrent calls gets past this.
+        with metrics.timed('upload'):
+            sha256 = upload_sessions.finalize(upload, params.get('sha256'))
+    except ValueError as e:
+        return jsonify({'status': 'fail', 'message': str(e), 'missing': upload.missing()}), 409
+
+    meta = upload.meta
+    digest, file_path = store_upload(upload.data_path, sha256, meta['filename'].rsplit('.', 1)[1].lower())
+    upload_sessions.discard(upload)
+    return accept_upload(meta['filename'], digest, file_path, upload_id, meta['priority'])
+
+
+@app.route('/ingestion/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    upload = upload_sessions.get(upload_id)
+    if upload is None:
+        return jsonify({'status': 'fail', 'message': 'No upload with that id'}), 404
+    upload_sessions.discard(upload)
+    return jsonify({'status': 'success', 'message': 'Upload aborted', 'upload_id': upload_id})
+
+
+@app.route('/ingestion/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'status': 'fail', 'message': 'No queued or running job with that id'}), 404
+    set_status(job.name, 'cancelled')
+    return jsonify({'status': 'success', 'message': 'Job cancelled', 'job_id': job_id})
+
+
+def append_output(data, source_label):
+    with metrics.timed('store', items=len(data)):
+        output_store.append(data, source_label)
+
+
+def export_output():
+    # Rebuild the workbook only when something was appended since the last export.
+    global exported_version
+    with export_lock:
+        version = output_store.version
+        if version != exported_version or not os.path.exists(OUTPUT_FILE):
+            with metrics.timed('export'):
+                output_store.export_excel(OUTPUT_FILE)
+            exported_version = version
+
+
+def process_file(file_path, cancelled=None, name=None, digest=None, source=None):
+    filename = name or os.path.basename(file_path)
+    source = source or {'filename': filename}
+    set_status(filename, 'processing')
+    cache_writer = None
+    chunks = None
 
     try:
         _, ext = os.path.splitext(file_path)
 
-        if ext == '.csv':
-            data = pd.read_csv(file_path)
-        elif ext in ['.xls', '.xlsx']:
-            data = pd.read_excel(file_path)
-        elif ext == '.json':
-            data = pd.read_json(file_path)
-        else:
+        if ext.lstrip('.').lower() not in readers.READERS:
             print("Unsupported file type:", file_path)
-            file_status[filename] = 'error'
-            save_history(file_status)
+            set_status(filename, 'error')
             return
 
-        send_to_output_sink(data)
-
-        file_status[filename] = 'processed'
-        save_history(file_status)
+        # Each chunk goes downstream as its own batch while the rest is still being read.
+        # Content parsed before is replayed from the cache instead.
+        stage = 'cache'
+        sheet_schemas = {}
+        cached = digest and parse_cache is not None
+        chunks = parse_cache.get(digest) if cached else None
+        if chunks is None:
+            stage = 'parse'
+            chunks = read_file(file_path)
+            if cached:
+                cache_writer = parse_cache.writer(digest)
+        while True:
+            with metrics.timed(stage):
+                sheet, data = next(chunks, (None, None))
+            if data is None:
+                break
+            if cancelled is not None and cancelled.is_set():
+                set_status(filename, 'cancelled')
+                return
+            metrics.count(stage, len(data))
+            if INFER_DTYPES:
+                # The schema of a sheet's first chunk is kept for the rest, widened where they need it.
+                with metrics.timed('typing', items=len(data)):
+                    data, sheet_schemas[sheet] = schemas.shrink(data, sheet_schemas.get(sheet))
+            if cache_writer is not None:
+                cache_writer.write(data, sheet)
+            send_to_output_sink(data, sheet_schemas.get(sheet), source if sheet is None else {**source, 'sheet': sheet})
+
+        # Only reached once every batch was delivered: a send that failed for
+        # good raised, so the upload ends up in 'error' and is not cached.
+        if cache_writer is not None:
+            cache_writer.commit()
+        set_status(filename, 'processed')
 
     except Exception as e:
         print(f"Error processing file {file_path}: {e}")
-        file_status[filename] = 'error'
-        save_history(file_status)
-
-
-def process_mqtt_data(data):
+        set_status(filename, 'error')
+    finally:
+        # Cached chunks stay on disk while they are being read.
+        if chunks is not None:
+            chunks.close()
+        # A parse that did not finish leaves nothing in the cache.
+        if cache_writer is not None:
+            cache_writer.discard()
+
+
+def read_file(file_path):
+    """Yield (sheet, DataFrame) chunks of an upload; sheet is None for formats without sheets.
+
+    Every sheet of a spreadsheet is read, in parallel in the parse pool when there is one.
+    """
+    ext = file_path.rsplit('.', 1)[-1].lower()
+    if ext not in readers.SHEET_FORMATS:
+        return ((None, chunk) for chunk in readers.read_chunks(file_path, CHUNK_ROWS))
+    if parse_pool is not None:
+        return parse_pool.read_sheets(file_path, CHUNK_ROWS)
+    return ((sheet, chunk) for sheet in readers.sheet_names(file_path)
+            for chunk in readers.read_chunks(file_path, CHUNK_ROWS, sheet))
+
+
+def process_mqtt_window(window):
+    timestamp_label = window.label
     try:
-        df = pd.DataFrame([json.loads(data)])
-        timestamp_label = f"MQTT {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-
-        file_status[timestamp_label] = 'processing'
-        save_history(file_status)
+        df = window.frame()
+        schema = None
+        if INFER_DTYPES:
+            df, schema = schemas.shrink(df)
+        set_status(timestamp_label, 'processing')
 
-        append_to_excel(df, timestamp_label)
-        file_status[timestamp_label] = 'processed'
-        save_history(file_status)
+        append_output(df, timestamp_label)
+        send_to_output_sink(df, schema, timestamp_label)
+        set_status(timestamp_label, 'processed')
 
-        print(f"MQTT data processed and appended to {OUTPUT_FILE}")
+        metrics.count('mqtt', len(df))
+        print(f"MQTT window of {len(df)} message(s) processed and stored in {OUTPUT_SEGMENTS}")
 
     except Exception as e:
         print(f"Error processing MQTT data: {e}")
-        file_status[timestamp_label] = 'error'
-        save_history(file_status)
-
-
-def process_files_in_queue():
-    while file_queue:
-        file_to_process = file_queue.pop(0)
-        process_file(file_to_process)
-
-def send_to_output_sink(data):
-    # CODE TO SEND TO OTHER SERVER
-    # URL of the endpoint
-    # Make the POST request
-    try:
-        json_data = data.to_json(orient='records')
-        response = requests.post(OUTPUT_URL, json=json_data)
-
-        # Check the response
-        if response.status_code == 200:
-            print("Response from server:", response.json())
-        else:
-            print(f"Failed to send data. Status code: {response.status_code}, Message: {response.text}")
-    except Exception as e:
-        print(f"Error making POST request: {e}")
-
-
-scheduler.add_job(process_files_in_queue, 'interval', seconds=10, max_instances=2)
+        set_status(timestamp_label, 'error')
+
+
+def run_job(job):
+    if job.cancelled.is_set():
+        return
+    metrics.observe('queue_wait', time.monotonic() - job.enqueued_at)
+    process_file(job.file_path, job.cancelled, job.name, job.digest, job.source)
+
+class SendFailed(RuntimeError):
+    """A batch could not be delivered to the formatting service, retries included."""
+
+
+def send_to_output_sink(data, schema=None, source=None):
+    """POST a batch to the formatting service; raises SendFailed once SEND_RETRIES are used up.
+
+    429s and connection errors are retried; other errors are not, since the
+    same body would fail the same way again.
+    """
+    with metrics.timed('serialize', items=len(data)):
+        body, headers = wire.encode(data, WIRE_FORMAT, WIRE_COMPRESSION, schema, source)
+
+    with metrics.timed('send', items=len(data)):
+        for attempt in range(SEND_RETRIES + 1):
+            delay = SEND_RETRY_DELAY
+            try:
+                response = session.post(OUTPUT_URL, data=body, headers=headers)
+            except requests.RequestException as e:
+                error = f'Error making POST request: {e}'
+            else:
+                if response.status_code == 200:
+                    print("Response from server:", response.json())
+                    return response
+                error = f'Failed to send data. Status code: {response.status_code}, Message: {response.text}'
+                # The formatting service answers 429 while its queue is full.
+                if response.status_code != 429:
+                    raise SendFailed(error)
+                delay = float(response.headers.get('Retry-After', delay))
+            if attempt < SEND_RETRIES:
+                time.sleep(delay)
+    raise SendFailed(error)
+
+
+def page_args():
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', VIEW_PAGE_SIZE, type=int), 1), 1000)
+    columns = request.args.get('columns')
+    columns = {column.strip() for column in columns.split(',')} if columns else None
+    return page, per_page, columns
+
+
+def output_etag():
+    # Changes only when data is appended, so an unchanged page is answered with 304
+    # before anything is read.
+    return hashlib.sha1(f"{output_store.version}:{request.full_path}".encode('utf-8')).hexdigest()
+
+
+def conditional(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+@app.route('/ingestion/output')
+def output_data():
+    etag = output_etag()
+    if request.if_none_match.contains(etag):
+        return conditional(app.response_class(status=304), etag)
+
+    page, per_page, columns = page_args()
+    output_view.refresh()
+    blocks = output_view.page((page - 1) * per_page, per_page, columns)
+    response = jsonify({
+        'page': page,
+        'per_page': per_page,
+        'total_rows': output_view.rows,
+        'pages': -(-output_view.rows // per_page),
+        'blocks': [{'block': block, 'source': source_label,
+                    **json.loads(rows.to_json(orient='split', index=False, date_format='iso'))}
+                   for block, source_label, rows in blocks],
+    })
+    return conditional(response, etag)
 
 
 @app.route('/view_data')
 def view_data():
-    if not os.path.exists(OUTPUT_FILE):
+    if output_store.empty():
         return "<h3>No data available. Upload files to view data.</h3>"
 
-    df = pd.read_excel(OUTPUT_FILE)
+    etag = output_etag()
+    if request.if_none_match.contains(etag):
+        return conditional(app.response_class(status=304), etag)
 
-    # Replace "Unnamed" headers with empty strings
-    df.columns = ["" if "Unnamed" in col else col for col in df.columns]
+    page, per_page, columns = page_args()
+    output_view.refresh()
+    pages = max(-(-output_view.rows // per_page), 1)
 
-    # Replace NaN values with empty strings for a clean display in HTML
-    df.fillna('', inplace=True)
+    # Same grid as the workbook: the source label, its headers, then its rows.
+    grid = []
+    for _, source_label, rows in output_view.page((page - 1) * per_page, per_page, columns):
+        grid.append([source_label])
+        grid.append([''] + list(rows.columns))
+        grid.extend([''] + row for row in rows.astype(object).where(rows.notna(), '').values.tolist())
+    df = pd.DataFrame(grid).fillna('')
 
     # Convert DataFrame to HTML table with Bootstrap classes
-    html_table = df.to_html(index=False, classes="table table-striped table-bordered table-hover", na_rep="")
+    html_table = df.to_html(index=False, header=False, na_rep="",
+                            classes="table table-striped table-bordered table-hover")
 
-    return render_template_string('''
+    response = app.make_response(render_template_string('''
     <link rel="stylesheet" href="https://stackpath.bootstrapcdn.com/bootstrap/4.5.2/css/bootstrap.min.css">
     <style>
         table { font-size: small; }
@@ -233,7 +490,7 @@ def view_data():
                 <h1>Output Sink</h1>
             </div>
             <div class="col-md-4 text-right">
-                <a href="{{ url_for('static', filename='output_data.xlsx') }}" class="btn btn-success">
+                <a href="{{ url_for('download_output') }}" class="btn btn-success">
                     Download
                 </a>
             </div>
@@ -241,21 +498,75 @@ def view_data():
         <div class="table-responsive">
             {{ table | safe }}
         </div>
+        <nav class="d-flex justify-content-between align-items-center mb-4">
+            <a class="btn btn-outline-secondary {{ 'disabled' if page <= 1 }}"
+               href="{{ url_for('view_data', page=page - 1, per_page=per_page, columns=request.args.get('columns')) }}">Previous</a>
+            <span>Page {{ page }} of {{ pages }} ({{ rows }} rows)</span>
+            <a class="btn btn-outline-secondary {{ 'disabled' if page >= pages }}"
+               href="{{ url_for('view_data', page=page + 1, per_page=per_page, columns=request.args.get('columns')) }}">Next</a>
+        </nav>
     </div>
-    ''', table=html_table)
+    ''', table=html_table, page=page, pages=pages, per_page=per_page, rows=output_view.rows))
+    return conditional(response, etag)
 
 
 @app.route('/download_output')
 def download_output():
-    if os.path.exists(OUTPUT_FILE):
-        return send_file(OUTPUT_FILE, as_attachment=True)
+    if not output_store.empty():
+        export_output()
+        return send_file(os.path.abspath(OUTPUT_FILE), as_attachment=True)
     else:
         return "<h3>No output file available to download.</h3>"
 
 
+@app.route('/ingestion/mqtt/windows')
+def mqtt_window_stats():
+    # Count, duplicates and min/max/mean of every numeric field, newest window last.
+    return jsonify(list(mqtt_windows.closed))
+
+
 @app.route('/status')
 def status():
-    return jsonify(file_status)
+    # Without query parameters this is the whole {name: state} map the upload page shows.
+    if not request.args:
+        return jsonify(status_store.all())
+
+    since = request.args.get('since', 0, type=int)
+    limit = min(max(request.args.get('limit', STATUS_PAGE_SIZE, type=int), 1), 1000)
+    updated_after = request.args.get('updated_after', type=float)
+    items, next_cursor = status_store.query(since=since, state=request.args.get('state'),
+                                            name=request.args.get('name'),
+                                            updated_after=updated_after, limit=limit)
+    return jsonify({'items': items, 'next_cursor': next_cursor, 'has_more': len(items) == limit})
+
+
+# The parse pool's processes import this script again; only the server process
+# opens the stores and starts the threads.
+if multiprocessing.parent_process() is None:
+    # Statuses recorded in upload_history.json by earlier versions are imported once.
+    status_store = StatusStore(STATUS_DB, legacy_path=HISTORY_FILE, retention=STATUS_RETENTION)
+    # Jobs only live in memory: uploads an earlier run had not finished are lost,
+    # and must not pass for live copies of their content.
+    status_store.fail_unfinished()
+
+    # Parsed chunks of uploads, so a re-upload of the same bytes is not parsed again.
+    # Repeats never get that far when they are skipped, so there is nothing to cache then.
+    parse_cache = ParseCache(PARSE_CACHE, max_bytes=PARSE_CACHE_BYTES) if DUPLICATE_UPLOADS == 'resend' else None
+    upload_sessions = UploadSessions(UPLOAD_SESSIONS, chunk_size=UPLOAD_CHUNK_BYTES, ttl=UPLOAD_SESSION_TTL,
+                                     max_size=UPLOAD_SESSION_MAX_BYTES)
+
+    # Ingested data is appended to segment files; OUTPUT_FILE is only built when asked for.
+    output_store = SegmentStore(OUTPUT_SEGMENTS, buffer_rows=OUTPUT_BUFFER_ROWS,
+                                flush_interval=OUTPUT_FLUSH_INTERVAL)
+    output_view = OutputView(output_store, cache_bytes=VIEW_CACHE_BYTES)
+
+    mqtt_windows = WindowBatcher(process_mqtt_window, max_messages=MQTT_WINDOW_MESSAGES,
+                                 max_age=MQTT_WINDOW_SECONDS, id_field=MQTT_ID_FIELD).start()
+
+    parse_pool = ParsePool(PARSE_WORKERS) if PARSE_WORKERS != 0 else None
+    job_queue = JobQueue(capacity=JOB_QUEUE_SIZE)
+    workers = WorkerPool(job_queue, run_job, workers=INGESTION_WORKERS)
+    workers.start()
 
 
 if __name__ == '__main__':
@@ -266,4 +577,10 @@ if __name__ == '__main__':
     mqtt_client.connect(MQTT_BROKER, 1883, 60)
     mqtt_client.loop_start()
 
-    app.run(port=5000)
\ No newline at end of file
+    try:
+        app.run(port=5000)
+    finally:
+        mqtt_windows.stop()
+        output_store.close()
+        if parse_pool is not None:
+            parse_pool.shutdown()
\ No newline at end of file
@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+BLOCK_SIZE = 1024 * 1024
+# Chunks up to this size are checked in memory, larger ones in a temporary file.
+SPOOL_SIZE = 8 * 1024 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """The announced size of an upload is over the limit."""
+
+
+class UploadSession:
+    """One chunked upload: a file of the announced size, filled in by chunks at any offset."""
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.lock = threading.Lock()
+        # Hash of the file up to hashed, fed by chunks that arrive in order.
+        # It is not kept on disk; finalize() hashes whatever it did not see.
+        self.sha = hashlib.sha256()
+        self.hashed = 0
+        # Set while a finalize() runs, and for good once one succeeded.
+        self.finalizing = False
+
+    @property
+    def id(self):
+        return self.meta['id']
+
+    @property
+    def data_path(self):
+        return os.path.join(self.path, 'data')
+
+    def received(self):
+        return sum(end - start for start, end in self.meta['received'])
+
+    def missing(self):
+        """Byte ranges [start, end) not received yet."""
+        gaps = []
+        position = 0
+        for start, end in self.meta['received']:
+            if start > position:
+                gaps.append([position, start])
+            position = end
+        if position < self.meta['size']:
+            gaps.append([position, self.meta['size']])
+        return gaps
+
+    def complete(self):
+        return not self.missing()
+
+    def describe(self):
+        return {**self.meta, 'received_bytes': self.received(), 'missing': self.missing()}
+
+    def mark_received(self, start, end):
+        ranges = sorted(self.meta['received'] + [[start, end]])
+        merged = [ranges[0]]
+        for range_start, range_end in ranges[1:]:
+            if range_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], range_end)
+            else:
+                merged.append([range_start, range_end])
+        self.meta['received'] = merged
+
+    def save(self):
+        meta_path = os.path.join(self.path, 'meta.json')
+        with open(f'{meta_path}.tmp', 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(f'{meta_path}.tmp', meta_path)
+
+
+class UploadSessions:
+    """Chunked uploads in progress, kept on disk so clients can resume them after a disconnect.
+
+    A client creates a session with the file's size, PUTs chunks at any
+    offset (in parallel if it likes), each with the SHA-256 of its bytes,
+    asks which ranges are missing after a failure, and finalizes once every
+    byte is there. Chunks are streamed straight to their place in the file.
+    Files are reserved at their announced size, which is at most max_size.
+    """
+
+    def __init__(self, directory, chunk_size=8 * 1024 * 1024, max_chunk_size=64 * 1024 * 1024, ttl=24 * 3600,
+                 max_size=16 * 1024 * 1024 * 1024):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.sessions = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def create(self, filename, size, chunk_size=None, priority=0):
+        if size < 0:
+            raise ValueError('size must not be negative')
+        if self.max_size is not None and size > self.max_size:
+            raise UploadTooLarge(f'Uploads are limited to {self.max_size} bytes')
+        self.expire()
+        upload_id = uuid.uuid4().hex
+        path = os.path.join(self.directory, upload_id)
+        os.makedirs(path)
+        session = UploadSession(path, {
+            'id': upload_id,
+            'filename': filename,
+            'size': size,
+            'chunk_size': min(chunk_size or self.chunk_size, self.max_chunk_size),
+            'priority': priority,
+            'created_at': time.time(),
+            'received': [],
+        })
+        # Sparse until the chunks arrive.
+        with open(session.data_path, 'wb') as f:
+            f.truncate(size)
+        session.save()
+        with self.lock:
+            self.sessions[upload_id] = session
+        return session
+
+    def get(self, upload_id):
+        with self.lock:
+            session = self.sessions.get(upload_id)
+            if session is None:
+                # Written before a restart.
+                path = os.path.join(self.directory, os.path.basename(upload_id))
+                try:
+                    with open(os.path.join(path, 'meta.json')) as f:
+                        session = self.sessions[upload_id] = UploadSession(path, json.load(f))
+                except (OSError, ValueError):
+                    return None
+            return session
+
+    def write_chunk(self, session, offset, stream, length, checksum):
+        """Copy length bytes from stream into the file at offset, checking them against checksum."""
+        if length is None or length > self.max_chunk_size:
+            raise ValueError(f'Chunks need a Content-Length of at most {self.max_chunk_size} bytes')
+        if offset < 0 or offset + length > session.meta['size']:
+            raise ValueError('Chunk lies outside the file')
+        if not checksum:
+            raise ValueError('Chunks need a SHA-256 checksum')
+
+        with session.lock:
+            if session.finalizing:
+                raise ValueError('Upload is being finalized')
+            in_order = offset == session.hashed
+            whole = session.sha.copy() if in_order else None
+        chunk_sha = hashlib.sha256()
+        written = 0
+        # The chunk is only copied into the file once its checksum matched, so
+        # a corrupt retry cannot overwrite bytes that arrived intact.
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, dir=session.path) as spool:
+            while written < length:
+                block = stream.read(min(BLOCK_SIZE, length - written))
+                if not block:
+                    break
+                chunk_sha.update(block)
+                spool.write(block)
+                written += len(block)
+            if written != length:
+                raise ValueError(f'Chunk ended after {written} of {length} bytes')
+            if chunk_sha.hexdigest() != checksum.lower():
+                raise ValueError('Chunk checksum does not match')
+
+            spool.seek(0)
+            with open(session.data_path, 'r+b') as f:
+                f.seek(offset)
+                for block in iter(lambda: spool.read(BLOCK_SIZE), b''):
+                    if whole is not None:
+                        whole.update(block)
+                    f.write(block)
+
+        with session.lock:
+            if in_order and session.hashed == offset:
+                session.sha = whole
+                session.hashed = offset + length
+            session.mark_received(offset, offset + length)
+            session.save()
+
+    def finalize(self, session, checksum=None):
+        """Check the upload is whole and return the SHA-256 of the file; it stays at session.data_path.
+
+        Only one call per session succeeds; the caller then owns the file.
+        """
+        with session.lock:
+            if session.finalizing:
+                raise ValueError('Upload is already being finalized')
+            if not session.complete():
+                raise ValueError(f'Upload is missing {len(session.missing())} range(s)')
+            session.finalizing = True
+            sha = session.sha.copy()
+            hashed = session.hashed
+        try:
+            with open(session.data_path, 'rb') as f:
+                f.seek(hashed)
+                for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+                    sha.update(block)
+            digest = sha.hexdigest()
+            if checksum and checksum.lower() != digest:
+                raise ValueError('File checksum does not match')
+        except BaseException:
+            with session.lock:
+                session.finalizing = False
+            raise
+        return digest
+
+    def discard(self, session):
+        with self.lock:
+            self.sessions.pop(session.id, None)
+        shutil.rmtree(session.path, ignore_errors=True)
+
+    def expire(self):
+        # Sessions nobody touched within ttl are abandoned.
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            meta_path = os.path.join(path, 'meta.json')
+            if os.path.exists(meta_path) and os.path.getmtime(meta_path) < cutoff:
+                with self.lock:
+                    self.sessions.pop(name, None)
+                shutil.rmtree(path, ignore_errors=True)
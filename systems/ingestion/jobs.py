@@ -0,0 +1,110 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+from queue import Full
+
+
+class Job:
+    def __init__(self, file_path, priority=0, name=None, digest=None, source=None):
+        self.id = uuid.uuid4().hex
+        self.file_path = file_path
+        self.priority = priority
+        # Status entry of the upload, and the hash of its content.
+        self.name = name or os.path.basename(file_path)
+        self.digest = digest
+        # Sent along with every batch: the uploaded filename and the upload id.
+        self.source = source
+        self.enqueued_at = time.monotonic()
+        # Set to stop a job that is waiting, or a running one between chunks.
+        self.cancelled = threading.Event()
+
+
+class JobQueue:
+    """Bounded, thread-safe queue of jobs; higher priority first, then in arrival order."""
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.heap = []
+        self.jobs = {}
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.closed = False
+
+    def put(self, job):
+        with self.cond:
+            if len(self.heap) >= self.capacity:
+                raise Full()
+            heapq.heappush(self.heap, (-job.priority, next(self.counter), job))
+            self.jobs[job.id] = job
+            self.cond.notify()
+
+    def get(self):
+        """Wait for the next job; returns None once the queue is closed."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.heap or self.closed)
+            if self.closed:
+                return None
+            _, _, job = heapq.heappop(self.heap)
+            return job
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns the job, or None if it is unknown."""
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            job.cancelled.set()
+            entries = [entry for entry in self.heap if entry[2] is not job]
+            if len(entries) != len(self.heap):
+                self.heap = entries
+                heapq.heapify(self.heap)
+                del self.jobs[job_id]
+            return job
+
+    def done(self, job):
+        with self.cond:
+            self.jobs.pop(job.id, None)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def __len__(self):
+        return len(self.heap)
+
+
+class WorkerPool:
+    """Threads that run handler(job) for every job as soon as it is queued."""
+
+    def __init__(self, queue, handler, workers=4):
+        self.queue = queue
+        self.handler = handler
+        self.threads = [threading.Thread(target=self.run, name=f'ingestion-worker-{i}', daemon=True)
+                        for i in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            try:
+                self.handler(job)
+            except Exception as e:
+                print(f"Error running job {job.id} for {job.file_path}: {e}")
+            finally:
+                self.queue.done(job)
+
+    def shutdown(self, wait=True):
+        # Workers finish their current job; queued jobs are left behind.
+        self.queue.close()
+        if wait:
+            for thread in self.threads:
+                thread.join()
@@ -0,0 +1,218 @@
+import datetime
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from types import SimpleNamespace
+
+import pandas as pd
+
+
+class MessageWindow:
+    """Messages collected over one window, with running stats of their numeric fields."""
+
+    def __init__(self):
+        self.records = []
+        self.started_at = datetime.datetime.now()
+        self.opened = time.monotonic()
+        self.duplicates = 0
+        self.invalid = 0
+        # field -> [count, min, max, sum]
+        self.fields = {}
+
+    def add(self, record):
+        self.records.append(record)
+        for field, value in record.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and value == value:
+                stats = self.fields.get(field)
+                if stats is None:
+                    self.fields[field] = [1, value, value, value]
+                else:
+                    stats[0] += 1
+                    stats[1] = min(stats[1], value)
+                    stats[2] = max(stats[2], value)
+                    stats[3] += value
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def label(self):
+        return f"MQTT {self.started_at.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}"
+
+    def frame(self):
+        return pd.DataFrame(self.records)
+
+    def summary(self):
+        return {
+            'label': self.label,
+            'started_at': self.started_at.isoformat(),
+            'seconds': round(time.monotonic() - self.opened, 3),
+            'count': len(self.records),
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+            'fields': {field: {'count': count, 'min': low, 'max': high, 'mean': total / count}
+                       for field, (count, low, high, total) in self.fields.items()},
+        }
+
+
+class WindowBatcher:
+    """Groups MQTT payloads into windows closed by size or age, and hands each one to handler.
+
+    add() is cheap and safe to call from the MQTT network thread; windows are
+    closed and handled on the batcher's own thread. Messages whose id_field
+    was seen in the last dedupe_size messages are dropped.
+    """
+
+    def __init__(self, handler, max_messages=1000, max_age=1.0, id_field='message_id', dedupe_size=100000,
+                 history=100):
+        self.handler = handler
+        self.max_messages = max_messages
+        self.max_age = max_age
+        self.id_field = id_field
+        self.dedupe_size = dedupe_size
+        self.seen = OrderedDict()
+        self.window = None
+        # Windows closed by size, waiting for the batcher thread.
+        self.full = deque()
+        self.closed = deque(maxlen=history)
+        self.cond = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='mqtt-windows', daemon=True)
+        self.thread.start()
+        return self
+
+    def add(self, payload):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            data = None
+
+        with self.cond:
+            if self.window is None:
+                self.window = MessageWindow()
+            window = self.window
+            records = data if isinstance(data, list) else [data]
+            for record in records:
+                if not isinstance(record, dict):
+                    window.invalid += 1
+                elif self.is_duplicate(record):
+                    window.duplicates += 1
+                else:
+                    window.add(record)
+                    if len(window) >= self.max_messages:
+                        self.full.append(window)
+                        window = self.window = MessageWindow()
+                        self.cond.notify()
+
+    def is_duplicate(self, record):
+        message_id = record.get(self.id_field) if self.id_field else None
+        if message_id is None:
+            return False
+        try:
+            if message_id in self.seen:
+                return True
+        except TypeError:
+            return False
+        self.seen[message_id] = None
+        if len(self.seen) > self.dedupe_size:
+            self.seen.popitem(last=False)
+        return False
+
+    def due(self):
+        return bool(self.full) or (self.window is not None
+                                   and time.monotonic() - self.window.opened >= self.max_age)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            with self.cond:
+                timeout = self.max_age
+                if self.window is not None:
+                    timeout = max(0.0, self.max_age - (time.monotonic() - self.window.opened))
+                self.cond.wait_for(lambda: self.due() or self.stop_event.is_set(), timeout)
+                windows = self.take() if self.due() else []
+            for window in windows:
+                self.handle(window)
+
+    def take(self, everything=False):
+        windows = list(self.full)
+        self.full.clear()
+        if self.window is not None and (everything or time.monotonic() - self.window.opened >= self.max_age):
+            windows.append(self.window)
+            self.window = None
+        return windows
+
+    def handle(self, window):
+        self.closed.append(window.summary())
+        if len(window):
+            try:
+                self.handler(window)
+            except Exception as e:
+                print(f"Error handling MQTT window {window.label}: {e}")
+
+    def flush(self):
+        """Close and handle the current window now."""
+        with self.cond:
+            windows = self.take(everything=True)
+        for window in windows:
+            self.handle(window)
+
+    def stop(self):
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+
+class LocalBroker:
+    """In-process stand-in for paho's MQTT client, for running the ingestion path without a broker.
+
+    It implements the part of the client the app uses; publish() delivers to
+    matching subscriptions synchronously, on the caller's thread.
+    """
+
+    def __init__(self):
+        self.on_connect = None
+        self.on_message = None
+        self.subscriptions = set()
+        self.next_mid = 0
+
+    def connect(self, host='localhost', port=1883, keepalive=60):
+        if self.on_connect is not None:
+            self.on_connect(self, None, {}, 0)
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.add(topic)
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def publish(self, topic, payload, qos=0):
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        elif not isinstance(payload, bytes):
+            payload = json.dumps(payload).encode('utf-8')
+        self.next_mid += 1
+        if self.on_message is not None and any(topic_matches(pattern, topic) for pattern in self.subscriptions):
+            self.on_message(self, None, SimpleNamespace(topic=topic, payload=payload, mid=self.next_mid, qos=qos))
+        return SimpleNamespace(rc=0, mid=self.next_mid)
+
+
+def topic_matches(pattern, topic):
+    # MQTT wildcards: + matches one level, # the rest.
+    pattern_levels = pattern.split('/')
+    topic_levels = topic.split('/')
+    for i, level in enumerate(pattern_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels) or (level != '+' and level != topic_levels[i]):
+            return False
+    return len(pattern_levels) == len(topic_levels)
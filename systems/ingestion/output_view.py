@@ -0,0 +1,90 @@
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+
+
+class OutputView:
+    """Index of the segment store's blocks for paging through ingested rows.
+
+    For every block only its id, source label and first row are kept; a
+    refresh adds the blocks appended since the last one without decoding
+    them. Decoded blocks are kept in an LRU of at most cache_bytes, and a
+    page that needs others reads them back from the segments holding them.
+    """
+
+    def __init__(self, store, cache_bytes=64 * 1024 * 1024):
+        self.store = store
+        self.cache_bytes = cache_bytes
+        self.lock = threading.Lock()
+        self.version = None
+        self.last_block = 0
+        self.block_ids = []
+        self.labels = []
+        # Row number where each block starts, for finding the first block of a page.
+        self.starts = []
+        self.rows = 0
+        # block -> (DataFrame, bytes), least recently used first
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+
+    def refresh(self):
+        with self.lock:
+            version = self.store.version
+            if version == self.version:
+                return version
+            for block, source_label, rows in self.store.block_sizes(since=self.last_block):
+                self.block_ids.append(block)
+                self.labels.append(source_label)
+                self.starts.append(self.rows)
+                self.rows += rows
+                self.last_block = block
+            self.version = version
+            return version
+
+    def page(self, offset, limit, columns=None):
+        """Return [(block, source_label, DataFrame)] covering rows offset to offset + limit.
+
+        columns keeps only the named columns of each block; blocks left with
+        none are skipped.
+        """
+        with self.lock:
+            starts = self.starts
+            end = offset + limit
+            first = last = max(bisect_right(starts, offset) - 1, 0)
+            while last < len(starts) and starts[last] < end:
+                last += 1
+            frames = self.frames(self.block_ids[first:last])
+
+            page = []
+            for i in range(first, last):
+                frame = frames[self.block_ids[i]]
+                rows = frame.iloc[max(offset - starts[i], 0):end - starts[i]]
+                if columns is not None:
+                    rows = rows[[column for column in rows.columns if column in columns]]
+                if len(rows.columns):
+                    page.append((self.block_ids[i], self.labels[i], rows))
+            return page
+
+    def frames(self, blocks):
+        """The decoded frames of blocks, from the cache or else from the store. Called with the lock held."""
+        frames = {}
+        for block in blocks:
+            if block in self.cache:
+                self.cache.move_to_end(block)
+                frames[block] = self.cache[block][0]
+        missing = [block for block in blocks if block not in frames]
+        if missing:
+            for block, _, frame in self.store.read(missing):
+                frames[block] = frame
+                self.remember(block, frame)
+        return frames
+
+    def remember(self, block, frame):
+        size = int(frame.memory_usage(index=False, deep=True).sum())
+        if size > self.cache_bytes:
+            return
+        self.cache[block] = (frame, size)
+        self.cached_bytes += size
+        while self.cached_bytes > self.cache_bytes:
+            _, (_, evicted) = self.cache.popitem(last=False)
+            self.cached_bytes -= evicted
@@ -0,0 +1,164 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+from groovybytes import wire
+
+
+class ParseCache:
+    """Parsed uploads kept as Arrow files, keyed by the hash of the uploaded bytes.
+
+    Each entry is a directory holding one file per parsed chunk and the sheet
+    each chunk came from, so a cached upload is replayed chunk by chunk like a
+    fresh parse. Past max_bytes the least recently used entries are removed.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # digest -> size in bytes, least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        # digest -> chunk readers still open on it; an evicted entry they hold
+        # is only removed from disk once the last one is done.
+        self.readers = {}
+        self.evicted = set()
+        os.makedirs(directory, exist_ok=True)
+
+        found = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith('.tmp'):
+                # Left by a parse that never finished.
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.isdir(path):
+                found.append((os.path.getmtime(path), name, self.entry_size(path)))
+        for _, digest, size in sorted(found):
+            self.entries[digest] = size
+            self.size += size
+
+    @staticmethod
+    def entry_size(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+    def __contains__(self, digest):
+        with self.lock:
+            return digest in self.entries
+
+    def get(self, digest):
+        """The cached chunks of an upload as an iterator of (sheet, DataFrame); None if it is not cached.
+
+        The entry stays on disk until the iterator is exhausted or closed,
+        even if it is evicted meanwhile.
+        """
+        path = os.path.join(self.directory, digest)
+        with self.lock:
+            if digest not in self.entries:
+                return None
+            self.entries.move_to_end(digest)
+            # Remembers the order across restarts.
+            os.utime(path)
+            names = sorted(name for name in os.listdir(path) if name.endswith('.arrow'))
+            self.readers[digest] = self.readers.get(digest, 0) + 1
+        return CachedChunks(self, digest, self.read_chunks(path, names))
+
+    @staticmethod
+    def read_chunks(path, names):
+        try:
+            with open(os.path.join(path, 'sheets.json')) as f:
+                sheets = json.load(f)
+        except FileNotFoundError:
+            sheets = [None] * len(names)
+        for name, sheet in zip(names, sheets):
+            with open(os.path.join(path, name), 'rb') as f:
+                yield sheet, wire.decode_arrow(f.read(), as_frame=True)
+
+    def release(self, digest):
+        with self.lock:
+            self.readers[digest] -= 1
+            if self.readers[digest]:
+                return
+            del self.readers[digest]
+            if digest in self.evicted:
+                self.evicted.discard(digest)
+                shutil.rmtree(os.path.join(self.directory, digest), ignore_errors=True)
+
+    def writer(self, digest):
+        return CacheWriter(self, digest)
+
+    def add(self, digest, tmp_path):
+        path = os.path.join(self.directory, digest)
+        size = self.entry_size(tmp_path)
+        with self.lock:
+            if digest in self.entries or digest in self.evicted or size > self.max_bytes:
+                # Another upload of the same bytes got here first (and may still
+                # be being read after its eviction), or it would never fit.
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                return
+            os.replace(tmp_path, path)
+            self.entries[digest] = size
+            self.size += size
+            while self.size > self.max_bytes:
+                old_digest, old_size = self.entries.popitem(last=False)
+                self.size -= old_size
+                if old_digest in self.readers:
+                    self.evicted.add(old_digest)
+                else:
+                    shutil.rmtree(os.path.join(self.directory, old_digest), ignore_errors=True)
+
+
+class CachedChunks:
+    """Iterator over the chunks of one cache entry, which it keeps on disk until it is done."""
+
+    def __init__(self, cache, digest, chunks):
+        self.cache = cache
+        self.digest = digest
+        self.chunks = chunks
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if not self.done:
+            self.done = True
+            self.chunks.close()
+            self.cache.release(self.digest)
+
+    def __del__(self):
+        self.close()
+
+
+class CacheWriter:
+    """Collects the chunks of one parse; nothing is visible in the cache until commit()."""
+
+    def __init__(self, cache, digest):
+        self.cache = cache
+        self.digest = digest
+        self.path = os.path.join(cache.directory, f'{digest}-{uuid.uuid4().hex}.tmp')
+        self.sheets = []
+        os.makedirs(self.path)
+
+    def write(self, data, sheet=None):
+        with open(os.path.join(self.path, f'{len(self.sheets):08d}.arrow'), 'wb') as f:
+            f.write(wire.encode_arrow(data))
+        self.sheets.append(sheet)
+
+    def commit(self):
+        with open(os.path.join(self.path, 'sheets.json'), 'w') as f:
+            json.dump(self.sheets, f)
+        self.cache.add(self.digest, self.path)
+
+    def discard(self):
+        shutil.rmtree(self.path, ignore_errors=True)
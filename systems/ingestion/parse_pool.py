@@ -0,0 +1,111 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty, Full
+
+from groovybytes import wire
+
+import readers
+
+# Seconds between checks of the stop flag, or of a failed worker, while waiting on a queue.
+POLL_INTERVAL = 0.5
+
+
+def parse_sheet(file_path, sheet, chunk_rows, chunks, stop):
+    # Runs in a pool process. Each chunk goes back as soon as it is parsed, as
+    # an Arrow buffer, which costs far less to send between processes than a
+    # pickled DataFrame. The queue is bounded, so a sheet does not run ahead
+    # of the job reading it.
+    for chunk in readers.read_chunks(file_path, chunk_rows, sheet):
+        if not put(chunks, wire.encode_arrow(chunk), stop):
+            return
+    put(chunks, None, stop)
+
+
+def put(queue, item, stop):
+    """Put item on queue once there is room; False if stop was set first."""
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=POLL_INTERVAL)
+            return True
+        except Full:
+            pass
+    return False
+
+
+class ParsePool:
+    """Process pool that parses the sheets of a workbook in parallel.
+
+    Jobs for different files share the pool, so the sheets of all the
+    workbooks being ingested are parsed side by side on every core. Each job
+    has at most one sheet per worker in flight, and each sheet at most
+    queue_chunks parsed chunks waiting, so memory stays bounded however big
+    the workbook is.
+    """
+
+    def __init__(self, workers=None, queue_chunks=2):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_chunks = queue_chunks
+        # Spawned rather than forked: the server forks from a process that is
+        # already running its worker and Flask threads.
+        self.context = multiprocessing.get_context('spawn')
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context)
+        self.manager = None
+        self.lock = threading.Lock()
+
+    def start_manager(self):
+        # The manager's queues can be handed to pool tasks, unlike multiprocessing queues.
+        with self.lock:
+            if self.manager is None:
+                self.manager = self.context.Manager()
+            return self.manager
+
+    def read_sheets(self, file_path, chunk_rows):
+        """Yield (sheet name, DataFrame) for every chunk of every sheet, in workbook order.
+
+        The first chunk is yielded as soon as it is parsed, while the next
+        sheets are parsed ahead of it.
+        """
+        sheets = readers.sheet_names(file_path)
+        manager = self.start_manager()
+        stop = manager.Event()
+        chunks = [manager.Queue(self.queue_chunks) for _ in sheets]
+        futures = {}
+
+        def submit(i):
+            if i < len(sheets):
+                futures[i] = self.executor.submit(parse_sheet, file_path, sheets[i], chunk_rows, chunks[i], stop)
+
+        try:
+            for i in range(self.workers):
+                submit(i)
+            for i, sheet in enumerate(sheets):
+                while True:
+                    body = self.next_chunk(chunks[i], futures[i])
+                    if body is None:
+                        break
+                    yield sheet, wire.decode_arrow(body, as_frame=True)
+                submit(i + self.workers)
+        finally:
+            # Left early: cancelled or failed. Workers still parsing give up.
+            stop.set()
+            for future in futures.values():
+                future.cancel()
+
+    @staticmethod
+    def next_chunk(queue, future):
+        """The next Arrow buffer of a sheet, or None at its end; raises what the worker raised."""
+        while True:
+            try:
+                return queue.get(timeout=POLL_INTERVAL)
+            except Empty:
+                if future.done() and future.exception() is not None:
+                    raise future.exception()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        # Workers still waiting to hand over a chunk fail once the queues are gone.
+        if self.manager is not None:
+            self.manager.shutdown()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,207 @@
+import json
+from itertools import chain, islice
+
+import pandas as pd
+from openpyxl import load_workbook
+
+CHUNK_ROWS = 50000
+JSON_BLOCK_SIZE = 1 << 20
+# Skipped between the values of a JSON array or of NDJSON.
+JSON_SEPARATORS = ' \t\r\n,'
+
+# Cell text pd.read_excel reads as missing.
+NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+             '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'}
+
+
+def read_chunks(file_path, chunk_rows=CHUNK_ROWS, sheet=None):
+    """Yield the rows of an upload as DataFrames of at most chunk_rows rows.
+
+    Only one chunk (plus a read buffer) is held in memory at a time, except
+    for legacy .xls files, which xlrd can only load whole. Spreadsheets are
+    read from their first sheet unless sheet names another.
+    """
+    ext = file_path.rsplit('.', 1)[-1].lower()
+    if ext not in READERS:
+        raise ValueError(f'Unsupported file type: {file_path}')
+    chunks = READERS[ext](file_path, chunk_rows) if sheet is None else READERS[ext](file_path, chunk_rows, sheet)
+    for chunk in chunks:
+        if len(chunk):
+            yield chunk
+
+
+def sheet_names(file_path):
+    """Names of the sheets of a spreadsheet, in workbook order."""
+    if file_path.rsplit('.', 1)[-1].lower() == 'xlsx':
+        workbook = load_workbook(file_path, read_only=True)
+        try:
+            return workbook.sheetnames
+        finally:
+            workbook.close()
+    with pd.ExcelFile(file_path) as workbook:
+        return workbook.sheet_names
+
+
+def read_csv(file_path, chunk_rows):
+    with pd.read_csv(file_path, chunksize=chunk_rows) as reader:
+        yield from reader
+
+
+def read_xlsx(file_path, chunk_rows, sheet=0):
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        # pd.read_excel reads the first sheet, which is not always the active one.
+        worksheet = workbook.worksheets[sheet] if isinstance(sheet, int) else workbook[sheet]
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = column_names(header)
+        width = len(columns)
+
+        batch = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            row = row[:width] + (None,) * (width - len(row))
+            batch.append(tuple(None if value.__class__ is str and value in NA_VALUES else value
+                               for value in row))
+            if len(batch) >= chunk_rows:
+                yield pd.DataFrame(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns)
+    finally:
+        workbook.close()
+
+
+def read_xls(file_path, chunk_rows, sheet=0):
+    # xlrd has no streaming mode, and .xls sheets stop at 65536 rows anyway.
+    yield from read_frame(pd.read_excel(file_path, sheet_name=sheet), chunk_rows)
+
+
+def read_json(file_path, chunk_rows):
+    records = iter_json_values(file_path)
+    if first_char(file_path) != '[':
+        head = list(islice(records, 2))
+        if len(head) == 1 and is_column_document(head[0]):
+            # A lone {"column": {...}} document is read by column, as before;
+            # it has to be held whole anyway.
+            yield from read_frame(pd.read_json(file_path), chunk_rows)
+            return
+        records = chain(head, records)
+    yield from read_records(records, chunk_rows)
+
+
+def read_ndjson(file_path, chunk_rows):
+    yield from read_records(iter_json_values(file_path), chunk_rows)
+
+
+def read_records(records, chunk_rows):
+    records = (record if isinstance(record, dict) else {0: record} for record in records)
+    while True:
+        batch = list(islice(records, chunk_rows))
+        if not batch:
+            return
+        yield pd.DataFrame.from_records(batch)
+
+
+def read_frame(data, chunk_rows):
+    for start in range(0, len(data), chunk_rows):
+        yield data.iloc[start:start + chunk_rows]
+
+
+def iter_json_values(file_path, block_size=JSON_BLOCK_SIZE):
+    """Yield the values of a JSON array, or of whitespace-separated JSON values (NDJSON).
+
+    The file is read block by block, so memory is bounded by the block size and
+    the largest single value rather than by the file.
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        buffer = ''
+        pos = 0
+        eof = False
+        in_array = False
+        started = False
+
+        while True:
+            # Skip whitespace, the array brackets and the commas between values.
+            while True:
+                while pos < len(buffer) and buffer[pos] in JSON_SEPARATORS:
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    break
+                buffer, pos = f.read(block_size), 0
+                eof = not buffer
+
+            if pos >= len(buffer):
+                return
+            if not started:
+                started = True
+                if buffer[pos] == '[':
+                    in_array = True
+                    pos += 1
+                    continue
+            if in_array and buffer[pos] == ']':
+                return
+
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    # A value that runs to the end of the buffer may continue in the next
+                    # block, and so may a number cut off before its fraction or exponent.
+                    if eof or (end < len(buffer) and (buffer[pos] in '{["' or buffer[end] in JSON_SEPARATORS
+                                                      or buffer[end] == ']')):
+                        break
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                block = f.read(block_size)
+                eof = not block
+                buffer, pos = buffer[pos:] + block, 0
+
+            yield value
+            pos = end
+
+
+def first_char(file_path):
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        while True:
+            block = f.read(4096)
+            if not block:
+                return ''
+            stripped = block.lstrip()
+            if stripped:
+                return stripped[0]
+
+
+def is_column_document(value):
+    return isinstance(value, dict) and value and all(isinstance(column, (dict, list))
+                                                     for column in value.values())
+
+
+def column_names(header):
+    # Same names pd.read_excel gives blank and repeated headers.
+    names = []
+    seen = {}
+    for i, name in enumerate(header):
+        if name is None:
+            name = f'Unnamed: {i}'
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        names.append(f'{name}.{count}' if count else name)
+    return names
+
+
+# Formats with several sheets, each read on its own.
+SHEET_FORMATS = ('xlsx', 'xls')
+
+READERS = {
+    'csv': read_csv,
+    'xlsx': read_xlsx,
+    'xls': read_xls,
+    'json': read_json,
+    'ndjson': read_ndjson,
+    'jsonl': read_ndjson,
+}
@@ -0,0 +1,288 @@
+import os
+import re
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from groovybytes import wire
+
+BLOCK = '__block'
+SOURCE = '__source'
+SEGMENT_NAME = re.compile(r'^segment-(\d+)-(\d+)\.arrow$')
+
+
+class SegmentStore:
+    """Append-optimized store for ingested data.
+
+    Every append is a block: a DataFrame and the source label it came from.
+    Blocks are buffered in memory and written out as Arrow segment files,
+    one per set of columns, named after the range of block ids they hold so
+    the store can be reopened without reading them. The source label is kept
+    once per segment (a dictionary column) instead of in every cell, and
+    small segments are merged by compact().
+    """
+
+    def __init__(self, directory, buffer_rows=5000, flush_interval=5.0, compact_min_segments=8,
+                 segment_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.buffer_rows = buffer_rows
+        self.flush_interval = flush_interval
+        self.compact_min_segments = compact_min_segments
+        self.segment_bytes = segment_bytes
+        self.lock = threading.RLock()
+        self.buffer = {}
+        self.buffered_rows = 0
+        self.oldest = None
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = sorted(self.list_segments())
+        self.drop_leftovers()
+        self.next_block = max((last for _, last, _ in self.segments), default=0) + 1
+        # Bumped by every append, so readers can tell whether their copy is stale.
+        self.version = self.next_block
+
+        self.stop = threading.Event()
+        self.flusher = None
+        if flush_interval:
+            self.flusher = threading.Thread(target=self.run_flusher, daemon=True)
+            self.flusher.start()
+
+    def list_segments(self):
+        for name in os.listdir(self.directory):
+            match = SEGMENT_NAME.match(name)
+            if match:
+                yield int(match.group(1)), int(match.group(2)), os.path.join(self.directory, name)
+
+    @staticmethod
+    def segment_columns(path):
+        with pa.memory_map(path) as source:
+            names = pa.ipc.open_stream(source).schema.names
+        return tuple(name for name in names if name not in (BLOCK, SOURCE))
+
+    def drop_leftovers(self):
+        # A compaction that stopped between writing the merged segment and
+        # removing its parts leaves parts whose blocks are all in the merged one.
+        columns = {path: self.segment_columns(path) for _, _, path in self.segments}
+        leftovers = set()
+        for first, last, path in self.segments:
+            for other_first, other_last, other_path in self.segments:
+                if (other_path != path and other_first <= first and last <= other_last
+                        and (other_first, other_last) != (first, last)
+                        and columns[other_path] == columns[path]):
+                    leftovers.add(path)
+        for path in leftovers:
+            os.remove(path)
+        self.segments = [segment for segment in self.segments if segment[2] not in leftovers]
+
+    def append(self, data, source_label):
+        with self.lock:
+            block = self.next_block
+            self.next_block += 1
+            self.version += 1
+            columns = tuple(str(column) for column in data.columns)
+            frame = data.set_axis(list(columns), axis=1)
+            self.buffer.setdefault(columns, []).append((block, source_label, frame))
+            self.buffered_rows += len(frame)
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            if self.buffered_rows >= self.buffer_rows:
+                self.flush()
+        return block
+
+    def empty(self):
+        with self.lock:
+            return not self.segments and not self.buffer
+
+    def run_flusher(self):
+        while not self.stop.wait(min(self.flush_interval, 1.0)):
+            with self.lock:
+                due = self.oldest is not None and time.monotonic() - self.oldest >= self.flush_interval
+            if due:
+                self.flush()
+                self.maybe_compact()
+
+    def flush(self):
+        with self.lock:
+            buffer, self.buffer = self.buffer, {}
+            self.buffered_rows = 0
+            self.oldest = None
+            for blocks in buffer.values():
+                self.write_segment(blocks)
+
+    def write_segment(self, blocks):
+        frames = []
+        for block, source_label, frame in blocks:
+            frames.append(frame.assign(**{BLOCK: block, SOURCE: source_label}))
+        frame = pd.concat(frames, ignore_index=True)
+        frame[SOURCE] = frame[SOURCE].astype('category')
+
+        first, last = blocks[0][0], blocks[-1][0]
+        path = os.path.join(self.directory, f'segment-{first:012d}-{last:012d}.arrow')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(wire.encode_arrow(frame))
+        os.replace(tmp_path, path)
+        self.segments.append((first, last, path))
+        self.segments.sort()
+
+    @staticmethod
+    def read_segment(path):
+        with open(path, 'rb') as f:
+            return wire.decode_arrow(f.read(), as_frame=True)
+
+    def blocks(self, since=0):
+        """Return [(block, source_label, DataFrame)] for every append after block since, in order.
+
+        Only segments holding such blocks are read, so callers that keep what
+        they have seen can catch up cheaply.
+        """
+        while True:
+            with self.lock:
+                segments = [path for _, last, path in self.segments if last > since]
+                buffered = [entry for blocks in self.buffer.values() for entry in blocks if entry[0] > since]
+            try:
+                found = self.read_blocks(segments, since)
+            except FileNotFoundError:
+                # A compaction replaced one of the segments; look again.
+                continue
+            found.extend(buffered)
+            found.sort(key=lambda entry: entry[0])
+            return found
+
+    def read(self, wanted):
+        """Return [(block, source_label, DataFrame)] for the blocks whose ids are in wanted, in order.
+
+        Only the segments whose range of block ids holds one of them are read.
+        """
+        wanted = set(wanted)
+        while True:
+            with self.lock:
+                segments = [path for first, last, path in self.segments
+                            if any(first <= block <= last for block in wanted)]
+                buffered = [entry for blocks in self.buffer.values() for entry in blocks if entry[0] in wanted]
+            try:
+                found = self.read_blocks(segments, wanted=wanted)
+            except FileNotFoundError:
+                continue
+            found.extend(buffered)
+            found.sort(key=lambda entry: entry[0])
+            return found
+
+    def block_sizes(self, since=0):
+        """Return [(block, source_label, rows)] for every append after block since, in order.
+
+        Segments are memory-mapped and only their block and source columns are
+        looked at, so no rows are decoded.
+        """
+        while True:
+            with self.lock:
+                segments = [path for _, last, path in self.segments if last > since]
+                buffered = [(block, source_label, len(frame)) for blocks in self.buffer.values()
+                            for block, source_label, frame in blocks if block > since]
+            found = []
+            try:
+                for path in segments:
+                    with pa.memory_map(path) as source:
+                        frame = pa.ipc.open_stream(source).read_all().select([BLOCK, SOURCE]).to_pandas()
+                    frame = frame[frame[BLOCK] > since]
+                    for block, rows in frame.groupby(BLOCK, sort=False):
+                        found.append((int(block), str(rows[SOURCE].iat[0]), len(rows)))
+            except FileNotFoundError:
+                continue
+            found.extend(buffered)
+            found.sort(key=lambda entry: entry[0])
+            return found
+
+    def read_blocks(self, segments, since=0, wanted=None):
+        found = []
+        for path in segments:
+            frame = self.read_segment(path)
+            frame = frame[frame[BLOCK] > since]
+            if wanted is not None:
+                frame = frame[frame[BLOCK].isin(wanted)]
+            columns = [column for column in frame.columns if column not in (BLOCK, SOURCE)]
+            for block, rows in frame.groupby(BLOCK, sort=False):
+                found.append((int(block), str(rows[SOURCE].iat[0]), rows[columns].reset_index(drop=True)))
+        return found
+
+    def maybe_compact(self):
+        with self.lock:
+            small = [path for _, _, path in self.segments if os.path.getsize(path) < self.segment_bytes]
+        if len(small) >= self.compact_min_segments:
+            self.compact()
+
+    def compact(self):
+        """Merge small segments with the same columns into files of up to segment_bytes."""
+        with self.lock:
+            groups = {}
+            for first, last, path in self.segments:
+                groups.setdefault(self.segment_columns(path), []).append((first, last, path))
+
+            for entries in groups.values():
+                runs = [[]]
+                size = 0
+                for entry in entries:
+                    entry_size = os.path.getsize(entry[2])
+                    if runs[-1] and size + entry_size > self.segment_bytes:
+                        runs.append([])
+                        size = 0
+                    runs[-1].append(entry)
+                    size += entry_size
+                for run in runs:
+                    if len(run) > 1:
+                        self.merge_segments(run)
+
+    def merge_segments(self, parts):
+        frame = pd.concat([self.read_segment(path) for _, _, path in parts], ignore_index=True)
+        frame[SOURCE] = frame[SOURCE].astype(str).astype('category')
+        first, last = parts[0][0], parts[-1][1]
+        path = os.path.join(self.directory, f'segment-{first:012d}-{last:012d}.arrow')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(wire.encode_arrow(frame))
+        os.replace(tmp_path, path)
+
+        # Segments of other columns can hold blocks between first and last,
+        # so readers order blocks by id rather than by file.
+        old_paths = {part_path for _, _, part_path in parts} - {path}
+        for old_path in old_paths:
+            os.remove(old_path)
+        self.segments = sorted([segment for segment in self.segments if segment[2] not in old_paths
+                                and segment[2] != path] + [(first, last, path)])
+
+    def export_excel(self, path):
+        """Write every block to a workbook in the layout append_to_excel used to build."""
+        bold = Font(bold=True)
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+
+        def bold_cell(value):
+            cell = WriteOnlyCell(sheet, value=value)
+            cell.font = bold
+            return cell
+
+        first = True
+        for _, source_label, frame in self.blocks():
+            # A blank row between entries, the source label, then the headers.
+            if not first:
+                sheet.append([])
+            first = False
+            sheet.append([bold_cell(source_label)])
+            sheet.append([None] + [bold_cell(column) for column in frame.columns])
+            for row in frame.itertuples(index=False, name=None):
+                sheet.append([None] + [f"{value}::{source_label}::{column}"
+                                       for value, column in zip(row, frame.columns)])
+
+        tmp_path = f'{path}.tmp'
+        workbook.save(tmp_path)
+        os.replace(tmp_path, path)
+
+    def close(self):
+        self.stop.set()
+        if self.flusher is not None:
+            self.flusher.join()
+        self.flush()
@@ -0,0 +1,187 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# States a job does not leave, which compaction may drop once they are old.
+FINAL_STATES = ('processed', 'error', 'cancelled', 'duplicate')
+# States of an upload whose job has not finished yet.
+UNFINISHED_STATES = ('uploaded', 'queued', 'processing')
+# States in which an upload's content is on its way downstream, or was
+# delivered in full ('processed'); an upload that fails moves to 'error'.
+LIVE_STATES = (*UNFINISHED_STATES, 'processed')
+
+
+class StatusStore:
+    """Current state of every upload and MQTT message, in SQLite with write-ahead logging.
+
+    A status change is one indexed upsert instead of a rewrite of the whole
+    history. Every change takes the next cursor, so clients can ask for what
+    changed since the last cursor they saw. Uploads also record the hash of
+    their content, to find earlier uploads of the same bytes.
+    """
+
+    def __init__(self, path, legacy_path=None, retention=None, compact_every=10000):
+        self.path = path
+        self.retention = retention
+        self.compact_every = compact_every
+        self.lock = threading.Lock()
+        self.writes = 0
+
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS status (
+                name TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                cursor INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS status_state ON status (state, cursor);
+            CREATE INDEX IF NOT EXISTS status_updated_at ON status (updated_at);
+            CREATE UNIQUE INDEX IF NOT EXISTS status_cursor ON status (cursor);
+        ''')
+        if 'digest' not in [row[1] for row in self.db.execute('PRAGMA table_info(status)')]:
+            self.db.execute('ALTER TABLE status ADD COLUMN digest TEXT')
+        self.db.execute('CREATE INDEX IF NOT EXISTS status_digest ON status (digest, cursor)')
+        self.cursor = self.db.execute('SELECT COALESCE(MAX(cursor), 0) FROM status').fetchone()[0]
+
+        if legacy_path and self.cursor == 0 and os.path.exists(legacy_path):
+            self.import_history(legacy_path)
+
+    def import_history(self, legacy_path):
+        # One-time move from upload_history.json, keeping its order.
+        with open(legacy_path, 'r') as f:
+            history = json.load(f)
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN')
+            for name, state in history.items():
+                self.cursor += 1
+                self.db.execute('INSERT OR REPLACE INTO status (name, state, updated_at, cursor) '
+                                'VALUES (?, ?, ?, ?)', (name, state, now, self.cursor))
+            self.db.execute('COMMIT')
+
+    def set(self, name, state, digest=None):
+        with self.lock:
+            self.cursor += 1
+            self.db.execute('''
+                INSERT INTO status (name, state, updated_at, cursor, digest) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET state = excluded.state,
+                    updated_at = excluded.updated_at, cursor = excluded.cursor,
+                    digest = COALESCE(excluded.digest, status.digest)
+            ''', (name, state, time.time(), self.cursor, digest))
+            self.writes += 1
+            if self.writes % self.compact_every == 0:
+                self.compact_locked()
+
+    def get(self, name):
+        with self.lock:
+            row = self.db.execute('SELECT state FROM status WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def find_digest(self, digest, states=LIVE_STATES):
+        """Name of the latest upload of this content in one of states, or None."""
+        with self.lock:
+            row = self.db.execute(f'''
+                SELECT name FROM status WHERE digest = ? AND state IN ({', '.join('?' * len(states))})
+                ORDER BY cursor DESC LIMIT 1
+            ''', (digest, *states)).fetchone()
+        return row[0] if row else None
+
+    def claim(self, name, digest, duplicate_state=None, states=LIVE_STATES):
+        """Record the upload name of digest; returns the latest earlier upload in states, or None.
+
+        name is recorded as 'uploaded', or as duplicate_state if given and
+        there is an earlier upload. The lookup and the insert are one
+        transaction, so of several uploads of the same content arriving
+        together only one finds no earlier copy.
+        """
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.db.execute(f'''
+                    SELECT name FROM status WHERE digest = ? AND state IN ({', '.join('?' * len(states))})
+                    ORDER BY cursor DESC LIMIT 1
+                ''', (digest, *states)).fetchone()
+                state = duplicate_state if row and duplicate_state else 'uploaded'
+                self.cursor += 1
+                self.db.execute('''
+                    INSERT INTO status (name, state, updated_at, cursor, digest) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (name) DO UPDATE SET state = excluded.state,
+                        updated_at = excluded.updated_at, cursor = excluded.cursor, digest = excluded.digest
+                ''', (name, state, time.time(), self.cursor, digest))
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.writes += 1
+        return row[0] if row else None
+
+    def fail_unfinished(self, states=UNFINISHED_STATES, state='error'):
+        """Move every entry still in states to state; returns how many there were.
+
+        For entries left behind by an earlier run, whose jobs died with it.
+        """
+        with self.lock:
+            names = [name for (name,) in self.db.execute(
+                f'SELECT name FROM status WHERE state IN ({", ".join("?" * len(states))}) ORDER BY cursor',
+                states)]
+            self.db.execute('BEGIN')
+            for name in names:
+                self.cursor += 1
+                self.db.execute('UPDATE status SET state = ?, updated_at = ?, cursor = ? WHERE name = ?',
+                                (state, time.time(), self.cursor, name))
+            self.db.execute('COMMIT')
+        return len(names)
+
+    def all(self):
+        """Every status as {name: state}, oldest change first."""
+        with self.lock:
+            return dict(self.db.execute('SELECT name, state FROM status ORDER BY cursor'))
+
+    def query(self, since=0, state=None, name=None, updated_after=None, limit=100):
+        """Statuses changed after the since cursor, oldest first, optionally filtered.
+
+        Returns (rows, next_cursor); pass next_cursor back as since for the next page.
+        """
+        clauses = ['cursor > ?']
+        params = [since]
+        if state is not None:
+            clauses.append('state = ?')
+            params.append(state)
+        if name is not None:
+            clauses.append('name = ?')
+            params.append(name)
+        if updated_after is not None:
+            clauses.append('updated_at > ?')
+            params.append(updated_after)
+        params.append(limit)
+
+        with self.lock:
+            rows = self.db.execute(f'''
+                SELECT name, state, updated_at, cursor FROM status
+                WHERE {' AND '.join(clauses)} ORDER BY cursor LIMIT ?
+            ''', params).fetchall()
+        items = [{'name': name, 'state': state, 'updated_at': updated_at, 'cursor': cursor}
+                 for name, state, updated_at, cursor in rows]
+        return items, items[-1]['cursor'] if items else since
+
+    def compact(self):
+        with self.lock:
+            self.compact_locked()
+
+    def compact_locked(self):
+        # Drop finished entries past the retention, then fold the WAL back into the database.
+        if self.retention is not None:
+            self.db.execute(f'''
+                DELETE FROM status WHERE updated_at < ?
+                AND state IN ({', '.join('?' * len(FINAL_STATES))})
+            ''', (time.time() - self.retention, *FINAL_STATES))
+        self.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def close(self):
+        with self.lock:
+            self.db.close()
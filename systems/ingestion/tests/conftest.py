@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# The service runs from its own directory and imports its modules by name.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def ingestion_dir(tmp_path_factory):
+    # The app opens its stores in the working directory when it is imported.
+    directory = tmp_path_factory.mktemp('ingestion')
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        import app
+        os.makedirs(app.UPLOAD_FOLDER, exist_ok=True)
+        # Queued jobs are left alone; tests run the parts they are about themselves.
+        app.workers.shutdown()
+    finally:
+        os.chdir(cwd)
+    return directory
+
+
+@pytest.fixture
+def ingestion(ingestion_dir, monkeypatch):
+    """The ingestion app module, run from the directory its stores were opened in."""
+    import app
+    monkeypatch.chdir(ingestion_dir)
+    return app
@@ -0,0 +1,149 @@
+import hashlib
+import io
+import os
+import threading
+
+import pytest
+
+from chunked_uploads import UploadSessions, UploadTooLarge
+
+DATA = bytes(range(256)) * 40  # 10240 bytes
+CHUNK = 4096
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def put(sessions, upload, offset, data=None, checksum=None):
+    data = DATA[offset:offset + CHUNK] if data is None else data
+    sessions.write_chunk(upload, offset, io.BytesIO(data), len(data), checksum or sha256(data))
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    return UploadSessions(str(tmp_path), chunk_size=CHUNK, max_size=len(DATA) * 2)
+
+
+def test_chunks_in_any_order(sessions):
+    upload = sessions.create('people.csv', len(DATA))
+    for offset in (8192, 0, 4096):
+        put(sessions, upload, offset)
+    assert sessions.finalize(upload, sha256(DATA)) == sha256(DATA)
+    with open(upload.data_path, 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_bad_checksum_is_rejected_and_the_range_stays_missing(sessions):
+    upload = sessions.create('people.csv', len(DATA))
+    with pytest.raises(ValueError, match='checksum'):
+        put(sessions, upload, 0, checksum=sha256(b'something else'))
+    assert upload.missing() == [[0, len(DATA)]]
+    with pytest.raises(ValueError, match='checksum'):
+        sessions.write_chunk(upload, 0, io.BytesIO(DATA[:CHUNK]), CHUNK, None)
+
+
+
+def test_a_corrupt_retry_leaves_the_received_bytes_alone(sessions):
+    upload = sessions.create('people.csv', len(DATA))
+    put(sessions, upload, 0)
+    with pytest.raises(ValueError, match='checksum'):
+        put(sessions, upload, 0, bytes(CHUNK), checksum=sha256(DATA[:CHUNK]))
+    with pytest.raises(ValueError, match='ended'):
+        sessions.write_chunk(upload, 0, io.BytesIO(bytes(CHUNK // 2)), CHUNK, sha256(DATA[:CHUNK]))
+    for offset in (4096, 8192):
+        put(sessions, upload, offset)
+    assert sessions.finalize(upload, sha256(DATA)) == sha256(DATA)
+    with open(upload.data_path, 'rb') as f:
+        assert f.read() == DATA
+
+def test_resume_from_the_missing_ranges_after_a_restart(sessions, tmp_path):
+    upload = sessions.create('people.csv', len(DATA))
+    put(sessions, upload, 4096)
+
+    # A new process only has what is on disk.
+    reopened = UploadSessions(str(tmp_path), chunk_size=CHUNK)
+    upload = reopened.get(upload.id)
+    assert upload.describe()['missing'] == [[0, 4096], [8192, len(DATA)]]
+    for start, end in upload.describe()['missing']:
+        put(reopened, upload, start, DATA[start:end])
+    assert reopened.finalize(upload) == sha256(DATA)
+
+
+def test_finalize_with_gaps(sessions):
+    upload = sessions.create('people.csv', len(DATA))
+    put(sessions, upload, 0)
+    put(sessions, upload, 8192)
+    with pytest.raises(ValueError, match='missing 1 range'):
+        sessions.finalize(upload)
+    put(sessions, upload, 4096)
+    with pytest.raises(ValueError, match='checksum'):
+        sessions.finalize(upload, sha256(b'other'))
+    # A failed finalize can be retried.
+    assert sessions.finalize(upload) == sha256(DATA)
+
+
+def test_only_one_finalize_succeeds(sessions):
+    upload = sessions.create('people.csv', len(DATA))
+    for offset in range(0, len(DATA), CHUNK):
+        put(sessions, upload, offset)
+    results = []
+
+    def finalize():
+        try:
+            results.append(sessions.finalize(upload))
+        except ValueError as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=finalize) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(sha256(DATA)) == 1
+    with pytest.raises(ValueError, match='finalized'):
+        put(sessions, upload, 0)
+
+
+def test_size_limits(sessions):
+    with pytest.raises(UploadTooLarge):
+        sessions.create('huge.csv', len(DATA) * 2 + 1)
+    with pytest.raises(ValueError):
+        sessions.create('negative.csv', -1)
+    upload = sessions.create('people.csv', len(DATA))
+    with pytest.raises(ValueError, match='outside'):
+        put(sessions, upload, len(DATA) - 10, DATA[:CHUNK])
+
+
+@pytest.fixture
+def client(ingestion, monkeypatch):
+    monkeypatch.setattr(ingestion.upload_sessions, 'max_size', len(DATA) * 2)
+    return ingestion.app.test_client()
+
+
+def test_upload_over_http(client):
+    assert client.post('/ingestion/uploads', json={'filename': 'huge.csv', 'size': len(DATA) * 3}).status_code == 413
+
+    upload = client.post('/ingestion/uploads', json={'filename': 'people.csv', 'size': len(DATA),
+                                                     'chunk_size': CHUNK}).get_json()
+    url = f"/ingestion/uploads/{upload['id']}"
+    chunks = [(offset, DATA[offset:offset + upload['chunk_size']])
+              for offset in range(0, len(DATA), upload['chunk_size'])]
+
+    def put_chunk(offset, data, checksum=None):
+        return client.put(url, query_string={'offset': offset}, data=data,
+                          headers={'X-Chunk-SHA256': checksum or sha256(data)})
+
+    assert put_chunk(*chunks[-1]).status_code == 200
+    assert put_chunk(chunks[0][0], chunks[0][1], sha256(b'x')).status_code == 400
+    response = client.post(f'{url}/finalize', json={})
+    assert response.status_code == 409
+    assert response.get_json()['missing'] == [[0, chunks[-1][0]]]
+
+    for start, end in client.get(url).get_json()['missing']:
+        assert put_chunk(start, DATA[start:end]).status_code == 200
+    response = client.post(f'{url}/finalize', json={'sha256': sha256(DATA)})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['status'] == 'success' and body['upload_id'] == upload['id']
+    assert client.get(url).status_code == 404
@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+import pytest
+import requests
+
+from parse_cache import ParseCache
+
+
+class Formatting:
+    """Stands in for the session ingestion posts to the formatting service with."""
+
+    def __init__(self, *answers):
+        # Status codes, or exceptions to raise, in turn; the last one repeats.
+        self.answers = list(answers)
+        self.posts = 0
+
+    def post(self, url, data=None, headers=None):
+        self.posts += 1
+        answer = self.answers.pop(0) if len(self.answers) > 1 else self.answers[0]
+        if isinstance(answer, Exception):
+            raise answer
+        response = requests.Response()
+        response.status_code = answer
+        response.headers['Retry-After'] = '0'
+        response._content = b'{"status": "ok"}'
+        return response
+
+
+@pytest.fixture
+def formatting(ingestion, monkeypatch):
+    monkeypatch.setattr(ingestion, 'SEND_RETRY_DELAY', 0)
+
+    def answering(*answers):
+        session = Formatting(*answers)
+        monkeypatch.setattr(ingestion, 'session', session)
+        return session
+    return answering
+
+
+def upload(ingestion, tmp_path):
+    """A CSV of its own content stored as an upload; returns (digest, path)."""
+    tmp = tmp_path / f'{uuid.uuid4().hex}.tmp'
+    pd.DataFrame({'name': ['Ada', 'Grace'], 'batch': [uuid.uuid4().hex] * 2}).to_csv(tmp, index=False)
+    return ingestion.store_upload(str(tmp), uuid.uuid4().hex, 'csv')
+
+
+def accept(ingestion, digest, path):
+    with ingestion.app.test_request_context():
+        response, status = ingestion.accept_upload('people.csv', digest, path, uuid.uuid4().hex, 0)
+    assert status == 200
+    return response.get_json()
+
+
+def test_send_gives_up_once_its_retries_are_used_up(ingestion, formatting):
+    session = formatting(429)
+    with pytest.raises(ingestion.SendFailed, match='429'):
+        ingestion.send_to_output_sink(pd.DataFrame({'name': ['Ada']}))
+    assert session.posts == ingestion.SEND_RETRIES + 1
+
+
+def test_send_retries_connection_errors_but_not_rejected_batches(ingestion, formatting):
+    session = formatting(requests.ConnectionError('down'), 429, 200)
+    ingestion.send_to_output_sink(pd.DataFrame({'name': ['Ada']}))
+    assert session.posts == 3
+
+    session = formatting(400)
+    with pytest.raises(ingestion.SendFailed, match='400'):
+        ingestion.send_to_output_sink(pd.DataFrame({'name': ['Ada']}))
+    assert session.posts == 1
+
+
+def test_an_upload_that_was_not_delivered_is_no_duplicate(ingestion, formatting, tmp_path):
+    digest, path = upload(ingestion, tmp_path)
+    first = accept(ingestion, digest, path)
+    formatting(503)
+    ingestion.process_file(path, name=first['name'], digest=digest, source={'filename': 'people.csv'})
+    assert ingestion.status_store.get(first['name']) == 'error'
+
+    second = accept(ingestion, digest, path)
+    assert 'duplicate_of' not in second
+    formatting(200)
+    ingestion.process_file(path, name=second['name'], digest=digest, source={'filename': 'people.csv'})
+    assert ingestion.status_store.get(second['name']) == 'processed'
+
+    assert accept(ingestion, digest, path)['duplicate_of'] == second['name']
+
+
+def test_uploads_an_earlier_run_did_not_finish_are_failed(ingestion, tmp_path):
+    digest, path = upload(ingestion, tmp_path)
+    first = accept(ingestion, digest, path)
+    assert ingestion.status_store.get(first['name']) == 'queued'
+    assert ingestion.status_store.fail_unfinished() >= 1
+    assert ingestion.status_store.get(first['name']) == 'error'
+    assert 'duplicate_of' not in accept(ingestion, digest, path)
+
+
+def test_of_identical_uploads_arriving_together_only_one_is_queued(ingestion, tmp_path, monkeypatch):
+    timed = ingestion.metrics.timed
+
+    def slow_status(stage, *args, **kwargs):
+        # Every status write waits a moment first, as if the database were busy.
+        if stage == 'status':
+            time.sleep(0.01)
+        return timed(stage, *args, **kwargs)
+
+    monkeypatch.setattr(ingestion.metrics, 'timed', slow_status)
+    digest, path = upload(ingestion, tmp_path)
+    start = threading.Barrier(8)
+    answers = []
+
+    def race():
+        start.wait()
+        answers.append(accept(ingestion, digest, path))
+
+    threads = [threading.Thread(target=race) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queued = [answer for answer in answers if 'duplicate_of' not in answer]
+    assert len(queued) == 1
+    assert all(answer['duplicate_of'] == queued[0]['name'] for answer in answers if answer is not queued[0])
+
+
+def test_parsed_chunks_are_only_cached_when_duplicates_are_resent(ingestion, formatting, tmp_path, monkeypatch):
+    assert ingestion.DUPLICATE_UPLOADS == 'skip' and ingestion.parse_cache is None
+
+    monkeypatch.setattr(ingestion, 'DUPLICATE_UPLOADS', 'resend')
+    monkeypatch.setattr(ingestion, 'parse_cache', ParseCache(str(tmp_path / 'cache')))
+    digest, path = upload(ingestion, tmp_path)
+    formatting(503)
+    ingestion.process_file(path, name='failed', digest=digest)
+    assert digest not in ingestion.parse_cache
+
+    session = formatting(200)
+    ingestion.process_file(path, name='sent', digest=digest)
+    assert digest in ingestion.parse_cache
+    os.remove(path)
+    # Sent again from the cache, without the upload.
+    ingestion.process_file(path, name='resent', digest=digest)
+    assert ingestion.status_store.get('resent') == 'processed'
+    assert session.posts == 2
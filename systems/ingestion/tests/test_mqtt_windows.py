@@ -0,0 +1,109 @@
+import json
+import threading
+import time
+
+from mqtt_windows import LocalBroker, WindowBatcher, topic_matches
+
+
+class Windows:
+    """Collects the windows a batcher hands over, and lets a test wait for them."""
+
+    def __init__(self):
+        self.windows = []
+        self.cond = threading.Condition()
+
+    def __call__(self, window):
+        with self.cond:
+            self.windows.append(window)
+            self.cond.notify_all()
+
+    def wait(self, count, timeout=5):
+        with self.cond:
+            assert self.cond.wait_for(lambda: len(self.windows) >= count, timeout)
+            return [window.records for window in self.windows]
+
+
+def connect(batcher, topic='sensors/#'):
+    broker = LocalBroker()
+    broker.on_connect = lambda client, userdata, flags, rc: client.subscribe(topic)
+    broker.on_message = lambda client, userdata, msg: batcher.add(msg.payload)
+    broker.connect()
+    return broker
+
+
+def test_windows_close_by_count():
+    windows = Windows()
+    batcher = WindowBatcher(windows, max_messages=3, max_age=60).start()
+    broker = connect(batcher)
+    try:
+        for i in range(7):
+            broker.publish('sensors/1', {'message_id': i, 'value': i})
+        assert windows.wait(2) == [[{'message_id': i, 'value': i} for i in range(3)],
+                                   [{'message_id': i, 'value': i} for i in range(3, 6)]]
+    finally:
+        batcher.stop()
+    # The last, partial window is handed over on shutdown.
+    assert windows.wait(3)[2] == [{'message_id': 6, 'value': 6}]
+
+
+def test_windows_close_by_time():
+    windows = Windows()
+    batcher = WindowBatcher(windows, max_messages=1000, max_age=0.05).start()
+    broker = connect(batcher)
+    try:
+        broker.publish('sensors/1', {'value': 1})
+        broker.publish('sensors/1', {'value': 2})
+        started = time.monotonic()
+        assert windows.wait(1) == [[{'value': 1}, {'value': 2}]]
+        assert time.monotonic() - started < 1
+    finally:
+        batcher.stop()
+    assert len(windows.windows) == 1
+
+
+def test_late_messages_go_to_the_next_window():
+    windows = Windows()
+    batcher = WindowBatcher(windows, max_messages=1000, max_age=0.05).start()
+    broker = connect(batcher)
+    try:
+        broker.publish('sensors/1', {'value': 1})
+        windows.wait(1)
+        # Arrives after its window was closed and handed over, so it is not lost with it.
+        broker.publish('sensors/1', {'value': 2})
+        assert windows.wait(2) == [[{'value': 1}], [{'value': 2}]]
+    finally:
+        batcher.stop()
+    assert [summary['count'] for summary in batcher.closed] == [1, 1]
+
+
+def test_flush_on_shutdown_without_the_batcher_thread_catching_up():
+    windows = Windows()
+    batcher = WindowBatcher(windows, max_messages=1000, max_age=60).start()
+    broker = connect(batcher)
+    broker.publish('sensors/1', json.dumps([{'value': 1}, {'value': 2}]))
+    assert windows.windows == []
+    batcher.stop()
+    assert windows.wait(1) == [[{'value': 1}, {'value': 2}]]
+    assert not batcher.thread.is_alive()
+
+
+def test_duplicates_invalid_payloads_and_other_topics_are_left_out():
+    windows = Windows()
+    batcher = WindowBatcher(windows, max_messages=1000, max_age=60, dedupe_size=2)
+    broker = connect(batcher, 'sensors/+/temperature')
+    broker.publish('sensors/1/temperature', {'message_id': 'a', 'value': 1})
+    broker.publish('sensors/1/temperature', {'message_id': 'a', 'value': 1})
+    broker.publish('sensors/1/temperature', b'not json')
+    broker.publish('sensors/1/humidity', {'message_id': 'b', 'value': 2})
+    batcher.flush()
+    assert windows.wait(1) == [[{'message_id': 'a', 'value': 1}]]
+    summary = batcher.closed[0]
+    assert (summary['count'], summary['duplicates'], summary['invalid']) == (1, 1, 1)
+    assert summary['fields']['value'] == {'count': 1, 'min': 1, 'max': 1, 'mean': 1.0}
+
+
+def test_topic_wildcards():
+    assert topic_matches('sensors/#', 'sensors/1/temperature')
+    assert topic_matches('sensors/+/temperature', 'sensors/1/temperature')
+    assert not topic_matches('sensors/+', 'sensors/1/temperature')
+    assert not topic_matches('sensors/1', 'sensors/2')
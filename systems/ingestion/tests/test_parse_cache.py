@@ -0,0 +1,44 @@
+import os
+
+import pandas as pd
+
+from parse_cache import ParseCache
+
+
+def cache_upload(cache, digest, chunks=3, rows=200):
+    writer = cache.writer(digest)
+    for i in range(chunks):
+        writer.write(pd.DataFrame({'value': range(i * rows, (i + 1) * rows)}), sheet=f'sheet {i}')
+    writer.commit()
+
+
+def test_entry_evicted_while_it_is_read_stays_until_the_reader_is_done(tmp_path):
+    cache = ParseCache(str(tmp_path), max_bytes=10 ** 9)
+    cache_upload(cache, 'first')
+    cache.max_bytes = cache.size + 1
+
+    chunks = cache.get('first')
+    sheet, frame = next(chunks)
+    assert (sheet, frame['value'].iat[0]) == ('sheet 0', 0)
+    cache_upload(cache, 'second')
+    assert 'first' not in cache and 'second' in cache
+    assert cache.get('first') is None
+
+    assert [sheet for sheet, _ in chunks] == ['sheet 1', 'sheet 2']
+    assert not os.path.exists(tmp_path / 'first')
+    assert os.path.exists(tmp_path / 'second')
+
+
+def test_closing_a_reader_early_removes_an_evicted_entry(tmp_path):
+    cache = ParseCache(str(tmp_path), max_bytes=10 ** 9)
+    cache_upload(cache, 'first')
+    cache.max_bytes = cache.size + 1
+    chunks = cache.get('first')
+    next(chunks)
+    cache_upload(cache, 'second')
+    # The same bytes parsed again while the evicted copy is still read are not cached twice.
+    cache_upload(cache, 'first')
+    assert 'first' not in cache
+    chunks.close()
+    assert not os.path.exists(tmp_path / 'first')
+    assert cache.readers == {}
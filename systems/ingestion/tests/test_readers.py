@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+import readers
+
+VALUES = [{"name": "Ada", "tags": ["a", "b"]}, 12345, "text with [brackets], and commas",
+          True, None, -0.5, {"nested": {"deep": [1, {"x": "}"}]}}]
+
+
+def write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 3, 5, 8, 13, 1 << 20])
+def test_values_straddling_blocks(tmp_path, block_size):
+    array = write(tmp_path, "array.json", json.dumps(VALUES))
+    lines = write(tmp_path, "lines.ndjson", "\n".join(json.dumps(value) for value in VALUES))
+    assert list(readers.iter_json_values(array, block_size)) == VALUES
+    assert list(readers.iter_json_values(lines, block_size)) == VALUES
+
+
+@pytest.mark.parametrize("block_size", [1, 4, 1 << 20])
+def test_whitespace_between_values(tmp_path, block_size):
+    array = write(tmp_path, "array.json", ' \n[ 1 ,\n\t2,\r\n  {"a": 3}  \n]\n\n')
+    lines = write(tmp_path, "lines.ndjson", '\n\n{"a": 1}\r\n   {"a": 2}\t{"a": 3}\n\n')
+    assert list(readers.iter_json_values(array, block_size)) == [1, 2, {"a": 3}]
+    assert list(readers.iter_json_values(lines, block_size)) == [{"a": 1}, {"a": 2}, {"a": 3}]
+
+
+def test_byte_order_mark_and_empty_files(tmp_path):
+    path = tmp_path / "bom.json"
+    path.write_bytes('﻿[{"a": 1}]'.encode("utf-8"))
+    assert list(readers.iter_json_values(str(path), 2)) == [{"a": 1}]
+    assert list(readers.iter_json_values(write(tmp_path, "empty.json", "  \n"))) == []
+    assert list(readers.iter_json_values(write(tmp_path, "empty_array.json", "[ ]"))) == []
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 1 << 20])
+@pytest.mark.parametrize("text", ['[{"a": 1}, {"a": 2', '{"a": 1}\n{"a": 2', '[1, "unterminated'])
+def test_truncated_trailing_value(tmp_path, block_size, text):
+    values = readers.iter_json_values(write(tmp_path, "truncated.json", text), block_size)
+    assert next(values) in ({"a": 1}, 1)
+    with pytest.raises(json.JSONDecodeError):
+        list(values)
+
+
+def test_array_and_ndjson_read_to_the_same_chunks(tmp_path):
+    records = [{"name": f"person {i}", "age": i} for i in range(7)]
+    array = write(tmp_path, "people.json", json.dumps(records))
+    lines = write(tmp_path, "people.ndjson", "\n".join(json.dumps(record) for record in records))
+    for path in (array, lines):
+        chunks = list(readers.read_chunks(path, chunk_rows=3))
+        assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+        assert [row for chunk in chunks for row in chunk.to_dict("records")] == records
+
+
+def test_lone_json_object_is_one_row_and_column_documents_are_read_by_column(tmp_path):
+    record = write(tmp_path, "record.json", '{"name": "Ada", "age": 36}')
+    assert [chunk.to_dict("records") for chunk in readers.read_chunks(record)] == [[{"name": "Ada", "age": 36}]]
+    columns = write(tmp_path, "columns.json", '{"name": {"0": "Ada", "1": "Grace"}, "age": {"0": 36, "1": 85}}')
+    (chunk,) = readers.read_chunks(columns)
+    assert chunk.to_dict("records") == [{"name": "Ada", "age": 36}, {"name": "Grace", "age": 85}]